@@ -0,0 +1,334 @@
+from collections import defaultdict
+from collections.abc import Iterable
+from functools import reduce
+import math
+import operator
+from django.db import transaction
+from django.db.models import Q
+from .models import (
+    Evaluation,
+    EvaluationAggregate,
+    Example,
+    LeaderboardRollup,
+    ModelScore,
+    RunningStatistics,
+)
+
+# Percentiles come from a log-bucketed histogram (as in DDSketch): every
+# value in a bucket is within SKETCH_ACCURACY of the bucket's value, so
+# percentiles are accurate to 1% relative error with O(log range) buckets
+SKETCH_ACCURACY = 0.01
+SKETCH_GAMMA = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+SKETCH_MIN_MAGNITUDE = 1e-9
+PERCENTILES = [50, 90, 99]
+
+STATISTICS_FIELDS = [
+    "count",
+    "total",
+    "total_squares",
+    "minimum",
+    "maximum",
+    "histogram",
+]
+
+
+def sketch_bucket(value: float) -> str:
+    if abs(value) < SKETCH_MIN_MAGNITUDE:
+        return "0"
+    index = math.ceil(math.log(abs(value), SKETCH_GAMMA))
+    return f"+{index}" if value > 0 else f"-{index}"
+
+
+def sketch_bucket_value(bucket: str) -> float:
+    if bucket == "0":
+        return 0.0
+    sign = 1 if bucket[0] == "+" else -1
+    index = int(bucket[1:])
+    return sign * 2 * SKETCH_GAMMA**index / (SKETCH_GAMMA + 1)
+
+
+class StatisticsDelta:
+    """Changes to a RunningStatistics row, accumulated in memory and
+    applied under a row lock. Values can be removed again (when a score is
+    overwritten), except from minimum and maximum, which only widen."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.total_squares = 0.0
+        self.minimum = None
+        self.maximum = None
+        self.histogram = defaultdict(int)
+
+    def add(self, value: float, sign: int = 1):
+        self.count += sign
+        self.total += sign * value
+        self.total_squares += sign * value * value
+        self.histogram[sketch_bucket(value)] += sign
+        if sign > 0:
+            self.minimum = value if self.minimum is None else min(self.minimum, value)
+            self.maximum = value if self.maximum is None else max(self.maximum, value)
+
+    def merge(self, stats: RunningStatistics):
+        self.count += stats.count
+        self.total += stats.total
+        self.total_squares += stats.total_squares
+        for value in (stats.minimum, stats.maximum):
+            if value is not None:
+                self.minimum = (
+                    value if self.minimum is None else min(self.minimum, value)
+                )
+                self.maximum = (
+                    value if self.maximum is None else max(self.maximum, value)
+                )
+        for bucket, count in stats.histogram.items():
+            self.histogram[bucket] += count
+
+    def apply(self, stats: RunningStatistics):
+        stats.count += self.count
+        stats.total += self.total
+        stats.total_squares += self.total_squares
+        if self.minimum is not None:
+            stats.minimum = (
+                self.minimum
+                if stats.minimum is None
+                else min(stats.minimum, self.minimum)
+            )
+        if self.maximum is not None:
+            stats.maximum = (
+                self.maximum
+                if stats.maximum is None
+                else max(stats.maximum, self.maximum)
+            )
+        histogram = dict(stats.histogram)
+        for bucket, count in self.histogram.items():
+            histogram[bucket] = histogram.get(bucket, 0) + count
+            if histogram[bucket] <= 0:
+                del histogram[bucket]
+        stats.histogram = histogram
+
+
+def summarize(stats: RunningStatistics) -> dict:
+    if stats.count <= 0:
+        return {"count": 0}
+
+    mean = stats.total / stats.count
+    variance = max(stats.total_squares / stats.count - mean * mean, 0.0)
+    summary = {
+        "count": stats.count,
+        "mean": mean,
+        "stddev": math.sqrt(variance),
+        "min": stats.minimum,
+        "max": stats.maximum,
+    }
+
+    buckets = sorted(stats.histogram.items(), key=lambda b: sketch_bucket_value(b[0]))
+    for percentile in PERCENTILES:
+        rank = percentile / 100 * (stats.count - 1)
+        seen = 0
+        for bucket, count in buckets:
+            seen += count
+            if seen > rank:
+                summary[f"p{percentile}"] = sketch_bucket_value(bucket)
+                break
+    return summary
+
+
+def image_predict_time(labels: dict) -> float | None:
+    """A generated image's prediction time, if it has a numeric one."""
+    value = labels.get("predict_time")
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    return None
+
+
+def image_groups(gen_model: str | None, labels: dict) -> list[tuple[str, str]]:
+    """The (group_key, group_value) pairs an image's values count towards.
+    Scalar labels are grouped by their string value, lists and objects are
+    not grouped."""
+    groups = [("", "")]
+    if gen_model:
+        groups.append(("gen_model", gen_model[:255]))
+    for key, value in labels.items():
+        # predict_time is a metric, not a grouping
+        if key == "predict_time" or not isinstance(value, (str, int, float, bool)):
+            continue
+        groups.append((f"label:{key}"[:255], str(value)[:255]))
+    return groups
+
+
+def update_aggregates(
+    evaluation: Evaluation,
+    observations: Iterable[tuple[str, float, str | None, dict, int]],
+):
+    """Add (metric, value, gen_model, labels, sign) observations to the
+    evaluation's aggregates and its API key's leaderboard. A sign of -1
+    removes a previously added value."""
+    deltas = observation_deltas(observations)
+    with transaction.atomic():
+        apply_deltas(EvaluationAggregate, {"evaluation": evaluation}, deltas)
+        if evaluation.hashed_api_key:
+            apply_deltas(
+                LeaderboardRollup,
+                {"hashed_api_key": evaluation.hashed_api_key},
+                {key: delta for key, delta in deltas.items() if key[1]},
+            )
+
+
+def observation_deltas(
+    observations: Iterable[tuple[str, float, str | None, dict, int]],
+) -> dict[tuple[str, str, str], StatisticsDelta]:
+    deltas = defaultdict(StatisticsDelta)
+    for metric, value, gen_model, labels, sign in observations:
+        for group_key, group_value in image_groups(gen_model, labels):
+            deltas[(metric, group_key, group_value)].add(value, sign)
+    return deltas
+
+
+def apply_deltas(
+    model: type[RunningStatistics],
+    scope: dict,
+    deltas: dict[tuple[str, str, str], StatisticsDelta],
+):
+    """Apply deltas keyed on (metric, group_key, group_value) to the rows of
+    a statistics table within scope, creating missing rows."""
+    if not deltas:
+        return
+
+    keys = sorted(deltas)
+    with transaction.atomic():
+        # Create missing rows, then lock only those in a consistent order
+        model.objects.bulk_create(
+            [
+                model(
+                    **scope,
+                    metric=metric,
+                    group_key=group_key,
+                    group_value=group_value,
+                )
+                for metric, group_key, group_value in keys
+            ],
+            ignore_conflicts=True,
+        )
+        groups = reduce(
+            operator.or_,
+            (
+                Q(metric=metric, group_key=group_key, group_value=group_value)
+                for metric, group_key, group_value in keys
+            ),
+        )
+        rows = (
+            model.objects.select_for_update()
+            .filter(groups, **scope)
+            .order_by("metric", "group_key", "group_value")
+        )
+
+        changed = []
+        for row in rows:
+            delta = deltas.get((row.metric, row.group_key, row.group_value))
+            if delta:
+                delta.apply(row)
+                changed.append(row)
+        model.objects.bulk_update(changed, STATISTICS_FIELDS)
+
+
+def evaluation_summary(evaluation: Evaluation) -> dict:
+    """Per metric: statistics over all images, per gen_model and per label
+    value. Reads one row per group, whatever the evaluation's size."""
+    metrics = {}
+    for aggregate in evaluation.aggregates.order_by(
+        "metric", "group_key", "group_value"
+    ):
+        metric = metrics.setdefault(
+            aggregate.metric, {"all": None, "gen_model": {}, "labels": {}}
+        )
+        summary = summarize(aggregate)
+        if aggregate.group_key == "":
+            metric["all"] = summary
+        elif aggregate.group_key == "gen_model":
+            metric["gen_model"][aggregate.group_value] = summary
+        else:
+            label = aggregate.group_key.removeprefix("label:")
+            metric["labels"].setdefault(label, {})[aggregate.group_value] = summary
+    return metrics
+
+
+def rebuild_aggregates(evaluation: Evaluation):
+    """Recompute an evaluation's aggregates from its scores and images.
+    Its API key's leaderboard needs rebuild_leaderboard afterwards."""
+
+    def observations():
+        scores = (
+            ModelScore.objects.filter(evaluation=evaluation)
+            .values_list("model", "score", "example__gen_model", "example__labels")
+            .iterator(chunk_size=2000)
+        )
+        for model, score, gen_model, labels in scores:
+            yield model, score, gen_model, labels, 1
+
+        # Only generated images have a predict_time, as in record_predict_time
+        examples = (
+            Example.objects.filter(row__evaluation=evaluation)
+            .exclude(image_url=None)
+            .exclude(gen_prediction_id=None)
+            .values_list("gen_model", "labels")
+            .iterator(chunk_size=2000)
+        )
+        for gen_model, labels in examples:
+            value = image_predict_time(labels)
+            if value is not None:
+                yield "predict_time", value, gen_model, labels, 1
+
+    with transaction.atomic():
+        evaluation.aggregates.all().delete()
+        apply_deltas(
+            EvaluationAggregate,
+            {"evaluation": evaluation},
+            observation_deltas(observations()),
+        )
+
+
+def rebuild_leaderboard(hashed_api_key: str):
+    """Recompute an API key's leaderboard by merging the aggregates of its
+    evaluations, e.g. after evaluations were deleted."""
+    deltas = defaultdict(StatisticsDelta)
+    aggregates = EvaluationAggregate.objects.filter(
+        evaluation__hashed_api_key=hashed_api_key
+    ).exclude(group_key="")
+    for aggregate in aggregates.iterator(chunk_size=2000):
+        deltas[(aggregate.metric, aggregate.group_key, aggregate.group_value)].merge(
+            aggregate
+        )
+
+    with transaction.atomic():
+        LeaderboardRollup.objects.filter(hashed_api_key=hashed_api_key).delete()
+        apply_deltas(LeaderboardRollup, {"hashed_api_key": hashed_api_key}, deltas)
+
+
+def leaderboard(
+    hashed_api_key: str,
+    group_key: str = "gen_model",
+    metric: str | None = None,
+    ascending: bool = False,
+    min_count: int = 1,
+) -> dict[str, list[dict]]:
+    """Per metric, the group values of group_key ranked by mean score.
+    Groups whose scores have all been removed again are left out."""
+    rollups = LeaderboardRollup.objects.filter(
+        hashed_api_key=hashed_api_key,
+        group_key=group_key,
+        count__gte=max(min_count, 1),
+    )
+    if metric:
+        rollups = rollups.filter(metric=metric)
+
+    rankings = defaultdict(list)
+    for rollup in rollups:
+        rankings[rollup.metric].append(
+            {"value": rollup.group_value, **summarize(rollup)}
+        )
+    for entries in rankings.values():
+        entries.sort(key=lambda entry: entry["mean"], reverse=not ascending)
+        for rank, entry in enumerate(entries, start=1):
+            entry["rank"] = rank
+    return dict(rankings)
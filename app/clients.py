@@ -0,0 +1,50 @@
+from collections import OrderedDict
+import threading
+import httpx
+from django.conf import settings
+import replicate
+from .encryption import decrypt_key, hash_api_key
+
+# Process-local LRU of hashed API key -> Replicate client, so that tasks for
+# the same key reuse its pooled keep-alive connections
+_clients: OrderedDict[str, replicate.Client] = OrderedDict()
+_clients_lock = threading.Lock()
+
+
+def get_client(api_key: str) -> replicate.Client:
+    """The worker's shared Replicate client for an encrypted API key.
+
+    Clients are thread-safe, and each keeps up to REPLICATE_POOL_SIZE
+    connections alive for REPLICATE_KEEPALIVE_EXPIRY seconds. The least
+    recently used client is dropped once there are REPLICATE_CLIENT_CACHE_SIZE.
+    """
+    key = hash_api_key(api_key)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is not None:
+            _clients.move_to_end(key)
+            return client
+
+        client = new_client(decrypt_key(api_key))
+        _clients[key] = client
+        if len(_clients) > settings.REPLICATE_CLIENT_CACHE_SIZE:
+            # Not closed, since another thread may still be using it. Its
+            # connections are closed when it is garbage collected.
+            _clients.popitem(last=False)
+        return client
+
+
+def new_client(api_token: str) -> replicate.Client:
+    limits = httpx.Limits(
+        max_connections=settings.REPLICATE_POOL_SIZE,
+        max_keepalive_connections=settings.REPLICATE_POOL_SIZE,
+        keepalive_expiry=settings.REPLICATE_KEEPALIVE_EXPIRY,
+    )
+    return replicate.Client(
+        api_token=api_token, transport=httpx.HTTPTransport(limits=limits)
+    )
+
+
+def clear_clients():
+    with _clients_lock:
+        _clients.clear()
@@ -1,25 +1,42 @@
-import json
+from collections.abc import Iterable, Iterator
+import pydantic
 from .schemas import RowData
 
 
-def load_input_data(file_content: bytes) -> list[dict]:
-    data = []
-    for line in file_content.decode("utf-8").splitlines():
-        if line.strip():  # Skip empty lines
+class InputDataError(ValueError):
+    def __init__(self, line_number: int, message: str):
+        super().__init__(f"Line {line_number}: {message}")
+        self.line_number = line_number
+
+
+def load_input_data(lines: Iterable[bytes | str]) -> Iterator[RowData]:
+    """Validate JSONL input one line at a time.
+
+    Raises InputDataError with the 1-based line number of the first bad
+    line; rows yielded before it are valid and may already be stored.
+    """
+    has_prompt = None
+    for line_number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
             try:
-                row = json.loads(line)
-                validated_row = RowData.model_validate(row).model_dump()
-                data.append(validated_row)
-            except json.JSONDecodeError as e:
-                raise ValueError(f"Invalid JSON in line: {line}") from e
-            except ValueError as e:
-                raise ValueError(
-                    f"Validation error in line: {line}. Error: {str(e)}"
-                ) from e
-
-    # Additional validation: Check if all rows consistently have or don't have a prompt
-    has_prompt = [bool(row["prompt"]) for row in data]
-    if not all(has_prompt) and not all(not p for p in has_prompt):
-        raise ValueError("All rows must either have a prompt or no prompt")
-
-    return data
+                line = line.decode("utf-8")
+            except UnicodeDecodeError as e:
+                raise InputDataError(line_number, "Invalid UTF-8") from e
+
+        if not line.strip():  # Skip empty lines
+            continue
+
+        try:
+            row = RowData.model_validate_json(line)
+        except pydantic.ValidationError as e:
+            raise InputDataError(line_number, f"Validation error: {e}") from e
+
+        # All rows must consistently have or not have a prompt
+        if has_prompt is None:
+            has_prompt = bool(row.prompt)
+        elif has_prompt != bool(row.prompt):
+            raise InputDataError(
+                line_number, "All rows must either have a prompt or no prompt"
+            )
+
+        yield row
@@ -1,3 +1,4 @@
+import hashlib
 from django.core.signing import Signer
 
 signer = Signer()
@@ -9,3 +10,7 @@ def encrypt_key(key: str) -> str:
 
 def decrypt_key(encrypted_key: str) -> str:
     return signer.unsign(encrypted_key)
+
+
+def hash_api_key(encrypted_key: str) -> str:
+    return hashlib.sha256(encrypted_key.encode()).hexdigest()
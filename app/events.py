@@ -0,0 +1,131 @@
+import asyncio
+from collections import defaultdict
+import json
+import weakref
+import redis.asyncio
+from django.conf import settings
+from django.db import transaction
+from .models import Evaluation
+from .redis_client import get_redis
+from .results import serialize_changed_rows, evaluation_completed
+from .results_cache import invalidate_results_on_commit
+
+
+def results_channel(eval_id: str) -> str:
+    return f"results:{eval_id}"
+
+
+def publish_rows(evaluation: Evaluation, row_ids: list[int]):
+    """Push the given rows to viewers of the evaluation's event stream, and
+    invalidate its cached results, once the current transaction commits.
+    Failures are logged rather than raised, since the stream is
+    best-effort and viewers can resync."""
+    row_ids = list(row_ids)
+    invalidate_results_on_commit(evaluation.eval_id)
+    transaction.on_commit(lambda: publish_rows_now(evaluation, row_ids), robust=True)
+
+
+def publish_rows_now(evaluation: Evaluation, row_ids: list[int]):
+    channel = results_channel(evaluation.eval_id)
+    redis_client = get_redis()
+
+    # Skip serializing when nobody is watching
+    [(_, num_subscribers)] = redis_client.pubsub_numsub(channel)
+    if not num_subscribers:
+        return
+
+    message = {
+        "rows": serialize_changed_rows(evaluation, row_ids),
+        "enabled_models": evaluation.enabled_models,
+        "completed": evaluation_completed(evaluation),
+        "title": evaluation.title,
+        "delta": True,
+    }
+    redis_client.publish(channel, json.dumps(message))
+
+
+class ResultsBroadcaster:
+    """Fans out one Redis subscription per evaluation to all of a process's
+    viewers of that evaluation."""
+
+    def __init__(self):
+        self.redis = redis.asyncio.Redis.from_url(settings.REDIS_URL)
+        self.pubsub = self.redis.pubsub()
+        self.queues = defaultdict(set)
+        self.lock = asyncio.Lock()
+        self.reader = None
+
+    async def subscribe(self, eval_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=settings.RESULTS_EVENTS_QUEUE_SIZE)
+        async with self.lock:
+            if not self.queues[eval_id]:
+                await self.pubsub.subscribe(results_channel(eval_id))
+            self.queues[eval_id].add(queue)
+            if self.reader is None or self.reader.done():
+                self.reader = asyncio.create_task(self.read())
+        return queue
+
+    async def unsubscribe(self, eval_id: str, queue: asyncio.Queue):
+        async with self.lock:
+            self.queues[eval_id].discard(queue)
+            if not self.queues[eval_id]:
+                del self.queues[eval_id]
+                await self.pubsub.unsubscribe(results_channel(eval_id))
+
+    async def read(self):
+        while self.queues:
+            message = await self.pubsub.get_message(
+                ignore_subscribe_messages=True, timeout=1.0
+            )
+            if message is None:
+                continue
+
+            eval_id = message["channel"].decode().removeprefix("results:")
+            data = message["data"].decode()
+            completed = json.loads(data)["completed"]
+            for queue in self.queues.get(eval_id, ()):
+                try:
+                    queue.put_nowait((data, completed))
+                except asyncio.QueueFull:
+                    # The viewer fell behind, so have it refetch instead
+                    while not queue.empty():
+                        queue.get_nowait()
+                    queue.put_nowait((None, completed))
+
+
+# Keyed by event loop, since the broadcaster's connection belongs to one
+_broadcasters = weakref.WeakKeyDictionary()
+
+
+def get_broadcaster() -> ResultsBroadcaster:
+    loop = asyncio.get_running_loop()
+    if loop not in _broadcasters:
+        _broadcasters[loop] = ResultsBroadcaster()
+    return _broadcasters[loop]
+
+
+async def stream_results(eval_id: str):
+    """Server-sent events for an evaluation: a 'message' with changed rows
+    for every update, and 'resync' when the viewer missed updates and
+    should fetch a delta from the results API."""
+    broadcaster = get_broadcaster()
+    queue = await broadcaster.subscribe(eval_id)
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            try:
+                data, completed = await asyncio.wait_for(
+                    queue.get(), timeout=settings.RESULTS_EVENTS_KEEPALIVE
+                )
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+
+            if data is None:
+                yield "event: resync\ndata: {}\n\n"
+            else:
+                yield f"data: {data}\n\n"
+            if completed:
+                break
+    finally:
+        await broadcaster.unsubscribe(eval_id, queue)
@@ -0,0 +1,190 @@
+import csv
+import io
+import json
+from collections.abc import AsyncIterator, Iterator
+from itertools import islice
+from asgiref.sync import sync_to_async
+import pyarrow
+import pyarrow.parquet
+from .models import Evaluation, Example, ModelScore
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# Images per database round trip, and per chunk of output
+EXPORT_BATCH_SIZE = 2000
+
+IMAGE_FIELDS = [
+    "row_id",
+    "prompt",
+    "seed",
+    "image_id",
+    "image_url",
+    "gen_model",
+    "gen_prediction_id",
+    "gen_prediction_failed",
+    "labels",
+]
+
+
+def export_batches(evaluation: Evaluation) -> Iterator[list[dict]]:
+    """An evaluation's images with their rows' prompts and their scores, in
+    batches of EXPORT_BATCH_SIZE read through a server-side cursor."""
+    examples = (
+        Example.objects.filter(row__evaluation=evaluation)
+        .order_by("row_id", "id")
+        .values_list(
+            "id",
+            "row_id",
+            "row__prompt",
+            "row__seed",
+            "image_url",
+            "gen_model",
+            "gen_prediction_id",
+            "gen_prediction_failed",
+            "labels",
+        )
+        .iterator(chunk_size=EXPORT_BATCH_SIZE)
+    )
+
+    # DreamSim scores count against the row's first example, as in the
+    # results API
+    row_id = reference_id = None
+    while batch := list(islice(examples, EXPORT_BATCH_SIZE)):
+        scores = {}
+        for example_id, model, score, ref_example_id in ModelScore.objects.filter(
+            example_id__in=[example[0] for example in batch]
+        ).values_list("example_id", "model", "score", "ref_example_id"):
+            scores.setdefault(example_id, {})[model] = (score, ref_example_id)
+
+        records = []
+        for (
+            example_id,
+            example_row_id,
+            prompt,
+            seed,
+            image_url,
+            gen_model,
+            gen_prediction_id,
+            gen_prediction_failed,
+            labels,
+        ) in batch:
+            if example_row_id != row_id:
+                row_id, reference_id = example_row_id, example_id
+
+            record = {
+                "row_id": row_id,
+                "prompt": prompt,
+                "seed": seed,
+                "image_id": example_id,
+                "image_url": image_url,
+                "gen_model": gen_model,
+                "gen_prediction_id": gen_prediction_id,
+                "gen_prediction_failed": gen_prediction_failed,
+                "labels": labels,
+            }
+            for model in evaluation.enabled_models:
+                score, ref_example_id = scores.get(example_id, {}).get(
+                    model, (None, None)
+                )
+                if model == "DreamSim" and ref_example_id != reference_id:
+                    score = None
+                record[model] = score
+            records.append(record)
+        yield records
+
+
+def export_csv(evaluation: Evaluation) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(IMAGE_FIELDS + evaluation.enabled_models)
+    for records in export_batches(evaluation):
+        for record in records:
+            writer.writerow(
+                [
+                    *(record[field] for field in IMAGE_FIELDS[:-1]),
+                    json.dumps(record["labels"]),
+                    *(record[model] for model in evaluation.enabled_models),
+                ]
+            )
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+def export_jsonl(evaluation: Evaluation) -> Iterator[bytes]:
+    for records in export_batches(evaluation):
+        lines = []
+        for record in records:
+            scores = {model: record.pop(model) for model in evaluation.enabled_models}
+            lines.append(json.dumps({**record, "scores": scores}) + "\n")
+        yield "".join(lines).encode()
+
+
+class ChunkSink(io.RawIOBase):
+    """A write-only file that hands out what has been written so far."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def export_parquet(evaluation: Evaluation) -> Iterator[bytes]:
+    """One row group per batch, so only one batch is ever held in memory."""
+    schema = pyarrow.schema(
+        [
+            ("row_id", pyarrow.int64()),
+            ("prompt", pyarrow.string()),
+            ("seed", pyarrow.int64()),
+            ("image_id", pyarrow.int64()),
+            ("image_url", pyarrow.string()),
+            ("gen_model", pyarrow.string()),
+            ("gen_prediction_id", pyarrow.string()),
+            ("gen_prediction_failed", pyarrow.bool_()),
+            ("labels", pyarrow.string()),  # JSON, since labels vary by image
+            *((model, pyarrow.float64()) for model in evaluation.enabled_models),
+        ]
+    )
+    sink = ChunkSink()
+    with pyarrow.parquet.ParquetWriter(sink, schema) as writer:
+        for records in export_batches(evaluation):
+            for record in records:
+                record["labels"] = json.dumps(record["labels"])
+            writer.write_table(pyarrow.Table.from_pylist(records, schema=schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+def export_chunks(evaluation: Evaluation, export_format: str) -> Iterator[bytes]:
+    exporters = {"csv": export_csv, "jsonl": export_jsonl, "parquet": export_parquet}
+    return exporters[export_format](evaluation)
+
+
+async def aexport_chunks(
+    evaluation: Evaluation, export_format: str
+) -> AsyncIterator[bytes]:
+    """export_chunks for ASGI responses, which would otherwise read a
+    synchronous iterator into memory in full before sending it. Every
+    chunk is read in the request's thread, which keeps the server-side
+    cursor on one connection."""
+    chunks = export_chunks(evaluation, export_format)
+    try:
+        while (chunk := await sync_to_async(next)(chunks, None)) is not None:
+            yield chunk
+    finally:
+        await sync_to_async(chunks.close)()
@@ -0,0 +1,110 @@
+import random
+from collections import defaultdict
+from django.conf import settings
+from django.db import transaction
+from . import schemas
+from .models import Evaluation, Row, Example
+from .progress import update_progress
+from .scheduler import schedule
+from .tasks import CHUNK_SIZE, evaluate_chunk, generate_images
+
+INSERT_BATCH_SIZE = 1000
+
+
+def ingest_images(
+    api_key: str, evaluation: Evaluation, input_data: list[schemas.RowData]
+) -> list[int]:
+    """Bulk insert rows of existing images and evaluate them once committed.
+
+    Must be called inside a transaction; evaluate_chunk is only dispatched
+    after that transaction commits, so workers never see half-written rows.
+    """
+    rows = create_rows(evaluation, input_data, status=Row.GENERATED)
+
+    examples = [
+        Example(row=row, image_url=image_data.url, labels=image_data.labels)
+        for row, row_data in zip(rows, input_data)
+        for image_data in row_data.images
+    ]
+    Example.objects.bulk_create(examples, batch_size=INSERT_BATCH_SIZE)
+    update_progress(
+        evaluation,
+        num_rows=len(rows),
+        num_examples=len(examples),
+        num_generated=sum(1 for example in examples if example.image_url),
+    )
+
+    row_ids = [row.id for row in rows]
+    eval_id = evaluation.eval_id
+    transaction.on_commit(lambda: dispatch_evaluate_chunks(api_key, eval_id, row_ids))
+    return row_ids
+
+
+def ingest_generations(
+    api_key: str, evaluation: Evaluation, input_rows: list[schemas.Row]
+) -> list[int]:
+    """Bulk insert rows of examples to generate and start generating them
+    once committed. Must be called inside a transaction."""
+    rows = create_rows(evaluation, input_rows)
+
+    examples = []
+    generations = []
+    for row, row_data in zip(rows, input_rows):
+        for example_data in row_data.examples:
+            labels = {k: v for k, v in example_data.inputs.items()}  # clone
+            examples.append(
+                Example(row=row, labels=labels, gen_model=example_data.model)
+            )
+
+            inputs = {k: v for k, v in example_data.inputs.items()}
+            inputs[example_data.prompt_input] = row_data.prompt
+            inputs[example_data.seed_input] = row.seed
+            generations.append((example_data.model, inputs))
+
+    Example.objects.bulk_create(examples, batch_size=INSERT_BATCH_SIZE)
+    update_progress(evaluation, num_rows=len(rows), num_examples=len(examples))
+
+    jobs = [
+        (example.id, model, inputs)
+        for example, (model, inputs) in zip(examples, generations)
+    ]
+    eval_id = evaluation.eval_id
+    transaction.on_commit(lambda: dispatch_generations(api_key, eval_id, jobs))
+    return [row.id for row in rows]
+
+
+def create_rows(
+    evaluation: Evaluation,
+    input_rows: list[schemas.RowData] | list[schemas.Row],
+    status: str = Row.PENDING,
+) -> list[Row]:
+    rows = [
+        Row(
+            evaluation=evaluation,
+            prompt=row_data.prompt,
+            seed=row_data.seed or random.randint(0, 1000000),
+            status=status,
+        )
+        for row_data in input_rows
+    ]
+    # On Postgres bulk_create sets the primary keys on the returned objects
+    return Row.objects.bulk_create(rows, batch_size=INSERT_BATCH_SIZE)
+
+
+def dispatch_evaluate_chunks(api_key: str, eval_id: str, row_ids: list[int]):
+    chunks = [row_ids[i : i + CHUNK_SIZE] for i in range(0, len(row_ids), CHUNK_SIZE)]
+    schedule(eval_id, evaluate_chunk, [[api_key, eval_id, chunk] for chunk in chunks])
+
+
+def dispatch_generations(api_key: str, eval_id: str, jobs: list[tuple[int, str, dict]]):
+    """One generate_images task per GENERATE_BATCH_SIZE examples of a model."""
+    jobs_by_model = defaultdict(list)
+    for example_id, model, inputs in jobs:
+        jobs_by_model[model].append((example_id, inputs))
+
+    batches = []
+    for model, model_jobs in jobs_by_model.items():
+        for i in range(0, len(model_jobs), settings.GENERATE_BATCH_SIZE):
+            batch = model_jobs[i : i + settings.GENERATE_BATCH_SIZE]
+            batches.append([api_key, eval_id, model, batch])
+    schedule(eval_id, generate_images, batches)
@@ -0,0 +1,113 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import ssl
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from django.core.management.base import BaseCommand
+from app.clients import clear_clients, get_client
+from app.encryption import decrypt_key, encrypt_key
+import replicate
+
+PREDICTION = {
+    "id": "benchmark",
+    "model": "owner/model",
+    "version": "v",
+    "status": "starting",
+    "input": {},
+    "logs": "",
+    "urls": {},
+    "created_at": "2024-01-01T00:00:00Z",
+}
+
+
+class ReplicateHandler(BaseHTTPRequestHandler):
+    """Answers prediction creates and gets, over keep-alive connections."""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.respond()
+
+    def do_GET(self):
+        self.respond()
+
+    def respond(self):
+        body = json.dumps(PREDICTION).encode()
+        self.send_response(201 if self.command == "POST" else 200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark tasks that create and get a prediction against a local fake "
+        "Replicate API over TLS, with a fresh client per task or with the "
+        "shared per-API-key clients."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tasks", type=int, default=200)
+        parser.add_argument("--keys", type=int, default=4)
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as tmp:
+            cert, key = os.path.join(tmp, "cert.pem"), os.path.join(tmp, "key.pem")
+            subprocess.run(
+                [
+                    "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+                    "-keyout", key, "-out", cert, "-days", "1",
+                    "-subj", "/CN=localhost",
+                    "-addext", "subjectAltName=IP:127.0.0.1",
+                ],
+                check=True,
+                capture_output=True,
+            )  # fmt: skip
+            server = ThreadingHTTPServer(("127.0.0.1", 0), ReplicateHandler)
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(cert, key)
+            server.socket = context.wrap_socket(server.socket, server_side=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+            os.environ["SSL_CERT_FILE"] = cert
+            os.environ["REPLICATE_BASE_URL"] = f"https://127.0.0.1:{server.server_port}"
+            api_keys = [encrypt_key(f"token-{i}") for i in range(options["keys"])]
+
+            for name, client_for in [
+                ("fresh client per task", fresh_client),
+                ("shared client per key", get_client),
+            ]:
+                clear_clients()
+                latencies = []
+                for i in range(options["tasks"]):
+                    api_key = api_keys[i % len(api_keys)]
+                    start = time.perf_counter()
+                    client = client_for(api_key)
+                    prediction = client.predictions.create(version="v", input={})
+                    client.predictions.get(prediction.id)
+                    latencies.append(time.perf_counter() - start)
+
+                latencies.sort()
+                self.stdout.write(
+                    f"{name}: {options['tasks']} tasks in {sum(latencies):.2f}s, "
+                    f"mean {statistics.mean(latencies) * 1000:.1f} ms, "
+                    f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f} ms"
+                )
+
+            server.shutdown()
+            clear_clients()
+
+
+def fresh_client(api_key: str) -> replicate.Client:
+    """What every task used to do."""
+    return replicate.Client(api_token=decrypt_key(api_key))
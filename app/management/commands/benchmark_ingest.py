@@ -0,0 +1,51 @@
+import time
+import uuid
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from app.ingest import ingest_images
+from app.models import Evaluation
+from app.schemas import RowData, ImageData
+
+
+class Command(BaseCommand):
+    help = "Benchmark bulk ingestion of evaluate-images rows (rolled back, nothing is dispatched)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rows", type=int, nargs="+", default=[1_000, 10_000, 100_000]
+        )
+        parser.add_argument("--images-per-row", type=int, default=4)
+
+    def handle(self, *args, **options):
+        for num_rows in options["rows"]:
+            input_data = [
+                RowData(
+                    prompt=f"benchmark prompt {i}",
+                    images=[
+                        ImageData(
+                            url=f"https://example.com/{i}/{j}.png",
+                            labels={"model": f"model-{j}"},
+                        )
+                        for j in range(options["images_per_row"])
+                    ],
+                )
+                for i in range(num_rows)
+            ]
+
+            with transaction.atomic():
+                start = time.perf_counter()
+                evaluation = Evaluation.objects.create(
+                    eval_id=str(uuid.uuid4()),
+                    title="benchmark",
+                    enabled_models=["CLIP"],
+                    hashed_api_key="",
+                )
+                ingest_images("", evaluation, input_data)
+                elapsed = time.perf_counter() - start
+
+                # Roll back so the on_commit fan-out never runs
+                transaction.set_rollback(True)
+
+            self.stdout.write(
+                f"{num_rows:>8} rows: {elapsed:8.2f}s, {num_rows / elapsed:10.0f} rows/sec"
+            )
@@ -0,0 +1,104 @@
+import gzip
+import json
+import random
+import time
+import uuid
+import brotli
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+from app.ingest import ingest_images
+from app.middleware import BROTLI_QUALITY
+from app.models import Evaluation
+from app.schemas import RowData, ImageData
+from app.tasks import CHUNK_SIZE, save_model_score
+from app.views import api_results
+
+FLASH_EVAL_MODELS = ["ImageReward", "Aesthetic", "CLIP", "BLIP", "PickScore"]
+
+
+class Command(BaseCommand):
+    help = "Benchmark payload size and parse time of the rows and columnar results formats (rolled back)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--images", type=int, nargs="+", default=[10_000, 100_000])
+        parser.add_argument("--images-per-row", type=int, default=4)
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **options):
+        images_per_row = options["images_per_row"]
+        for num_images in options["images"]:
+            num_rows = num_images // images_per_row
+            input_data = [
+                RowData(
+                    prompt=f"benchmark prompt {i}",
+                    images=[
+                        ImageData(
+                            url=f"https://example.com/{i}/{j}.png",
+                            labels={
+                                "sampler": ["ddim", "euler"][j % 2],
+                                "predict_time": random.uniform(1, 10),
+                            },
+                        )
+                        for j in range(images_per_row)
+                    ],
+                )
+                for i in range(num_rows)
+            ]
+            outputs = [
+                {
+                    "prompt": row.prompt,
+                    "scores": {
+                        image.url: {
+                            model: random.random() for model in FLASH_EVAL_MODELS
+                        }
+                        for image in row.images
+                    },
+                }
+                for row in input_data
+            ]
+
+            with transaction.atomic():
+                evaluation = Evaluation.objects.create(
+                    eval_id=str(uuid.uuid4()),
+                    title="benchmark",
+                    enabled_models=FLASH_EVAL_MODELS,
+                    hashed_api_key="",
+                )
+                row_ids = ingest_images("", evaluation, input_data)
+                for i in range(0, num_rows, CHUNK_SIZE):
+                    save_model_score(
+                        evaluation,
+                        outputs[i : i + CHUNK_SIZE],
+                        "FlashEval",
+                        row_ids[i : i + CHUNK_SIZE],
+                    )
+
+                for response_format in ["rows", "columnar"]:
+                    self.benchmark(evaluation, response_format, num_images, options)
+
+                # Roll back so the on_commit fan-out never runs
+                transaction.set_rollback(True)
+
+    def benchmark(self, evaluation, response_format, num_images, options):
+        request = RequestFactory().get(
+            f"/api/results/{evaluation.eval_id}/", {"format": response_format}
+        )
+
+        start = time.perf_counter()
+        content = api_results(request, evaluation.eval_id).content
+        serialize_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(options["repeat"]):
+            json.loads(content)
+        parse_time = (time.perf_counter() - start) / options["repeat"]
+
+        gzip_size = len(gzip.compress(content, compresslevel=6))
+        brotli_size = len(brotli.compress(content, quality=BROTLI_QUALITY))
+        self.stdout.write(
+            f"{num_images:>8} images, {response_format:>8}: "
+            f"{len(content) / 1e6:7.2f} MB raw, {gzip_size / 1e6:6.2f} MB gzip, "
+            f"{brotli_size / 1e6:6.2f} MB brotli, "
+            f"serialize {serialize_time:6.2f}s, parse {parse_time * 1000:7.1f}ms"
+        )
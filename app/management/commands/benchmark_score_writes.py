@@ -0,0 +1,100 @@
+import time
+import uuid
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from app.ingest import ingest_images
+from app.models import Evaluation, Example, ModelScore
+from app.schemas import RowData, ImageData
+from app.tasks import CHUNK_SIZE, save_model_score
+
+FLASH_EVAL_MODELS = ["ImageReward", "Aesthetic", "CLIP", "BLIP", "PickScore"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark writing FlashEval chunk outputs with save_model_score (rolled back)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, nargs="+", default=[100, 1_000, 10_000])
+        parser.add_argument("--images-per-row", type=int, default=4)
+        parser.add_argument(
+            "--per-row",
+            action="store_true",
+            help="Also time one INSERT per score, for comparison",
+        )
+
+    def handle(self, *args, **options):
+        for num_rows in options["rows"]:
+            input_data = [
+                RowData(
+                    prompt=f"benchmark prompt {i}",
+                    images=[
+                        ImageData(url=f"https://example.com/{i}/{j}.png")
+                        for j in range(options["images_per_row"])
+                    ],
+                )
+                for i in range(num_rows)
+            ]
+            outputs = [
+                {
+                    "prompt": row.prompt,
+                    "scores": {
+                        image.url: {model: 0.5 for model in FLASH_EVAL_MODELS}
+                        for image in row.images
+                    },
+                }
+                for row in input_data
+            ]
+            num_scores = num_rows * options["images_per_row"] * len(FLASH_EVAL_MODELS)
+
+            writers = [("bulk upsert", save_model_score)]
+            if options["per_row"]:
+                writers.append(("per-row", save_model_score_per_row))
+
+            for name, write in writers:
+                with transaction.atomic():
+                    evaluation = Evaluation.objects.create(
+                        eval_id=str(uuid.uuid4()),
+                        title="benchmark",
+                        enabled_models=FLASH_EVAL_MODELS,
+                        hashed_api_key="",
+                    )
+                    row_ids = ingest_images("", evaluation, input_data)
+
+                    # One save per chunk, as complete_prediction does
+                    start = time.perf_counter()
+                    for i in range(0, num_rows, CHUNK_SIZE):
+                        write(
+                            evaluation,
+                            outputs[i : i + CHUNK_SIZE],
+                            "FlashEval",
+                            row_ids[i : i + CHUNK_SIZE],
+                        )
+                    elapsed = time.perf_counter() - start
+
+                    # Roll back so the on_commit fan-out never runs
+                    transaction.set_rollback(True)
+
+                self.stdout.write(
+                    f"{num_rows:>8} rows, {num_scores:>8} scores, {name:>11}: "
+                    f"{elapsed:8.2f}s, {num_scores / elapsed:10.0f} scores/sec"
+                )
+
+
+def save_model_score_per_row(evaluation, output, model_type, row_ids):
+    """One INSERT per score, as save_model_score used to do, for comparison."""
+    example_ids = dict(
+        Example.objects.filter(row_id__in=row_ids).values_list("image_url", "id")
+    )
+    for record in output:
+        for image_url, model_scores in record["scores"].items():
+            for model, score in model_scores.items():
+                ModelScore.objects.create(
+                    evaluation=evaluation,
+                    example_id=example_ids[image_url],
+                    image_url=image_url,
+                    model=model,
+                    score=score,
+                    prompt=record["prompt"],
+                )
@@ -0,0 +1,103 @@
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import resource
+import tempfile
+import threading
+import time
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from app.models import CachedPrediction
+from app.tasks import cache_prediction, s3
+
+BLOCK = os.urandom(1024 * 1024)
+
+
+class OutputHandler(BaseHTTPRequestHandler):
+    size = 0
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(self.size))
+        self.end_headers()
+        remaining = self.size
+        while remaining > 0:
+            block = BLOCK[: min(len(BLOCK), remaining)]
+            self.wfile.write(block)
+            remaining -= len(block)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark transfers of generated outputs from a local HTTP server into "
+        "the cache bucket. Point AWS_ENDPOINT_URL_S3 at a local S3 stand-in."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size-mb", type=int, default=20)
+        parser.add_argument("--count", type=int, default=16)
+        parser.add_argument(
+            "--concurrency", type=int, default=settings.TRANSFER_CONCURRENCY
+        )
+        parser.add_argument(
+            "--buffered",
+            action="store_true",
+            help="Download into memory and a tempfile before uploading, for comparison",
+        )
+
+    def handle(self, *args, **options):
+        OutputHandler.size = options["size_mb"] * 1024 * 1024
+        server = ThreadingHTTPServer(("127.0.0.1", 0), OutputHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_port}"
+
+        try:
+            s3.create_bucket(Bucket=settings.CACHE_BUCKET)
+        except s3.exceptions.ClientError:
+            pass
+
+        transfer = buffered_transfer if options["buffered"] else cache_prediction
+        cache_keys = [f"benchmark/{i}" for i in range(options["count"])]
+
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as executor:
+            list(
+                executor.map(
+                    lambda key: transfer(key, f"{base_url}/{key}.png", {}, None, "png"),
+                    cache_keys,
+                )
+            )
+        elapsed = time.perf_counter() - start
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        server.shutdown()
+        for key in cache_keys:
+            s3.delete_object(Bucket=settings.CACHE_BUCKET, Key=f"{key}.png")
+            s3.delete_object(Bucket=settings.CACHE_BUCKET, Key=f"{key}.json")
+        CachedPrediction.objects.filter(cache_key__in=cache_keys).delete()
+
+        total_bytes = OutputHandler.size * options["count"]
+        self.stdout.write(
+            f"{options['count']} x {options['size_mb']} MB in {elapsed:.2f}s: "
+            f"{total_bytes / elapsed / 1024 / 1024:.1f} MB/s, "
+            f"peak RSS {rss_after / 1024:.0f} MB "
+            f"(+{(rss_after - rss_before) / 1024:.0f} MB)"
+        )
+
+
+def buffered_transfer(cache_key, output_url, labels, prediction_id, file_extension):
+    """The previous download-then-upload implementation, for comparison."""
+    response = requests.get(output_url)
+    response.raise_for_status()
+    with tempfile.NamedTemporaryFile() as temp_file:
+        temp_file.write(response.content)
+        temp_file.flush()
+        s3.upload_file(
+            temp_file.name, settings.CACHE_BUCKET, f"{cache_key}.{file_extension}"
+        )
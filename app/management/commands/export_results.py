@@ -0,0 +1,30 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from app.export import EXPORT_FORMATS, export_chunks
+from app.models import Evaluation
+
+
+class Command(BaseCommand):
+    help = "Export every image of an evaluation with its prompt, labels and scores"
+
+    def add_arguments(self, parser):
+        parser.add_argument("eval_id")
+        parser.add_argument("--format", choices=list(EXPORT_FORMATS), default="csv")
+        parser.add_argument(
+            "--output", help="File to write to (default: standard output)"
+        )
+
+    def handle(self, *args, **options):
+        evaluation = Evaluation.objects.filter(eval_id=options["eval_id"]).first()
+        if evaluation is None:
+            raise CommandError(f"Evaluation {options['eval_id']} not found")
+
+        output = (
+            open(options["output"], "wb") if options["output"] else sys.stdout.buffer
+        )
+        try:
+            for chunk in export_chunks(evaluation, options["format"]):
+                output.write(chunk)
+        finally:
+            if options["output"]:
+                output.close()
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from app.aggregates import rebuild_aggregates, rebuild_leaderboard
+from app.models import Evaluation
+
+
+class Command(BaseCommand):
+    help = "Recompute evaluation aggregates and leaderboards from scores, e.g. for evaluations created before they existed"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "eval_ids", nargs="*", help="Evaluations to rebuild (default: all)"
+        )
+
+    def handle(self, *args, **options):
+        evaluations = Evaluation.objects.order_by("id")
+        if options["eval_ids"]:
+            evaluations = evaluations.filter(eval_id__in=options["eval_ids"])
+
+        hashed_api_keys = set()
+        for evaluation in evaluations.iterator():
+            rebuild_aggregates(evaluation)
+            hashed_api_keys.add(evaluation.hashed_api_key)
+            self.stdout.write(
+                f"{evaluation.eval_id}: {evaluation.aggregates.count()} groups"
+            )
+
+        # Leaderboards are merged from the evaluation aggregates
+        for hashed_api_key in hashed_api_keys - {""}:
+            rebuild_leaderboard(hashed_api_key)
+        self.stdout.write(f"Rebuilt {len(hashed_api_keys - {''})} leaderboards")
@@ -0,0 +1,64 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from app.models import CachedPrediction
+from app.tasks import s3
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = "Resync the CachedPrediction index from a listing of the cache bucket"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=16)
+
+    def handle(self, *args, **options):
+        started_at = timezone.now()
+        num_indexed = 0
+        paginator = s3.get_paginator("list_objects_v2")
+
+        with ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+            for page in paginator.paginate(
+                Bucket=settings.CACHE_BUCKET, PaginationConfig={"PageSize": BATCH_SIZE}
+            ):
+                metadata_keys = [
+                    obj["Key"]
+                    for obj in page.get("Contents", [])
+                    if obj["Key"].endswith(".json")
+                ]
+                cached = list(executor.map(read_metadata, metadata_keys))
+                CachedPrediction.objects.bulk_create(
+                    cached,
+                    update_conflicts=True,
+                    unique_fields=["cache_key"],
+                    update_fields=[
+                        "file_extension",
+                        "labels",
+                        "prediction_id",
+                        "updated_at",
+                    ],
+                )
+                num_indexed += len(cached)
+                self.stdout.write(f"Indexed {num_indexed} cached predictions")
+
+        # Anything not touched by this listing is no longer in the bucket
+        stale = CachedPrediction.objects.filter(updated_at__lt=started_at)
+        deleted, _ = stale.delete()
+        self.stdout.write(
+            f"Done: {num_indexed} indexed, {deleted} stale entries removed"
+        )
+
+
+def read_metadata(key: str) -> CachedPrediction:
+    metadata = json.loads(
+        s3.get_object(Bucket=settings.CACHE_BUCKET, Key=key)["Body"].read()
+    )
+    return CachedPrediction(
+        cache_key=key.removesuffix(".json"),
+        file_extension=metadata["file_extension"],
+        labels=metadata["labels"],
+        prediction_id=metadata["prediction_id"],
+    )
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from app.models import Evaluation
+from app.progress import recompute_progress
+
+
+class Command(BaseCommand):
+    help = "Recount evaluation progress counters from rows, examples and scores, to repair drift"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "eval_ids", nargs="*", help="Evaluations to recount (default: all)"
+        )
+
+    def handle(self, *args, **options):
+        evaluations = Evaluation.objects.order_by("id")
+        if options["eval_ids"]:
+            evaluations = evaluations.filter(eval_id__in=options["eval_ids"])
+
+        for evaluation in evaluations.iterator():
+            recompute_progress(evaluation)
+            evaluation.refresh_from_db()
+            self.stdout.write(
+                f"{evaluation.eval_id}: {evaluation.num_scored_rows}/"
+                f"{evaluation.num_rows} rows scored"
+            )
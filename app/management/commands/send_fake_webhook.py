@@ -0,0 +1,56 @@
+import json
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+from app.models import Prediction
+from app.webhooks import signer
+
+
+class Command(BaseCommand):
+    help = "POST a fake Replicate completion webhook for a tracked prediction"
+
+    def add_arguments(self, parser):
+        parser.add_argument("replicate_id")
+        parser.add_argument(
+            "--status", default="succeeded", choices=["succeeded", "failed", "canceled"]
+        )
+        parser.add_argument(
+            "--output",
+            help="Prediction output as JSON, e.g. a list of image URLs or FlashEval records",
+        )
+        parser.add_argument("--predict-time", type=float, default=1.0)
+        parser.add_argument(
+            "--base-url",
+            default=settings.REPLICATE_WEBHOOK_BASE_URL or "http://localhost:8000",
+        )
+
+    def handle(self, *args, **options):
+        tracked = Prediction.objects.filter(
+            replicate_id=options["replicate_id"]
+        ).first()
+        if tracked is None:
+            raise CommandError(f"Unknown prediction {options['replicate_id']}")
+
+        payload = {
+            "id": tracked.replicate_id,
+            "model": tracked.model or "",
+            "version": "",
+            "status": options["status"],
+            "input": {},
+            "output": json.loads(options["output"]) if options["output"] else None,
+            "logs": "",
+            "error": None,
+            "metrics": {"predict_time": options["predict_time"]},
+            "created_at": None,
+            "started_at": None,
+            "completed_at": None,
+            "urls": {},
+        }
+
+        token = signer.sign(str(tracked.pk))
+        url = options["base_url"].rstrip("/") + reverse(
+            "replicate_webhook", args=[token]
+        )
+        response = requests.post(url, json=payload)
+        self.stdout.write(f"{response.status_code} {response.text}")
@@ -0,0 +1,158 @@
+from collections import deque
+import heapq
+import itertools
+import math
+import statistics
+import uuid
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from app.redis_client import get_redis
+from app.scheduler import next_job, release_job, submit_jobs
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulate small evaluations submitted behind a huge one, and report "
+        "their time to first score with Celery's FIFO queue and with the "
+        "fair-share scheduler. Time is simulated; the scheduler runs in Redis."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=8)
+        parser.add_argument("--huge-examples", type=int, default=50000)
+        parser.add_argument("--small-evaluations", type=int, default=50)
+        parser.add_argument("--small-examples", type=int, default=40)
+        parser.add_argument("--small-users", type=int, default=10)
+        parser.add_argument(
+            "--small-interval",
+            type=float,
+            default=10,
+            help="Seconds between small evaluation submissions",
+        )
+        parser.add_argument("--examples-per-row", type=int, default=4)
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument(
+            "--seconds-per-example",
+            type=float,
+            default=0.05,
+            help="Worker time to create one generation prediction",
+        )
+        parser.add_argument(
+            "--evaluate-seconds",
+            type=float,
+            default=0.5,
+            help="Worker time to create a chunk's evaluation predictions",
+        )
+        parser.add_argument(
+            "--prediction-seconds",
+            type=float,
+            default=10,
+            help="Time for predictions to run on Replicate",
+        )
+
+    def handle(self, *args, **options):
+        for policy in ["fifo", "fair-share"]:
+            first_scores, huge_done = simulate(policy, options)
+            first_scores.sort()
+            self.stdout.write(
+                f"{policy}: small evaluations' time to first score "
+                f"p50 {statistics.median(first_scores):.0f}s, "
+                f"p99 {first_scores[math.ceil(len(first_scores) * 0.99) - 1]:.0f}s; "
+                f"huge evaluation done after {huge_done:.0f}s"
+            )
+
+
+def simulate(policy: str, options: dict) -> tuple[list[float], float]:
+    """Run the simulation, returning each small evaluation's time from
+    submission to its first score, and when the huge evaluation finished.
+
+    Every generation batch is followed, once its predictions have run, by an
+    evaluation job for the batch's rows, whose scores arrive after its
+    predictions have run.
+    """
+    prefix = f"simulate_scheduling:{uuid.uuid4().hex}"
+    fifo = deque()
+    events = []  # (time, sequence, kind, job)
+    sequence = itertools.count()
+    submitted_at = {}
+    owners = {}  # eval_id -> (user, small)
+    first_score = {}
+    remaining_batches = {}
+    huge_done = 0.0
+    free_workers = options["workers"]
+
+    def submit(eval_id, kind, sizes):
+        jobs = [
+            {"id": uuid.uuid4().hex, "task": kind, "args": [eval_id, size]}
+            for size in sizes
+        ]
+        if policy == "fifo":
+            fifo.extend(jobs)
+        else:
+            submit_jobs(eval_id, *owners[eval_id], jobs, prefix=prefix)
+
+    def evaluation(now, eval_id, user, num_examples):
+        submitted_at[eval_id] = now
+        owners[eval_id] = (user, num_examples < options["huge_examples"])
+        sizes = [
+            min(options["batch_size"], num_examples - i)
+            for i in range(0, num_examples, options["batch_size"])
+        ]
+        remaining_batches[eval_id] = len(sizes)
+        submit(eval_id, "generate", sizes)
+
+    heapq.heappush(events, (0.0, next(sequence), "huge", None))
+    for i in range(options["small_evaluations"]):
+        at = 1 + i * options["small_interval"]
+        heapq.heappush(events, (at, next(sequence), "small", i))
+
+    with override_settings(SCHEDULER_MAX_DISPATCHED=options["workers"]):
+        while events:
+            now, _, kind, data = heapq.heappop(events)
+            if kind == "huge":
+                evaluation(now, "huge", "huge-user", options["huge_examples"])
+            elif kind == "small":
+                user = f"user-{data % options['small_users']}"
+                evaluation(now, f"small-{data}", user, options["small_examples"])
+            elif kind == "done":
+                free_workers += 1
+                if policy != "fifo":
+                    release_job(data["id"], prefix=prefix)
+                after = now + options["prediction_seconds"]
+                heapq.heappush(events, (after, next(sequence), "predicted", data))
+            elif kind == "predicted":
+                eval_id, size = data["args"]
+                if data["task"] == "generate":
+                    rows = math.ceil(size / options["examples_per_row"])
+                    submit(eval_id, "evaluate", [rows])
+                else:
+                    first_score.setdefault(eval_id, now)
+                    remaining_batches[eval_id] -= 1
+                    if eval_id == "huge" and not remaining_batches[eval_id]:
+                        huge_done = now
+
+            while free_workers:
+                if policy == "fifo":
+                    job = fifo.popleft() if fifo else None
+                else:
+                    job = next_job(prefix)
+                if job is None:
+                    break
+                free_workers -= 1
+                eval_id, size = job["args"]
+                if job["task"] == "generate":
+                    duration = size * options["seconds_per_example"]
+                else:
+                    duration = options["evaluate_seconds"]
+                heapq.heappush(events, (now + duration, next(sequence), "done", job))
+
+    redis_client = get_redis()
+    for key in redis_client.scan_iter(f"{prefix}:*"):
+        redis_client.delete(key)
+
+    first_scores = [
+        first_score[eval_id] - submitted_at[eval_id]
+        for eval_id in first_score
+        if eval_id != "huge"
+    ]
+    return first_scores, huge_done
@@ -0,0 +1,75 @@
+import brotli
+from django.middleware.gzip import GZipMiddleware, re_accepts_gzip
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+from django.utils.text import compress_string
+
+re_accepts_brotli = _lazy_re_compile(r"\bbr\b")
+re_encoded_etag = _lazy_re_compile(r'-(br|gzip)"')
+
+# Quality 11 is meant for static assets; 5 compresses about as well as gzip
+# -9 in a fraction of the time
+BROTLI_QUALITY = 5
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """Compress JSON responses with brotli, or gzip for clients that do not
+    accept brotli. Other responses carry CSRF tokens (HTML) or are streamed
+    (results events, static files from WhiteNoise), and are left alone.
+
+    Strong ETags stay strong: each encoding gets its own ETag, with the
+    encoding appended, and the suffix is stripped from If-None-Match before
+    views compare it with theirs.
+    """
+
+    def process_request(self, request):
+        if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+        if if_none_match:
+            request.META["HTTP_IF_NONE_MATCH"] = re_encoded_etag.sub('"', if_none_match)
+            match = re_encoded_etag.search(if_none_match)
+            request.etag_encoding = match[1] if match else None
+
+    def process_response(self, request, response):
+        if response.status_code == 304:
+            # Answer with the ETag of the representation the client has
+            encoding = getattr(request, "etag_encoding", None)
+            if encoding:
+                self.encode_etag(response, encoding)
+            return response
+
+        if response.streaming or not response.get("Content-Type", "").startswith(
+            "application/json"
+        ):
+            return response
+
+        if len(response.content) < 200 or response.has_header("Content-Encoding"):
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+
+        accept_encoding = request.META.get("HTTP_ACCEPT_ENCODING", "")
+        if re_accepts_brotli.search(accept_encoding):
+            encoding = "br"
+            compressed_content = brotli.compress(
+                response.content, quality=BROTLI_QUALITY
+            )
+        elif re_accepts_gzip.search(accept_encoding):
+            encoding = "gzip"
+            compressed_content = compress_string(
+                response.content, max_random_bytes=self.max_random_bytes
+            )
+        else:
+            return response
+
+        if len(compressed_content) >= len(response.content):
+            return response
+        response.content = compressed_content
+        response.headers["Content-Length"] = str(len(response.content))
+        response.headers["Content-Encoding"] = encoding
+        self.encode_etag(response, encoding)
+        return response
+
+    def encode_etag(self, response, encoding: str):
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = f'{etag[:-1]}-{encoding}"'
@@ -0,0 +1,58 @@
+# Generated by Django 5.1.2 on 2026-10-18 08:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0004_evaluation_hashed_api_key"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Prediction",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "replicate_id",
+                    models.CharField(
+                        blank=True, max_length=100, null=True, unique=True
+                    ),
+                ),
+                ("kind", models.CharField(max_length=20)),
+                ("model", models.CharField(blank=True, max_length=200, null=True)),
+                ("cache_key", models.CharField(blank=True, max_length=200, null=True)),
+                ("api_key", models.TextField()),
+                ("status", models.CharField(default="starting", max_length=20)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "evaluation",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="predictions",
+                        to="app.evaluation",
+                    ),
+                ),
+                (
+                    "example",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="app.example",
+                    ),
+                ),
+            ],
+        ),
+    ]
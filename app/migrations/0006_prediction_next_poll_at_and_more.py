@@ -0,0 +1,25 @@
+# Generated by Django 5.1.2 on 2026-10-18 08:05
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0005_prediction"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="prediction",
+            name="next_poll_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name="prediction",
+            index=models.Index(
+                fields=["status", "next_poll_at"], name="app_predict_status_d349be_idx"
+            ),
+        ),
+    ]
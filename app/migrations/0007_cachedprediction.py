@@ -0,0 +1,35 @@
+# Generated by Django 5.1.2 on 2026-10-18 08:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0006_prediction_next_poll_at_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CachedPrediction",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("cache_key", models.CharField(max_length=200, unique=True)),
+                ("file_extension", models.CharField(max_length=20)),
+                ("labels", models.JSONField(default=dict)),
+                (
+                    "prediction_id",
+                    models.CharField(blank=True, max_length=100, null=True),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.2 on 2026-10-18 08:11
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+def set_existing_row_status(apps, schema_editor):
+    # Rows created before the state machine have already been dispatched
+    # for evaluation, unless some of their images are still generating
+    Row = apps.get_model("app", "Row")
+    Example = apps.get_model("app", "Example")
+    generating = Example.objects.filter(
+        image_url__isnull=True, gen_prediction_failed=False
+    ).values("row_id")
+    Row.objects.exclude(id__in=generating).update(status="scored")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0007_cachedprediction"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="prediction",
+            name="idempotency_key",
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name="prediction",
+            name="row_ids",
+            field=django.contrib.postgres.fields.ArrayField(
+                base_field=models.BigIntegerField(), blank=True, default=list, size=None
+            ),
+        ),
+        migrations.AddField(
+            model_name="row",
+            name="status",
+            field=models.CharField(default="pending", max_length=20),
+        ),
+        migrations.RunPython(set_existing_row_status, migrations.RunPython.noop),
+    ]
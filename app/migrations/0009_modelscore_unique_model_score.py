@@ -0,0 +1,34 @@
+# Generated by Django 5.1.2 on 2026-10-18 08:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0008_row_status_prediction_idempotency_key"),
+    ]
+
+    operations = [
+        # Keep the newest of any duplicated scores
+        migrations.RunSQL(
+            """
+            DELETE FROM app_modelscore a
+            USING app_modelscore b
+            WHERE a.evaluation_id = b.evaluation_id
+              AND a.image_url = b.image_url
+              AND a.model = b.model
+              AND a.ref_image IS NOT DISTINCT FROM b.ref_image
+              AND a.id < b.id
+            """,
+            migrations.RunSQL.noop,
+        ),
+        migrations.AddConstraint(
+            model_name="modelscore",
+            constraint=models.UniqueConstraint(
+                fields=("evaluation", "image_url", "model", "ref_image"),
+                name="unique_model_score",
+                nulls_distinct=False,
+            ),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.1.2 on 2026-10-18 08:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0009_modelscore_unique_model_score"),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name="modelscore",
+            name="unique_model_score",
+        ),
+        migrations.AddField(
+            model_name="modelscore",
+            name="example",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="scores",
+                to="app.example",
+            ),
+        ),
+        migrations.AddField(
+            model_name="modelscore",
+            name="ref_example",
+            field=models.ForeignKey(
+                blank=True,
+                default=None,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to="app.example",
+            ),
+        ),
+    ]
@@ -0,0 +1,63 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0010_modelscore_example"),
+    ]
+
+    operations = [
+        # Scores were matched to images by URL across the whole evaluation.
+        # Attach each score to the first example with its URL, and copy it
+        # to any other example that shares the URL, as the results page
+        # showed it there too.
+        migrations.RunSQL(
+            """
+            UPDATE app_modelscore s
+            SET example_id = (
+                SELECT min(e.id)
+                FROM app_example e
+                JOIN app_row r ON r.id = e.row_id
+                WHERE r.evaluation_id = s.evaluation_id AND e.image_url = s.image_url
+            )
+            """,
+            migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(
+            """
+            INSERT INTO app_modelscore
+                (evaluation_id, example_id, image_url, model, score, ref_image, prompt)
+            SELECT s.evaluation_id, e.id, s.image_url, s.model, s.score,
+                s.ref_image, s.prompt
+            FROM app_modelscore s
+            JOIN app_example e ON e.image_url = s.image_url AND e.id > s.example_id
+            JOIN app_row r ON r.id = e.row_id AND r.evaluation_id = s.evaluation_id
+            """,
+            migrations.RunSQL.noop,
+        ),
+        # The reference is the example with ref_image in the scored row
+        migrations.RunSQL(
+            """
+            UPDATE app_modelscore s
+            SET ref_example_id = (
+                SELECT min(ref.id)
+                FROM app_example e
+                JOIN app_example ref ON ref.row_id = e.row_id
+                WHERE e.id = s.example_id AND ref.image_url = s.ref_image
+            )
+            WHERE s.ref_image IS NOT NULL
+            """,
+            migrations.RunSQL.noop,
+        ),
+        # Scores for images that are no longer in the evaluation, or against
+        # a reference outside their row, were never shown
+        migrations.RunSQL(
+            """
+            DELETE FROM app_modelscore
+            WHERE example_id IS NULL
+               OR (ref_image IS NOT NULL AND ref_example_id IS NULL)
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
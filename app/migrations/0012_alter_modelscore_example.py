@@ -0,0 +1,40 @@
+# Generated by Django 5.1.2 on 2026-10-18 08:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Separate from the backfill, whose deferred foreign key checks would
+    # otherwise block ALTER TABLE in the same transaction
+
+    dependencies = [
+        ("app", "0011_backfill_modelscore_example"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="modelscore",
+            name="example",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="scores",
+                to="app.example",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="modelscore",
+            index=models.Index(
+                fields=["evaluation", "example", "model"],
+                name="app_modelsc_evaluat_daaa72_idx",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="modelscore",
+            constraint=models.UniqueConstraint(
+                fields=("example", "model", "ref_example"),
+                name="unique_model_score",
+                nulls_distinct=False,
+            ),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.2 on 2026-10-18 08:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0012_alter_modelscore_example"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="example",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name="modelscore",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name="modelscore",
+            index=models.Index(
+                fields=["evaluation", "updated_at"],
+                name="app_modelsc_evaluat_bda5cc_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.1.2 on 2026-10-18 08:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0013_example_modelscore_updated_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EvaluationAggregate",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("count", models.BigIntegerField(default=0)),
+                ("total", models.FloatField(default=0)),
+                ("total_squares", models.FloatField(default=0)),
+                ("minimum", models.FloatField(blank=True, null=True)),
+                ("maximum", models.FloatField(blank=True, null=True)),
+                ("histogram", models.JSONField(default=dict)),
+                ("metric", models.CharField(max_length=50)),
+                ("group_key", models.CharField(blank=True, default="", max_length=255)),
+                (
+                    "group_value",
+                    models.CharField(blank=True, default="", max_length=255),
+                ),
+                (
+                    "evaluation",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="aggregates",
+                        to="app.evaluation",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("evaluation", "metric", "group_key", "group_value"),
+                        name="unique_evaluation_aggregate",
+                    )
+                ],
+            },
+        ),
+    ]
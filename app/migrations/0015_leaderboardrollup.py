@@ -0,0 +1,45 @@
+# Generated by Django 5.1.2 on 2026-10-18 08:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0014_evaluationaggregate"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LeaderboardRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("count", models.BigIntegerField(default=0)),
+                ("total", models.FloatField(default=0)),
+                ("total_squares", models.FloatField(default=0)),
+                ("minimum", models.FloatField(blank=True, null=True)),
+                ("maximum", models.FloatField(blank=True, null=True)),
+                ("histogram", models.JSONField(default=dict)),
+                ("hashed_api_key", models.CharField(max_length=64)),
+                ("metric", models.CharField(max_length=50)),
+                ("group_key", models.CharField(max_length=255)),
+                ("group_value", models.CharField(max_length=255)),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("hashed_api_key", "metric", "group_key", "group_value"),
+                        name="unique_leaderboard_rollup",
+                    )
+                ],
+            },
+        ),
+    ]
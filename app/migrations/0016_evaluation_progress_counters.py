@@ -0,0 +1,99 @@
+# Generated by Django 5.1.2 on 2026-10-18 08:27
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def count_existing_progress(apps, schema_editor):
+    # Same counts as app.progress.recompute_progress
+    Evaluation = apps.get_model("app", "Evaluation")
+    Row = apps.get_model("app", "Row")
+    Example = apps.get_model("app", "Example")
+    ModelScore = apps.get_model("app", "ModelScore")
+
+    for evaluation in Evaluation.objects.iterator():
+        examples = Example.objects.filter(row__evaluation=evaluation).aggregate(
+            num_examples=Count("id"),
+            num_generated=Count("id", filter=Q(image_url__isnull=False)),
+            num_failed=Count("id", filter=Q(gen_prediction_failed=True)),
+        )
+        rows = Row.objects.filter(evaluation=evaluation).aggregate(
+            num_rows=Count("id"),
+            num_scored_rows=Count("id", filter=Q(status="scored")),
+        )
+        image_counts = (
+            Row.objects.filter(
+                evaluation=evaluation, status__in=["evaluating", "scored"]
+            )
+            .annotate(
+                num_images=Count(
+                    "examples", filter=Q(examples__image_url__isnull=False)
+                )
+            )
+            .values_list("num_images", flat=True)
+        )
+        expected_scores = {}
+        for model in evaluation.enabled_models:
+            expected = sum(
+                max(n - 1, 0) if model == "DreamSim" else n for n in image_counts
+            )
+            if expected:
+                expected_scores[model] = expected
+        received_scores = dict(
+            ModelScore.objects.filter(evaluation=evaluation)
+            .values("model")
+            .annotate(count=Count("id"))
+            .values_list("model", "count")
+        )
+        Evaluation.objects.filter(id=evaluation.id).update(
+            **examples,
+            **rows,
+            expected_scores=expected_scores,
+            received_scores=received_scores,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0015_leaderboardrollup"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="evaluation",
+            name="expected_scores",
+            field=models.JSONField(default=dict),
+        ),
+        migrations.AddField(
+            model_name="evaluation",
+            name="num_examples",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="evaluation",
+            name="num_failed",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="evaluation",
+            name="num_generated",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="evaluation",
+            name="num_rows",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="evaluation",
+            name="num_scored_rows",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="evaluation",
+            name="received_scores",
+            field=models.JSONField(default=dict),
+        ),
+        migrations.RunPython(count_existing_progress, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.2 on 2026-10-18 08:29
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0016_evaluation_progress_counters"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="row",
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.search.SearchVector("prompt", config="simple"),
+                name="row_prompt_search",
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 08:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0017_row_prompt_search"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="evaluation",
+            name="ingesting",
+            field=models.BooleanField(default=False),
+        ),
+    ]
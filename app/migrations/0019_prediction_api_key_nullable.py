@@ -0,0 +1,28 @@
+# Generated by Django 5.1.2 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+def clear_finished_api_keys(apps, schema_editor):
+    # API keys are only signed, not encrypted, so finished predictions
+    # don't keep them
+    Prediction = apps.get_model("app", "Prediction")
+    Prediction.objects.filter(status__in=["succeeded", "failed", "canceled"]).update(
+        api_key=None
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0018_evaluation_ingesting"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="prediction",
+            name="api_key",
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.RunPython(clear_finished_api_keys, migrations.RunPython.noop),
+    ]
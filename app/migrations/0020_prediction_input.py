@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 09:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0019_prediction_api_key_nullable"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="prediction",
+            name="input",
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
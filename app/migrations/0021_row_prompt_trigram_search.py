@@ -0,0 +1,30 @@
+# Generated by Django 5.1.2 on 2026-10-18 09:26
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0020_prediction_input"),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RemoveIndex(
+            model_name="row",
+            name="row_prompt_search",
+        ),
+        migrations.AddIndex(
+            model_name="row",
+            index=django.contrib.postgres.indexes.GinIndex(
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.text.Upper("prompt"), name="gin_trgm_ops"
+                ),
+                name="row_prompt_trgm",
+            ),
+        ),
+    ]
@@ -1,5 +1,8 @@
 from django.db import models
+from django.utils import timezone
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.db.models.functions import Upper
 
 
 class Evaluation(models.Model):
@@ -8,14 +11,43 @@ class Evaluation(models.Model):
     enabled_models = ArrayField(models.CharField(max_length=50))
     created_at = models.DateTimeField(auto_now_add=True)
     hashed_api_key = models.CharField(64)
+    # Set while an upload is still adding rows, so that the evaluation does
+    # not count as completed in between batches
+    ingesting = models.BooleanField(default=False)
+    # Progress counters, maintained by app/progress.py
+    num_rows = models.IntegerField(default=0)
+    num_examples = models.IntegerField(default=0)
+    num_generated = models.IntegerField(default=0)
+    num_failed = models.IntegerField(default=0)
+    num_scored_rows = models.IntegerField(default=0)
+    # Per evaluation model, e.g. {"ImageReward": 120}
+    expected_scores = models.JSONField(default=dict)
+    received_scores = models.JSONField(default=dict)
 
 
 class Row(models.Model):
+    # Lifecycle: pending -> generated -> evaluating -> scored. Rows of
+    # existing images start out generated.
+    PENDING = "pending"
+    GENERATED = "generated"
+    EVALUATING = "evaluating"
+    SCORED = "scored"
+
     evaluation = models.ForeignKey(
         Evaluation, on_delete=models.CASCADE, related_name="rows"
     )
     prompt = models.TextField(null=True, blank=True)
     seed = models.BigIntegerField(null=True, blank=True)
+    status = models.CharField(max_length=20, default=PENDING)
+
+    class Meta:
+        indexes = [
+            # Prompt search in the results API, see app.results.search_rows.
+            # Trigrams of the upper-cased prompt, as icontains compares those.
+            GinIndex(
+                OpClass(Upper("prompt"), name="gin_trgm_ops"), name="row_prompt_trgm"
+            )
+        ]
 
 
 class Example(models.Model):
@@ -25,12 +57,131 @@ class Example(models.Model):
     gen_model = models.CharField(max_length=200, blank=True, null=True)
     gen_prediction_id = models.CharField(max_length=100, blank=True, null=True)
     gen_prediction_failed = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
 
 
 class ModelScore(models.Model):
     evaluation = models.ForeignKey(Evaluation, on_delete=models.CASCADE)
+    example = models.ForeignKey(
+        Example, on_delete=models.CASCADE, related_name="scores"
+    )
+    # DreamSim distances are measured against the row's reference example
+    ref_example = models.ForeignKey(
+        Example,
+        on_delete=models.CASCADE,
+        related_name="+",
+        default=None,
+        blank=True,
+        null=True,
+    )
     image_url = models.URLField(max_length=1000)
     model = models.CharField(max_length=50)
     score = models.FloatField()
     ref_image = models.URLField(max_length=1000, default=None, blank=True, null=True)
     prompt = models.TextField(default=None, blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            # FlashEval scores have no ref_example, so NULLs must compare equal
+            models.UniqueConstraint(
+                fields=["example", "model", "ref_example"],
+                name="unique_model_score",
+                nulls_distinct=False,
+            )
+        ]
+        indexes = [
+            models.Index(fields=["evaluation", "example", "model"]),
+            models.Index(fields=["evaluation", "updated_at"]),
+        ]
+
+
+class Prediction(models.Model):
+    evaluation = models.ForeignKey(
+        Evaluation, on_delete=models.CASCADE, related_name="predictions"
+    )
+    example = models.ForeignKey(
+        Example, on_delete=models.CASCADE, blank=True, null=True
+    )
+    replicate_id = models.CharField(max_length=100, unique=True, blank=True, null=True)
+    kind = models.CharField(max_length=20)  # "generation", "DreamSim" or "FlashEval"
+    model = models.CharField(max_length=200, blank=True, null=True)
+    cache_key = models.CharField(max_length=200, blank=True, null=True)
+    # Evaluation predictions: the chunk's rows, and a key that makes
+    # redelivered evaluate_chunk tasks create each prediction only once
+    row_ids = ArrayField(models.BigIntegerField(), default=list, blank=True)
+    idempotency_key = models.CharField(
+        max_length=64, unique=True, blank=True, null=True
+    )
+    # Generation predictions: their input, to create them again if the task
+    # creating them was lost
+    input = models.JSONField(blank=True, null=True)
+    # Signed, not encrypted, so only kept while the prediction is unfinished
+    api_key = models.TextField(blank=True, null=True)
+    status = models.CharField(max_length=20, default="starting")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    next_poll_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "next_poll_at"])]
+
+
+class CachedPrediction(models.Model):
+    # Index of the {cache_key}.json metadata objects in the cache bucket
+    cache_key = models.CharField(max_length=200, unique=True)
+    file_extension = models.CharField(max_length=20)
+    labels = models.JSONField(default=dict)
+    prediction_id = models.CharField(max_length=100, blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class RunningStatistics(models.Model):
+    # Mergeable summary of a stream of values, see app/aggregates.py
+    count = models.BigIntegerField(default=0)
+    total = models.FloatField(default=0)
+    total_squares = models.FloatField(default=0)
+    minimum = models.FloatField(blank=True, null=True)
+    maximum = models.FloatField(blank=True, null=True)
+    # Log-bucketed value counts, for approximate percentiles
+    histogram = models.JSONField(default=dict)
+
+    class Meta:
+        abstract = True
+
+
+class EvaluationAggregate(RunningStatistics):
+    # Statistics of one metric (a scoring model, or predict_time) over one
+    # group of an evaluation's images. group_key is "" for all images,
+    # "gen_model", or "label:<key>".
+    evaluation = models.ForeignKey(
+        Evaluation, on_delete=models.CASCADE, related_name="aggregates"
+    )
+    metric = models.CharField(max_length=50)
+    group_key = models.CharField(max_length=255, blank=True, default="")
+    group_value = models.CharField(max_length=255, blank=True, default="")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["evaluation", "metric", "group_key", "group_value"],
+                name="unique_evaluation_aggregate",
+            )
+        ]
+
+
+class LeaderboardRollup(RunningStatistics):
+    # EvaluationAggregate summed over all evaluations of one API key, for
+    # every group except the all-images one
+    hashed_api_key = models.CharField(max_length=64)
+    metric = models.CharField(max_length=50)
+    group_key = models.CharField(max_length=255)
+    group_value = models.CharField(max_length=255)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["hashed_api_key", "metric", "group_key", "group_value"],
+                name="unique_leaderboard_rollup",
+            )
+        ]
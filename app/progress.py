@@ -0,0 +1,126 @@
+from collections import Counter
+from django.db import transaction
+from django.db.models import Count, F, Q
+from .models import Evaluation, Row, Example, ModelScore
+from .results_cache import invalidate_results_on_commit
+
+COUNTER_FIELDS = [
+    "num_rows",
+    "num_examples",
+    "num_generated",
+    "num_failed",
+    "num_scored_rows",
+]
+
+
+def update_progress(
+    evaluation: Evaluation,
+    expected_scores: dict[str, int] | None = None,
+    received_scores: dict[str, int] | None = None,
+    **counts: int,
+):
+    """Add to an evaluation's progress counters, e.g. num_generated=1.
+
+    Updating the counters locks the evaluation row until the transaction
+    commits, so call this last in a transaction, after any Row or
+    aggregate locks have been taken.
+    """
+    counts = {field: n for field, n in counts.items() if n}
+    expected_scores = {model: n for model, n in (expected_scores or {}).items() if n}
+    received_scores = {model: n for model, n in (received_scores or {}).items() if n}
+
+    if not counts and not expected_scores and not received_scores:
+        return
+    invalidate_results_on_commit(evaluation.eval_id)
+
+    if not expected_scores and not received_scores:
+        Evaluation.objects.filter(id=evaluation.id).update(
+            **{field: F(field) + n for field, n in counts.items()}
+        )
+        return
+
+    with transaction.atomic():
+        locked = (
+            Evaluation.objects.select_for_update()
+            .only(*COUNTER_FIELDS, "expected_scores", "received_scores")
+            .get(id=evaluation.id)
+        )
+        for field, n in counts.items():
+            setattr(locked, field, getattr(locked, field) + n)
+        locked.expected_scores = dict(
+            Counter(locked.expected_scores) + Counter(expected_scores)
+        )
+        locked.received_scores = dict(
+            Counter(locked.received_scores) + Counter(received_scores)
+        )
+        locked.save(update_fields=[*counts, "expected_scores", "received_scores"])
+
+
+def expected_scores_for(models: list[str], image_counts: list[int]) -> dict[str, int]:
+    """Scores an evaluation prediction over rows with the given numbers of
+    images should produce: one per image, except that DreamSim does not
+    score a row's reference image."""
+    return {
+        model: sum(max(n - 1, 0) if model == "DreamSim" else n for n in image_counts)
+        for model in models
+    }
+
+
+def is_completed(evaluation: Evaluation) -> bool:
+    return (
+        not evaluation.ingesting and evaluation.num_scored_rows >= evaluation.num_rows
+    )
+
+
+def evaluation_progress(evaluation: Evaluation) -> dict:
+    return {
+        "num_rows": evaluation.num_rows,
+        "num_scored_rows": evaluation.num_scored_rows,
+        "num_examples": evaluation.num_examples,
+        "num_generated": evaluation.num_generated,
+        "num_failed": evaluation.num_failed,
+        "scores": {
+            model: {
+                "expected": evaluation.expected_scores.get(model, 0),
+                "received": evaluation.received_scores.get(model, 0),
+            }
+            for model in evaluation.enabled_models
+        },
+    }
+
+
+def recompute_progress(evaluation: Evaluation):
+    """Recount an evaluation's progress counters from its rows, examples
+    and scores, to repair drift."""
+    examples = Example.objects.filter(row__evaluation=evaluation).aggregate(
+        num_examples=Count("id"),
+        num_generated=Count("id", filter=Q(image_url__isnull=False)),
+        num_failed=Count("id", filter=Q(gen_prediction_failed=True)),
+    )
+    rows = evaluation.rows.aggregate(
+        num_rows=Count("id"),
+        num_scored_rows=Count("id", filter=Q(status=Row.SCORED)),
+    )
+
+    # Rows that were sent to evaluation, by their number of images
+    image_counts = (
+        evaluation.rows.filter(status__in=[Row.EVALUATING, Row.SCORED])
+        .annotate(
+            num_images=Count("examples", filter=Q(examples__image_url__isnull=False))
+        )
+        .values_list("num_images", flat=True)
+    )
+    expected_scores = expected_scores_for(evaluation.enabled_models, image_counts)
+    received_scores = dict(
+        ModelScore.objects.filter(evaluation=evaluation)
+        .values("model")
+        .annotate(count=Count("id"))
+        .values_list("model", "count")
+    )
+
+    Evaluation.objects.filter(id=evaluation.id).update(
+        **examples,
+        **rows,
+        expected_scores={k: v for k, v in expected_scores.items() if v},
+        received_scores=received_scores,
+    )
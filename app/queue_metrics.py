@@ -0,0 +1,85 @@
+from datetime import datetime
+import threading
+import time
+from celery.signals import before_task_publish, task_postrun, task_prerun
+from django.conf import settings
+import redis
+from .redis_client import get_redis
+
+# Recent samples kept per queue
+QUEUE_METRICS_SAMPLES = 1000
+
+_started_at = {}
+_started_at_lock = threading.Lock()
+
+
+@before_task_publish.connect
+def stamp_published_at(headers=None, **kwargs):
+    if headers is not None:
+        headers["published_at"] = time.time()
+
+
+@task_prerun.connect
+def record_queue_wait(task_id=None, task=None, **kwargs):
+    """Record how long the task waited in its queue: since it was published,
+    or since its countdown ran out."""
+    now = time.time()
+    with _started_at_lock:
+        _started_at[task_id] = now
+
+    published_at = getattr(task.request, "published_at", None)
+    queue = (task.request.delivery_info or {}).get("routing_key")
+    if published_at is None or queue is None:
+        return
+
+    ready_at = published_at
+    if task.request.eta:
+        ready_at = max(ready_at, parse_eta(task.request.eta))
+    record_sample(f"queue_wait:{queue}", max(now - ready_at, 0))
+
+
+@task_postrun.connect
+def record_run_time(task_id=None, task=None, **kwargs):
+    with _started_at_lock:
+        started_at = _started_at.pop(task_id, None)
+    queue = (task.request.delivery_info or {}).get("routing_key")
+    if started_at is not None and queue is not None:
+        record_sample(f"queue_run:{queue}", time.time() - started_at)
+
+
+def parse_eta(eta: str | datetime) -> float:
+    if isinstance(eta, str):
+        eta = datetime.fromisoformat(eta)
+    return eta.timestamp()
+
+
+def record_sample(key: str, seconds: float):
+    try:
+        pipe = get_redis().pipeline()
+        pipe.lpush(key, round(seconds, 3))
+        pipe.ltrim(key, 0, QUEUE_METRICS_SAMPLES - 1)
+        pipe.execute()
+    except redis.RedisError as e:
+        print(f"Failed to record {key}: {e}")
+
+
+def queue_stats() -> dict[str, dict]:
+    """Percentiles of the recent wait and run times of tasks, per queue."""
+    redis_client = get_redis()
+    queues = {route["queue"] for route in settings.CELERY_TASK_ROUTES.values()}
+    stats = {}
+    for queue in sorted(queues | {settings.CELERY_TASK_DEFAULT_QUEUE}):
+        stats[queue] = {}
+        for metric in ["wait", "run"]:
+            samples = sorted(
+                float(s) for s in redis_client.lrange(f"queue_{metric}:{queue}", 0, -1)
+            )
+            if not samples:
+                continue
+            stats[queue][metric] = {
+                "p50": samples[len(samples) // 2],
+                "p95": samples[int(len(samples) * 0.95)],
+                "max": samples[-1],
+                "samples": len(samples),
+            }
+    return stats
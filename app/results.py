@@ -0,0 +1,147 @@
+import json
+from django.db.models import Avg, F, Prefetch, Q
+from .models import Evaluation, Row, Example, ModelScore
+from .progress import is_completed
+
+
+def serialize_rows(evaluation: Evaluation, rows, model_scores) -> list[dict]:
+    """Serialize rows with their images and scores as returned by the
+    results API, in the queryset's order or else by id. model_scores must
+    cover at least the given rows."""
+    if not rows.ordered:
+        rows = rows.order_by("id")
+    rows = rows.prefetch_related(
+        Prefetch(
+            "examples",
+            queryset=Example.objects.order_by("id"),
+            to_attr="ordered_examples",
+        )
+    )
+
+    # Create a dictionary for fast lookup
+    score_lookup = {}
+    for score in model_scores:
+        score_lookup.setdefault(score.example_id, {})[score.model] = score
+
+    rows_data = []
+    for row in rows:
+        row_data = {"id": row.id, "prompt": row.prompt, "seed": row.seed, "images": []}
+
+        for index, example in enumerate(row.ordered_examples):
+            image_data = {
+                "id": example.id,
+                "url": example.image_url,
+                "labels": example.labels,
+                "scores": {},
+                "gen_prediction_id": example.gen_prediction_id,
+                "gen_model": example.gen_model,
+            }
+
+            for model in evaluation.enabled_models:
+                score = score_lookup.get(example.id, {}).get(model)
+                if score:
+                    if model == "DreamSim" and index > 0:
+                        if score.ref_example_id == row.ordered_examples[0].id:
+                            image_data["scores"][model] = score.score
+                        else:
+                            image_data["scores"][model] = None
+                    else:
+                        image_data["scores"][model] = score.score
+                else:
+                    image_data["scores"][model] = None
+
+            row_data["images"].append(image_data)
+
+        rows_data.append(row_data)
+
+    return rows_data
+
+
+def columnar_rows(rows_data: list[dict], enabled_models: list[str]) -> dict:
+    """The serialize_rows output as parallel arrays: one entry per row in
+    "rows", and one per image in "images", where images[i] belongs to the
+    row at index images["row"][i]. Generation models and label sets are
+    interned, and predict_time is split out of the labels so that images
+    with the same labels share one entry."""
+    rows = {"id": [], "prompt": [], "seed": []}
+    images = {
+        "row": [],
+        "id": [],
+        "url": [],
+        "gen_model": [],
+        "gen_prediction_id": [],
+        "labels": [],
+        "predict_time": [],
+        "scores": {model: [] for model in enabled_models},
+    }
+    gen_models = {}
+    label_sets = {}
+
+    for row_index, row in enumerate(rows_data):
+        rows["id"].append(row["id"])
+        rows["prompt"].append(row["prompt"])
+        rows["seed"].append(row["seed"])
+
+        for image in row["images"]:
+            images["row"].append(row_index)
+            images["id"].append(image["id"])
+            images["url"].append(image["url"])
+            images["gen_prediction_id"].append(image["gen_prediction_id"])
+
+            gen_model = image["gen_model"]
+            images["gen_model"].append(
+                None
+                if gen_model is None
+                else gen_models.setdefault(gen_model, len(gen_models))
+            )
+
+            labels = dict(image["labels"])
+            images["predict_time"].append(labels.pop("predict_time", None))
+            labels_key = json.dumps(labels, sort_keys=True)
+            images["labels"].append(label_sets.setdefault(labels_key, len(label_sets)))
+
+            for model in enabled_models:
+                images["scores"][model].append(image["scores"][model])
+
+    return {
+        "rows": rows,
+        "images": images,
+        "gen_models": list(gen_models),
+        "label_sets": [json.loads(labels_key) for labels_key in label_sets],
+    }
+
+
+def search_rows(rows, query: str):
+    """Rows whose prompt contains the query, ignoring case, using the
+    trigram index on Row.prompt."""
+    return rows.filter(prompt__icontains=query)
+
+
+def sort_rows(rows, metric: str, descending: bool = False):
+    """Order rows by the mean of their images' scores for metric. Rows
+    without any such score come last."""
+    rows = rows.annotate(
+        sort_score=Avg(
+            "examples__scores__score", filter=Q(examples__scores__model=metric)
+        )
+    )
+    if descending:
+        return rows.order_by(F("sort_score").desc(nulls_last=True), "id")
+    return rows.order_by(F("sort_score").asc(nulls_last=True), "id")
+
+
+def serialize_changed_rows(evaluation: Evaluation, row_ids: list[int]) -> list[dict]:
+    rows = Row.objects.filter(evaluation=evaluation, id__in=row_ids)
+    model_scores = ModelScore.objects.filter(
+        evaluation=evaluation, example__row_id__in=row_ids
+    )
+    return serialize_rows(evaluation, rows, model_scores)
+
+
+def evaluation_completed(evaluation: Evaluation) -> bool:
+    # Read the counters fresh, since evaluation may predate the last commit
+    return is_completed(
+        Evaluation.objects.only("ingesting", "num_rows", "num_scored_rows").get(
+            id=evaluation.id
+        )
+    )
@@ -0,0 +1,77 @@
+from collections.abc import Callable
+import hashlib
+import uuid
+import redis
+from django.conf import settings
+from django.db import transaction
+from .redis_client import get_redis
+
+# Outlives cached responses, which are keyed on the version
+RESULTS_VERSION_TTL = 30 * 24 * 60 * 60
+
+
+def results_version_key(eval_id: str) -> str:
+    return f"results_version:{eval_id}"
+
+
+def results_version(eval_id: str) -> str | None:
+    """A token that changes whenever the evaluation's results change, or
+    None if Redis is unavailable. Random rather than a counter, so that a
+    version lost from Redis is never reissued for different results."""
+    redis_client = get_redis()
+    key = results_version_key(eval_id)
+    try:
+        version = redis_client.get(key)
+        if version is None:
+            redis_client.set(key, uuid.uuid4().hex, nx=True, ex=RESULTS_VERSION_TTL)
+            version = redis_client.get(key)
+    except redis.RedisError as e:
+        print(f"Failed to read results version of {eval_id}: {e}")
+        return None
+    return version.decode()
+
+
+def invalidate_results(eval_id: str):
+    """Retire the evaluation's cached results and ETags. Call it once the
+    change has committed, since the next request caches what it reads."""
+    get_redis().set(
+        results_version_key(eval_id), uuid.uuid4().hex, ex=RESULTS_VERSION_TTL
+    )
+
+
+def invalidate_results_on_commit(eval_id: str):
+    transaction.on_commit(lambda: invalidate_results(eval_id), robust=True)
+
+
+def cached_results(
+    eval_id: str, query: str, build: Callable[[], tuple[bytes, bool]]
+) -> tuple[bytes, bool]:
+    """The (body, completed) results response for the query string, from
+    the cache or else from build(). The version is read before building,
+    so a response that raced with a change is cached under the old
+    version, where nothing reads it."""
+    version = results_version(eval_id)
+    if version is None:
+        return build()
+
+    redis_client = get_redis()
+    query_hash = hashlib.sha256(query.encode()).hexdigest()
+    key = f"results_cache:{eval_id}:{version}:{query_hash}"
+    try:
+        body, completed = redis_client.hmget(key, "body", "completed")
+    except redis.RedisError as e:
+        print(f"Failed to read cached results of {eval_id}: {e}")
+        return build()
+    if body is not None:
+        return body, completed == b"1"
+
+    body, completed = build()
+    if len(body) <= settings.RESULTS_CACHE_MAX_SIZE:
+        try:
+            pipe = redis_client.pipeline()
+            pipe.hset(key, mapping={"body": body, "completed": int(completed)})
+            pipe.expire(key, settings.RESULTS_CACHE_TTL)
+            pipe.execute()
+        except redis.RedisError as e:
+            print(f"Failed to cache results of {eval_id}: {e}")
+    return body, completed
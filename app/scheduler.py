@@ -0,0 +1,210 @@
+import json
+import uuid
+from celery import current_app, shared_task
+from django.conf import settings
+import redis
+from .models import Evaluation
+from .redis_client import get_redis
+
+# Jobs wait in Redis, one list per evaluation, and are handed to Celery only
+# when a worker slot is free, so Celery's FIFO queue never holds a backlog
+# that other evaluations would have to wait behind.
+#
+# Evaluations are served round-robin per API key, and round-robin among
+# each key's evaluations, so every user gets an equal share of the workers
+# however much they submit. Evaluations of at most
+# SCHEDULER_SMALL_EVALUATION_SIZE examples are served first, from their own
+# round-robin lane, but for at most SCHEDULER_SMALL_BURST jobs in a row while
+# larger evaluations are waiting, so that they are never starved.
+PREFIX = "scheduler"
+
+SUBMIT_SCRIPT = """
+local prefix, eval_id, user, small = ARGV[1], ARGV[2], ARGV[3], ARGV[4] == "1"
+local small_lane, users = prefix .. ":small", prefix .. ":users"
+local user_lane = prefix .. ":user:" .. user
+
+for i = 5, #ARGV do
+    redis.call("RPUSH", prefix .. ":jobs:" .. eval_id, ARGV[i])
+end
+
+-- Evaluations move to the large lane as an upload grows past the threshold
+if small then
+    if not redis.call("LPOS", small_lane, eval_id) then
+        redis.call("RPUSH", small_lane, eval_id)
+    end
+else
+    redis.call("LREM", small_lane, 0, eval_id)
+    if not redis.call("LPOS", user_lane, eval_id) then
+        redis.call("RPUSH", user_lane, eval_id)
+    end
+    if not redis.call("LPOS", users, user) then
+        redis.call("RPUSH", users, user)
+    end
+end
+"""
+
+# Hands out the next job if fewer than max_dispatched are running, marking
+# it as running until it is released or its lease runs out
+DISPATCH_SCRIPT = """
+local prefix, max_dispatched, lease = ARGV[1], tonumber(ARGV[2]), tonumber(ARGV[3])
+local small_burst = tonumber(ARGV[4])
+local dispatched = prefix .. ":dispatched"
+local small_streak = prefix .. ":small_streak"
+
+local time = redis.call("TIME")
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+redis.call("ZREMRANGEBYSCORE", dispatched, "-inf", now - lease)
+if max_dispatched > 0 and redis.call("ZCARD", dispatched) >= max_dispatched then
+    return false
+end
+
+-- Take a job from the first evaluation in a lane with any, and rotate that
+-- evaluation to the back of the lane. Evaluations without jobs leave it.
+local function take_from_evaluations(lane)
+    for i = 1, redis.call("LLEN", lane) do
+        local eval_id = redis.call("LPOP", lane)
+        local jobs = prefix .. ":jobs:" .. eval_id
+        local job = redis.call("LPOP", jobs)
+        if job then
+            if redis.call("LLEN", jobs) > 0 then
+                redis.call("RPUSH", lane, eval_id)
+            end
+            return job
+        end
+    end
+    return false
+end
+
+local function take_from_users()
+    local users = prefix .. ":users"
+    for i = 1, redis.call("LLEN", users) do
+        local user = redis.call("LPOP", users)
+        local user_lane = prefix .. ":user:" .. user
+        local job = take_from_evaluations(user_lane)
+        if job then
+            if redis.call("LLEN", user_lane) > 0 then
+                redis.call("RPUSH", users, user)
+            end
+            return job
+        end
+    end
+    return false
+end
+
+-- The small lane goes first, until it has had small_burst jobs in a row
+local job = false
+if tonumber(redis.call("GET", small_streak) or "0") < small_burst then
+    job = take_from_evaluations(prefix .. ":small")
+end
+if job then
+    redis.call("INCR", small_streak)
+else
+    job = take_from_users()
+    if job then
+        redis.call("SET", small_streak, 0)
+    else
+        job = take_from_evaluations(prefix .. ":small")
+    end
+end
+
+if job then
+    redis.call("ZADD", dispatched, now, cjson.decode(job).id)
+end
+return job
+"""
+
+_scripts = {}
+
+
+def _script(source: str):
+    if source not in _scripts:
+        _scripts[source] = get_redis().register_script(source)
+    return _scripts[source]
+
+
+def schedule(eval_id: str, task, args_list: list[list]):
+    """Queue one call of a Celery task per args in args_list, to run as
+    workers free up, fairly shared with other evaluations' jobs.
+
+    If Redis is unavailable, the tasks are sent to Celery directly.
+    """
+    if not args_list:
+        return
+
+    hashed_api_key, num_examples = Evaluation.objects.values_list(
+        "hashed_api_key", "num_examples"
+    ).get(eval_id=eval_id)
+    jobs = [
+        {"id": uuid.uuid4().hex, "task": task.name, "args": args} for args in args_list
+    ]
+    try:
+        submit_jobs(
+            eval_id,
+            hashed_api_key or "",
+            num_examples <= settings.SCHEDULER_SMALL_EVALUATION_SIZE,
+            jobs,
+        )
+    except redis.RedisError as e:
+        print(f"Failed to schedule {task.name} jobs, sending them directly: {e}")
+        for args in args_list:
+            task.delay(*args)
+        return
+
+    dispatch_jobs()
+
+
+def submit_jobs(
+    eval_id: str, user: str, small: bool, jobs: list[dict], prefix: str = PREFIX
+):
+    _script(SUBMIT_SCRIPT)(
+        args=[prefix, eval_id, user, int(small), *(json.dumps(job) for job in jobs)]
+    )
+
+
+def next_job(prefix: str = PREFIX) -> dict | None:
+    """Take the next job to run, if a worker slot is free."""
+    job = _script(DISPATCH_SCRIPT)(
+        args=[
+            prefix,
+            settings.SCHEDULER_MAX_DISPATCHED,
+            settings.SCHEDULER_JOB_LEASE,
+            settings.SCHEDULER_SMALL_BURST,
+        ]
+    )
+    return json.loads(job) if job else None
+
+
+def release_job(job_id: str, prefix: str = PREFIX):
+    get_redis().zrem(f"{prefix}:dispatched", job_id)
+
+
+@shared_task
+def dispatch_jobs():
+    """Send jobs to Celery until every worker slot is taken. Runs whenever
+    jobs are scheduled or finish, and every SCHEDULER_TICK seconds from
+    celery beat to recover slots whose jobs were lost."""
+    try:
+        while job := next_job():
+            run_job.delay(job["id"], job["task"], job["args"])
+    except redis.RedisError as e:
+        print(f"Failed to dispatch scheduled jobs: {e}")
+
+
+@shared_task
+def run_job(job_id: str, task_name: str, args: list):
+    try:
+        current_app.tasks[task_name](*args)
+    finally:
+        release_job(job_id)
+        dispatch_jobs()
+
+
+def scheduler_stats() -> dict[str, int]:
+    redis_client = get_redis()
+    waiting = sum(
+        redis_client.llen(key) for key in redis_client.scan_iter(f"{PREFIX}:jobs:*")
+    )
+    return {
+        "waiting_jobs": waiting,
+        "running_jobs": redis_client.zcard(f"{PREFIX}:dispatched"),
+    }
@@ -6,38 +6,31 @@ function DataForm() {
 
     const handleSubmit = async (e) => {
         e.preventDefault();
-        const reader = new FileReader();
-        reader.onload = async (event) => {
-            const fileContent = event.target.result;
-            const jsonlData = fileContent.split('\n').filter(line => line.trim()).map(JSON.parse);
 
-            const requestData = {
-                api_key: apiKey,
-                title: title,
-                data: jsonlData,
-                eval_models: models,
-            };
+        // Stream the file as multipart instead of parsing it in the browser
+        const formData = new FormData();
+        formData.append('api_key', apiKey);
+        formData.append('title', title);
+        models.forEach(model => formData.append('eval_models', model));
+        formData.append('data', data);
 
-            try {
-                const response = await fetch('/api/evaluate-images', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json',
-                    },
-                    body: JSON.stringify(requestData),
-                });
-                if (response.ok) {
-                    const result = await response.json();
-                    window.location.href = result.results_url;
-                } else {
-                    const error = await response.json();
-                    alert(`Error: ${error.error}`);
-                }
-            } catch (error) {
-                alert(`Error: ${error.message}`);
+        try {
+            const response = await fetch('/api/evaluate-images/upload', {
+                method: 'POST',
+                body: formData,
+            });
+            const result = await response.json();
+            if (response.ok) {
+                window.location.href = result.results_url;
+            } else if (result.results_url) {
+                alert(`Error: ${result.error}\n\n${result.num_rows} rows before line ${result.line_number} were accepted.`);
+                window.location.href = result.results_url;
+            } else {
+                alert(`Error: ${result.error}`);
             }
-        };
-        reader.readAsText(data);
+        } catch (error) {
+            alert(`Error: ${error.message}`);
+        }
     };
 
     return (
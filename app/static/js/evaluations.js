@@ -88,7 +88,10 @@ function EvaluationCard({ evaluation }) {
                 </a>
             </h3>
             <p className="text-sm text-gray-600 mb-2">Created: {formattedDate}</p>
-            <p className="text-md text-gray-600 mb-2">{evaluation.num_rows} rows</p>
+            <p className="text-md text-gray-600 mb-2">
+                {evaluation.num_rows} rows
+                {!evaluation.completed && ` (${evaluation.progress.num_scored_rows} scored)`}
+            </p>
             <div className="flex flex-wrap gap-2">
                 {evaluation.enabled_models.map((model) => (
                     <span
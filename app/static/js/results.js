@@ -1,12 +1,18 @@
+// Rows fetched per page of the results API
+const PAGE_SIZE = 100;
+
 function ResultsPage() {
+  const urlParams = new URLSearchParams(window.location.search);
   const [title, setTitle] = React.useState(null);
   const [results, setResults] = React.useState(null);
+  const [numRows, setNumRows] = React.useState(0);
   const [enabledModels, setEnabledModels] = React.useState([]);
   const [modalImage, setModalImage] = React.useState(null);
   const [currentRowIndex, setCurrentRowIndex] = React.useState(0);
   const [currentImageIndex, setCurrentImageIndex] = React.useState(0);
-  const [promptFilter, setPromptFilter] = React.useState('');
-  const [hideScores, setHideScores] = React.useState(false);
+  const [promptFilter, setPromptFilter] = React.useState(() => urlParams.get('filter') || '');
+  const [sortBy, setSortBy] = React.useState(() => urlParams.get('sort') || '');
+  const [hideScores, setHideScores] = React.useState(() => urlParams.get('hideScores') === 'true');
   const [numColumns, setNumColumns] = React.useState(0);
   const [hasAnyScores, setHasAnyScores] = React.useState(false);
 
@@ -23,16 +29,14 @@ function ResultsPage() {
   };
 
   React.useEffect(() => {
-    // Read values from URL when component mounts
-    const urlParams = new URLSearchParams(window.location.search);
-    const filterParam = urlParams.get('filter');
-    const hideScoresParam = urlParams.get('hideScores');
-
-    if (filterParam) setPromptFilter(filterParam);
-    if (hideScoresParam) setHideScores(hideScoresParam === 'true');
-
-    fetchResults();
-  }, []);
+    // Filtering and sorting happen on the server, so start over from the
+    // first page whenever they change (debounced while typing)
+    const timeout = setTimeout(() => {
+      queryRef.current = { filter: promptFilter.trim(), sort: sortBy };
+      loadPage(1);
+    }, results ? 300 : 0);
+    return () => clearTimeout(timeout);
+  }, [promptFilter, sortBy]);
 
   React.useEffect(() => {
     // Update URL when controls change
@@ -44,6 +48,12 @@ function ResultsPage() {
       urlParams.delete('filter');
     }
 
+    if (sortBy) {
+      urlParams.set('sort', sortBy);
+    } else {
+      urlParams.delete('sort');
+    }
+
     if (hideScores) {
       urlParams.set('hideScores', 'true');
     } else {
@@ -52,7 +62,7 @@ function ResultsPage() {
 
     const newUrl = `${window.location.pathname}?${urlParams.toString()}`;
     window.history.replaceState({}, '', newUrl);
-  }, [promptFilter, hideScores]);
+  }, [promptFilter, sortBy, hideScores]);
 
   React.useEffect(() => {
     window.addEventListener('keydown', handleKeyDown);
@@ -86,11 +96,70 @@ function ResultsPage() {
     setModalImage(results[newRowIndex].images[newImageIndex].url);
   };
 
+  // Filter and sort of the loaded pages, and how far they have been loaded
+  const queryRef = React.useRef(null);
+  const pageRef = React.useRef(0);
+  const numPagesRef = React.useRef(0);
+  const loadingRef = React.useRef(false);
+  // Cursor and ETag of the last response, for delta polling
+  const cursorRef = React.useRef(null);
+  const etagRef = React.useRef(null);
+  const rowsRef = React.useRef([]);
+  // Server-sent events replace polling where available
+  const eventSourceRef = React.useRef(null);
+  const streamFailedRef = React.useRef(false);
+
+  const scheduleFetch = () => {
+    setTimeout(() => {
+      fetchResults();
+    }, 5000);  // Poll every 5 seconds
+  };
+
+  const loadPage = async (page) => {
+    const query = queryRef.current;
+    loadingRef.current = true;
+    try {
+      const params = new URLSearchParams({ limit: PAGE_SIZE, page, format: 'columnar' });
+      if (query.filter) params.set('q', query.filter);
+      if (query.sort) params.set('sort', query.sort);
+      const response = await fetch(`/api/results/${evalId}/?${params}`);
+      if (!response.ok) {
+        console.error('Failed to fetch results');
+        return;
+      }
+      const data = await response.json();
+      if (query !== queryRef.current) return;  // Superseded by a newer filter or sort
+      data.rows = fromColumnar(data.columns);
+
+      pageRef.current = data.page;
+      numPagesRef.current = data.num_pages;
+      setNumRows(data.num_rows);
+      if (!cursorRef.current) cursorRef.current = data.cursor;
+      handleResults(data, page > 1);
+    } catch (error) {
+      console.error('Error fetching results:', error);
+    } finally {
+      if (query === queryRef.current) loadingRef.current = false;
+    }
+  };
+
+  const loadMore = () => {
+    if (loadingRef.current || pageRef.current >= numPagesRef.current) return;
+    loadPage(pageRef.current + 1);
+  };
+
   const fetchResults = async () => {
+    if (!cursorRef.current) return;
     try {
-      const response = await fetch(`/api/results/${evalId}/`);
-      if (response.ok) {
+      const url = `/api/results/${evalId}/?since=${cursorRef.current}`;
+      const headers = etagRef.current ? { 'If-None-Match': etagRef.current } : {};
+      const response = await fetch(url, { headers });
+      if (response.status === 304) {
+        if (!eventSourceRef.current) scheduleFetch();
+      } else if (response.ok) {
         const data = await response.json();
+        etagRef.current = response.headers.get('ETag');
+        cursorRef.current = data.cursor;
         handleResults(data);
       } else {
         console.error('Failed to fetch results');
@@ -101,25 +170,85 @@ function ResultsPage() {
     }
   };
 
-  const handleResults = (results) => {
-    setNumColumns(getNumColumns(results));
+  const startStream = () => {
+    const eventSource = new EventSource(`/api/results/${evalId}/events`);
+    eventSourceRef.current = eventSource;
+
+    // Catch up on anything missed before (re)connecting
+    eventSource.onopen = () => fetchResults();
+    eventSource.onmessage = (event) => handleResults(JSON.parse(event.data));
+    eventSource.addEventListener('resync', () => fetchResults());
+    eventSource.onerror = () => {
+      if (eventSource.readyState === EventSource.CLOSED) {
+        eventSourceRef.current = null;
+        streamFailedRef.current = true;
+        scheduleFetch();
+      }
+    };
+  };
+
+  const stopStream = () => {
+    if (eventSourceRef.current) {
+      eventSourceRef.current.close();
+      eventSourceRef.current = null;
+    }
+  };
+
+  const mergeRows = (rows, changedRows) => {
+    // Changed rows replace loaded ones in place. Rows that were not loaded
+    // are only added once every page is, and only in the default order,
+    // since only then is their position known.
+    const changed = new Map(changedRows.map(row => [row.id, row]));
+    const merged = rows.map(row => {
+      const changedRow = changed.get(row.id);
+      changed.delete(row.id);
+      return changedRow || row;
+    });
+    const query = queryRef.current;
+    if (pageRef.current >= numPagesRef.current && !query.filter && !query.sort && changed.size) {
+      return merged.concat(Array.from(changed.values())).sort((a, b) => a.id - b.id);
+    }
+    return merged;
+  };
+
+  const appendRows = (rows, pageRows) => {
+    const loaded = new Set(rows.map(row => row.id));
+    return rows.concat(pageRows.filter(row => !loaded.has(row.id)));
+  };
+
+  const handleResults = (results, nextPage = false) => {
+    let rows;
+    if (results.delta) {
+      rows = mergeRows(rowsRef.current, results.rows);
+    } else if (nextPage) {
+      rows = appendRows(rowsRef.current, results.rows);
+    } else {
+      rows = results.rows;
+    }
+    rowsRef.current = rows;
+
+    setNumColumns(getNumColumns({ rows }));
 
     setTitle(results.title);
-    setResults(results.rows);
+    setResults(rows);
     setEnabledModels(results.enabled_models || []);
 
     // Check if any rows have any images with any scores
-    const anyScores = results.rows.some(row =>
+    const anyScores = rows.some(row =>
       row.images.some(image =>
         Object.values(image.scores || {}).some(score => score !== null)
       )
     );
     setHasAnyScores(anyScores);
 
-    if (!results.completed) {
-      setTimeout(() => {
-        fetchResults();
-      }, 5000);  // Poll every 5 seconds
+    if (results.completed) {
+      stopStream();
+    } else if (!eventSourceRef.current) {
+      if (window.EventSource && !streamFailedRef.current) {
+        startStream();
+      } else {
+        scheduleFetch();
+      }
     }
   };
 
@@ -131,17 +260,6 @@ function ResultsPage() {
     }
   };
 
-  const filterResults = (results) => {
-    if (!results) return [];
-    return results.filter(row =>
-      !promptFilter || (row.prompt && row.prompt.toLowerCase().includes(promptFilter.toLowerCase()))
-    );
-  };
-
-  React.useEffect(() => {
-    fetchResults();
-  }, []);
-
   if (!results) {
     return <LoadingMessage />;
   }
@@ -153,21 +271,29 @@ function ResultsPage() {
         <Controls
           promptFilter={promptFilter}
           setPromptFilter={setPromptFilter}
+          sortBy={sortBy}
+          setSortBy={setSortBy}
+          enabledModels={enabledModels}
+          numRows={numRows}
           hideScores={hideScores}
           setHideScores={setHideScores}
           hasAnyScores={hasAnyScores}
         />
       </div>
-      {filterResults(results).map((row, rowIndex) => (
-        <ResultRow
-          key={rowIndex}
-          row={row}
-          enabledModels={enabledModels}
-          selectImage={selectImage}
-          rowIndex={rowIndex}
-          hideScores={hideScores}
-        />
-      ))}
+      <VirtualList
+        items={results}
+        getKey={row => row.id}
+        onNearEnd={loadMore}
+        renderItem={(row, rowIndex) => (
+          <ResultRow
+            row={row}
+            enabledModels={enabledModels}
+            selectImage={selectImage}
+            rowIndex={rowIndex}
+            hideScores={hideScores}
+          />
+        )}
+      />
       {modalImage && (
         <ImageModal
           image={modalImage}
@@ -179,6 +305,120 @@ function ResultsPage() {
   );
 }
 
+// Renders only the items in and near the viewport, with spacers standing in
+// for the rest, so that the page stays fast however many rows are loaded.
+// Item heights are measured once rendered and estimated until then.
+function VirtualList({ items, getKey, renderItem, onNearEnd, estimatedHeight = 500, overscan = 1000 }) {
+  const containerRef = React.useRef(null);
+  const heightsRef = React.useRef(new Map());
+  const [, setMeasured] = React.useState(0);
+  const [viewport, setViewport] = React.useState({ top: 0, height: window.innerHeight });
+
+  React.useEffect(() => {
+    const update = () => {
+      if (!containerRef.current) return;
+      const top = -containerRef.current.getBoundingClientRect().top;
+      setViewport({ top, height: window.innerHeight });
+    };
+    update();
+    window.addEventListener('scroll', update, { passive: true });
+    window.addEventListener('resize', update);
+    return () => {
+      window.removeEventListener('scroll', update);
+      window.removeEventListener('resize', update);
+    };
+  }, []);
+
+  const onResize = React.useCallback((key, height) => {
+    if (heightsRef.current.get(key) !== height) {
+      heightsRef.current.set(key, height);
+      setMeasured(n => n + 1);
+    }
+  }, []);
+
+  const windowTop = viewport.top - overscan;
+  const windowBottom = viewport.top + viewport.height + overscan;
+  let offset = 0;
+  let start = items.length;
+  let end = items.length;
+  let paddingTop = 0;
+  for (let i = 0; i < items.length; i++) {
+    const height = heightsRef.current.get(getKey(items[i])) ?? estimatedHeight;
+    if (start === items.length && offset + height > windowTop) {
+      start = i;
+      paddingTop = offset;
+    }
+    if (offset > windowBottom) {
+      end = i;
+      break;
+    }
+    offset += height;
+  }
+  if (start === items.length) paddingTop = offset;
+  let totalHeight = offset;
+  for (let i = end; i < items.length; i++) {
+    totalHeight += heightsRef.current.get(getKey(items[i])) ?? estimatedHeight;
+  }
+  const paddingBottom = totalHeight - offset;
+
+  React.useEffect(() => {
+    if (end >= items.length - 10) onNearEnd();
+  }, [end, items.length]);
+
+  return (
+    <div ref={containerRef} style={{ paddingTop, paddingBottom }}>
+      {items.slice(start, end).map((item, i) => (
+        <MeasuredItem key={getKey(item)} itemKey={getKey(item)} onResize={onResize}>
+          {renderItem(item, start + i)}
+        </MeasuredItem>
+      ))}
+    </div>
+  );
+}
+
+function MeasuredItem({ itemKey, onResize, children }) {
+  const ref = React.useRef(null);
+
+  React.useLayoutEffect(() => {
+    const element = ref.current;
+    onResize(itemKey, element.offsetHeight);
+    if (!window.ResizeObserver) return;
+    const observer = new ResizeObserver(() => onResize(itemKey, element.offsetHeight));
+    observer.observe(element);
+    return () => observer.disconnect();
+  }, [itemKey]);
+
+  // flow-root keeps the row's bottom margin inside the measured height
+  return <div ref={ref} style={{ display: 'flow-root' }}>{children}</div>;
+}
+
+// Expand the results API's format=columnar payload into its rows format
+function fromColumnar({ rows, images, gen_models, label_sets }) {
+  const rowsData = rows.id.map((id, i) => ({
+    id,
+    prompt: rows.prompt[i],
+    seed: rows.seed[i],
+    images: [],
+  }));
+  images.id.forEach((id, i) => {
+    const labels = { ...label_sets[images.labels[i]] };
+    if (images.predict_time[i] !== null) labels.predict_time = images.predict_time[i];
+    const scores = {};
+    Object.entries(images.scores).forEach(([model, modelScores]) => {
+      scores[model] = modelScores[i];
+    });
+    rowsData[images.row[i]].images.push({
+      id,
+      url: images.url[i],
+      labels,
+      scores,
+      gen_prediction_id: images.gen_prediction_id[i],
+      gen_model: images.gen_model[i] === null ? null : gen_models[images.gen_model[i]],
+    });
+  });
+  return rowsData;
+}
+
 function getNumColumns(results) {
   if (!results || !results.rows || results.rows.length === 0) {
     return 0;
@@ -411,7 +651,7 @@ function ScoreItem({ model, score, rowImages }) {
   );
 }
 
-function Controls({ promptFilter, setPromptFilter, hideScores, setHideScores, hasAnyScores }) {
+function Controls({ promptFilter, setPromptFilter, sortBy, setSortBy, enabledModels, numRows, hideScores, setHideScores, hasAnyScores }) {
   return (
     <div>
       <div className="flex items-center space-x-4 mb-3">
@@ -424,6 +664,23 @@ function Controls({ promptFilter, setPromptFilter, hideScores, setHideScores, ha
             className="p-1 border border-gray-300 rounded"
           />
         </div>
+        {hasAnyScores && (
+          <div className="flex items-center space-x-2">
+            <label htmlFor="sortBy" className="text-sm ml-5">Sort by</label>
+            <select
+              id="sortBy"
+              value={sortBy}
+              onChange={(e) => setSortBy(e.target.value)}
+              className="p-1 border border-gray-300 rounded"
+            >
+              <option value="">Default order</option>
+              {enabledModels.flatMap(model => [
+                <option key={model} value={model}>Lowest {model} first</option>,
+                <option key={`-${model}`} value={`-${model}`}>Highest {model} first</option>,
+              ])}
+            </select>
+          </div>
+        )}
         {hasAnyScores && (
           <div className="flex items-center space-x-2">
             <label htmlFor="hideScores" className="text-sm ml-5">Hide scores</label>
@@ -436,6 +693,7 @@ function Controls({ promptFilter, setPromptFilter, hideScores, setHideScores, ha
             />
           </div>
         )}
+        <p className="text-sm ml-5">{numRows} rows</p>
       </div>
     </div>
   );
@@ -1,18 +1,35 @@
 from typing import cast
-from urllib.parse import urlparse
-import os
-from collections.abc import Iterator
-from contextlib import contextmanager
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 import hashlib
 import json
-import tempfile
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
 import requests
+from requests.adapters import HTTPAdapter
 from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Prefetch
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from celery import shared_task
 import replicate
-from .models import Evaluation, Row, Example, ModelScore
-from .encryption import decrypt_key
+from replicate.exceptions import ReplicateError
+from replicate.prediction import Prediction as ReplicatePrediction
+import redis
+from .models import Evaluation, Row, Example, ModelScore, Prediction, CachedPrediction
+from . import throttle
+from .aggregates import image_predict_time, update_aggregates
+from .clients import get_client
+from .events import publish_rows
+from .progress import expected_scores_for, update_progress
+from .redis_client import get_redis
+from .scheduler import schedule
+from .versions import resolve_version
+from .webhooks import webhook_url
 
 s3 = boto3.client(
     "s3",
@@ -20,72 +37,345 @@ s3 = boto3.client(
     region_name=settings.AWS_REGION,
     aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
     aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+    config=Config(
+        max_pool_connections=settings.TRANSFER_CONCURRENCY
+        * settings.TRANSFER_PART_CONCURRENCY
+    ),
 )
 
+# Multipart uploads read the source in bounded parts, so memory per
+# transfer is at most TRANSFER_CHUNK_SIZE * TRANSFER_PART_CONCURRENCY
+transfer_config = TransferConfig(
+    multipart_threshold=settings.TRANSFER_CHUNK_SIZE,
+    multipart_chunksize=settings.TRANSFER_CHUNK_SIZE,
+    max_concurrency=settings.TRANSFER_PART_CONCURRENCY,
+)
+
+# Pooled keep-alive connections for downloading prediction outputs
+http = requests.Session()
+http_adapter = HTTPAdapter(
+    pool_connections=settings.TRANSFER_CONCURRENCY,
+    pool_maxsize=settings.TRANSFER_CONCURRENCY,
+)
+http.mount("https://", http_adapter)
+http.mount("http://", http_adapter)
+
+CHUNK_SIZE = 100
+# Seconds that rows waiting for a chunk are kept in Redis
+COMPLETED_ROWS_TTL = 24 * 60 * 60
+SCORE_BATCH_SIZE = 1000
+FLASH_EVAL_MODELS = {"ImageReward", "Aesthetic", "CLIP", "BLIP", "PickScore"}
+
+TERMINAL_STATUSES = ["succeeded", "failed", "canceled"]
+# Evaluation predictions that are tracked but not yet created on Replicate
+DEFERRED = "deferred"
+
 
 @shared_task
 def evaluate_chunk(api_key, eval_id, row_ids):
     evaluation = Evaluation.objects.get(eval_id=eval_id)
     models = evaluation.enabled_models
-    rows = Row.objects.filter(id__in=row_ids).prefetch_related("examples")
 
-    client = replicate.Client(api_token=decrypt_key(api_key))
+    # Claim the rows. A redelivered task sees them as evaluating already
+    # and relies on the idempotency keys below instead.
+    Row.objects.filter(id__in=row_ids, status=Row.GENERATED).update(
+        status=Row.EVALUATING
+    )
+    rows = list(
+        Row.objects.filter(id__in=row_ids, status=Row.EVALUATING)
+        .order_by("id")
+        .prefetch_related(Prefetch("examples", queryset=Example.objects.order_by("id")))
+    )
+
+    # Rows where every generation failed have nothing to score
+    empty_row_ids = [
+        row.id for row in rows if not any(e.image_url for e in row.examples.all())
+    ]
+    num_scored = Row.objects.filter(id__in=empty_row_ids, status=Row.EVALUATING).update(
+        status=Row.SCORED
+    )
+    update_progress(evaluation, num_scored_rows=num_scored)
+    publish_rows(evaluation, empty_row_ids)
+    rows = [row for row in rows if row.id not in empty_row_ids]
+    if not rows:
+        return
 
+    run_flash_eval = bool(set(models) & FLASH_EVAL_MODELS)
+    if "DreamSim" not in models and not run_flash_eval:
+        row_ids = [row.id for row in rows]
+        num_scored = Row.objects.filter(id__in=row_ids, status=Row.EVALUATING).update(
+            status=Row.SCORED
+        )
+        update_progress(evaluation, num_scored_rows=num_scored)
+        publish_rows(evaluation, row_ids)
+        return
+
+    client = get_client(api_key)
+    image_counts = [
+        sum(1 for example in row.examples.all() if example.image_url) for row in rows
+    ]
+
+    # Record every prediction the chunk needs before creating any, so that
+    # its rows are not scored until all of them have been created and have
+    # finished, even if some are deferred
+    kinds = []
     if "DreamSim" in models:
-        dreamsim_prediction = dreamsim_create_prediction(client, rows)
-        poll_eval_prediction.delay(api_key, eval_id, dreamsim_prediction.id, "DreamSim")
+        kinds.append("DreamSim")
+    if run_flash_eval:
+        kinds.append("FlashEval")
+    reserve_chunk_predictions(evaluation, api_key, kinds, [row.id for row in rows])
+
+    # Redelivered and deferred tasks create no predictions twice, so expect
+    # their scores once
+    try:
+        if "DreamSim" in models:
+            if dreamsim_create_prediction(client, api_key, evaluation, rows):
+                update_progress(
+                    evaluation,
+                    expected_scores=expected_scores_for(["DreamSim"], image_counts),
+                )
 
-    if set(models) & {"ImageReward", "Aesthetic", "CLIP", "BLIP", "PickScore"}:
-        flash_eval_prediction = flash_eval_create_prediction(client, rows, models)
-        poll_eval_prediction.delay(
-            api_key, eval_id, flash_eval_prediction.id, "FlashEval"
+        if run_flash_eval:
+            if flash_eval_create_prediction(client, api_key, evaluation, rows, models):
+                flash_eval_models = [m for m in models if m != "DreamSim"]
+                update_progress(
+                    evaluation,
+                    expected_scores=expected_scores_for(
+                        flash_eval_models, image_counts
+                    ),
+                )
+    except throttle.Throttled as e:
+        print(f"Deferring evaluation of chunk by {e.retry_after:.1f}s: {e}")
+        throttle.record_deferral(e.retry_after)
+        evaluate_chunk.apply_async(
+            args=[api_key, eval_id, row_ids], countdown=e.retry_after
         )
 
 
 @shared_task
 def generate_image(api_key, example_id, model, inputs):
-    client = replicate.Client(api_token=decrypt_key(api_key))
-    example = Example.objects.get(id=example_id)
-
-    model_owner, model_name = model.split("/")
-    model_name, model_version = (
-        model_name.split(":") if ":" in model_name else (model_name, None)
+    """Single-example generate_images, for tasks queued before batching."""
+    eval_id = Evaluation.objects.values_list("eval_id", flat=True).get(
+        rows__examples__id=example_id
     )
+    generate_images(api_key, eval_id, model, [(example_id, inputs)])
 
-    if model_version:
-        version = client.models.get(f"{model_owner}/{model_name}").versions.get(
-            model_version
+
+@shared_task
+def generate_images(api_key, eval_id, model, jobs):
+    """Generate images for a batch of (example_id, inputs) of one evaluation
+    and model: the version is resolved once, the cache is checked for the
+    whole batch in one query, and the predictions for cache misses are
+    created concurrently over one client's pooled connections.
+
+    Examples that already have an image or a prediction, e.g. from an
+    earlier delivery of this task, are skipped.
+    """
+    client = get_client(api_key)
+    evaluation = Evaluation.objects.get(eval_id=eval_id)
+    version_id = resolve_version(client, model)
+
+    started = set(
+        Prediction.objects.filter(
+            example_id__in=[example_id for example_id, _ in jobs], kind="generation"
+        ).values_list("example_id", flat=True)
+    )
+    examples = Example.objects.in_bulk(
+        [example_id for example_id, _ in jobs if example_id not in started]
+    )
+    cache_keys = {
+        example_id: f"{version_id}/{compute_input_hash(inputs)}"
+        for example_id, inputs in jobs
+    }
+    cached = get_cached_predictions([cache_keys[example_id] for example_id in examples])
+
+    uncached = []
+    for example_id, inputs in jobs:
+        example = examples.get(example_id)
+        if example is None or example.image_url or example.gen_prediction_failed:
+            continue
+
+        cache_key = cache_keys[example_id]
+        if cache_key in cached:
+            print(f"Found cached image for {cache_key}")
+            use_cached_prediction(api_key, example_id, cache_key, cached[cache_key])
+        else:
+            uncached.append((example, inputs, cache_key))
+
+    deferred = []
+
+    def create_in_thread(job):
+        example, inputs, cache_key = job
+        try:
+            prediction = create_prediction(
+                client,
+                api_key,
+                evaluation,
+                "generation",
+                version=version_id,
+                input=inputs,
+                example=example,
+                model=model,
+                cache_key=cache_key,
+            )
+            Example.objects.filter(id=example.id).update(
+                gen_prediction_id=prediction.id
+            )
+        except throttle.Throttled as e:
+            deferred.append((example.id, inputs, e.retry_after))
+        except Exception as e:
+            print(f"Failed to create prediction for example {example.id}: {e}")
+            with transaction.atomic():
+                example.gen_prediction_failed = True
+                example.save(update_fields=["gen_prediction_failed"])
+                example_done(api_key, example)
+        finally:
+            connection.close()
+
+    print(f"Generating {len(uncached)} predictions with {model}")
+    with ThreadPoolExecutor(max_workers=settings.GENERATE_CONCURRENCY) as executor:
+        list(executor.map(create_in_thread, uncached))
+    publish_rows(evaluation, {example.row_id for example, _, _ in uncached})
+
+    if deferred:
+        retry_after = max(wait for _, _, wait in deferred)
+        print(f"Deferring {len(deferred)} predictions by {retry_after:.1f}s")
+        throttle.record_deferral(retry_after, len(deferred))
+        generate_images.apply_async(
+            args=[api_key, eval_id, model, [job[:2] for job in deferred]],
+            countdown=retry_after,
         )
-    else:
-        version = client.models.get(f"{model_owner}/{model_name}").latest_version
 
-    # Compute hash for caching
-    input_hash = compute_input_hash(inputs)
-    cache_key = f"{version.id}/{input_hash}"
 
-    # Check if output is cached
-    output_url, labels, prediction_id = get_cached_prediction(cache_key)
-    if output_url:
-        print(f"Found cached image at {output_url}")
-        example.image_url = output_url
-        example.labels = labels
-        example.gen_prediction_id = prediction_id
-        example.save()
+def use_cached_prediction(
+    api_key: str, example_id: int, cache_key: str, cached: CachedPrediction
+):
+    with transaction.atomic():
+        example = Example.objects.select_for_update().get(id=example_id)
+        if example.image_url:
+            return  # Already done by an earlier delivery of this task
 
-        row = example.row
-        if row_is_complete(row):
-            eval_id = row.evaluation.eval_id
-            evaluate_chunk.delay(api_key, eval_id, [row.id])
+        example.image_url = cached_url(cache_key, cached.file_extension)
+        example.labels = cached.labels
+        example.gen_prediction_id = cached.prediction_id
+        example.save()
 
+        record_predict_time(example)
+        example_done(api_key, example)
+
+
+def create_prediction(
+    client: replicate.Client,
+    api_key: str,
+    evaluation: Evaluation,
+    kind: str,
+    version: str,
+    input: dict,
+    example: Example | None = None,
+    model: str | None = None,
+    cache_key: str | None = None,
+    row_ids: list[int] | None = None,
+):
+    """Create a Replicate prediction and track it so that its completion
+    can be handled from a webhook or from poll_predictions.
+
+    Evaluation predictions are keyed on their kind and rows, and return
+    None if an earlier delivery of the same chunk already created one.
+
+    Raises Throttled, without creating anything, if the API key is over
+    its budget (see throttle.acquire) or Replicate rate limits it. An
+    evaluation prediction is then left deferred, for a retry to create.
+    """
+    next_poll_at = timezone.now() + timedelta(seconds=next_poll_delay(0))
+    if row_ids is None:
+        tracked = Prediction.objects.create(
+            evaluation=evaluation,
+            example=example,
+            kind=kind,
+            model=model,
+            cache_key=cache_key,
+            input=input,
+            api_key=api_key,
+            next_poll_at=next_poll_at,
+        )
     else:
-        print(f"Generating prediction with inputs {inputs}")
-        prediction = client.predictions.create(version=version, input=inputs)
-        example.gen_prediction_id = prediction.id
-        example.save()
-        poll_gen_prediction.apply_async(
-            args=[api_key, example_id, prediction.id, model, cache_key],
-            countdown=2,
+        reserve_chunk_predictions(evaluation, api_key, [kind], row_ids)
+        idempotency_key = chunk_idempotency_key(evaluation.eval_id, kind, row_ids)
+        claimed = Prediction.objects.filter(
+            idempotency_key=idempotency_key, status=DEFERRED
+        ).update(
+            status="starting", next_poll_at=next_poll_at, updated_at=timezone.now()
         )
+        if not claimed:
+            print(f"{kind} prediction for chunk {idempotency_key} already exists")
+            return None
+        tracked = Prediction.objects.get(idempotency_key=idempotency_key)
+
+    def give_up():
+        if row_ids is None:
+            tracked.delete()
+        else:
+            # Keep the chunk's rows from being scored without this prediction
+            Prediction.objects.filter(id=tracked.id).update(
+                status=DEFERRED, updated_at=timezone.now()
+            )
+
+    try:
+        throttle.acquire(api_key, tracked.pk)
+    except throttle.Throttled:
+        give_up()
+        raise
+
+    webhook = webhook_url(tracked.pk)
+    try:
+        if webhook:
+            prediction = client.predictions.create(
+                version=version,
+                input=input,
+                webhook=webhook,
+                webhook_events_filter=["completed"],
+            )
+        else:
+            prediction = client.predictions.create(version=version, input=input)
+    except Exception as e:
+        # Let a retry create it
+        give_up()
+        throttle.release(api_key, tracked.pk)
+        if isinstance(e, ReplicateError) and e.status == 429:
+            raise throttle.Throttled(settings.REPLICATE_THROTTLE_RETRY_DELAY) from e
+        raise
+
+    # Only set the ID, a fast webhook may already have updated the status
+    Prediction.objects.filter(id=tracked.id).update(replicate_id=prediction.id)
+    return prediction
+
+
+def reserve_chunk_predictions(
+    evaluation: Evaluation, api_key: str, kinds: list[str], row_ids: list[int]
+):
+    """Track a chunk's evaluation predictions as deferred until they are
+    created. Predictions it already has are left as they are."""
+    Prediction.objects.bulk_create(
+        [
+            Prediction(
+                evaluation=evaluation,
+                kind=kind,
+                row_ids=row_ids,
+                idempotency_key=chunk_idempotency_key(
+                    evaluation.eval_id, kind, row_ids
+                ),
+                api_key=api_key,
+                status=DEFERRED,
+            )
+            for kind in kinds
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def chunk_idempotency_key(eval_id: str, kind: str, row_ids: list[int]) -> str:
+    key = f"{eval_id}:{kind}:{','.join(str(i) for i in sorted(row_ids))}"
+    return hashlib.sha256(key.encode()).hexdigest()
 
 
 def compute_input_hash(inputs):
@@ -94,24 +384,6 @@ def compute_input_hash(inputs):
     return hashlib.sha256(input_str.encode()).hexdigest()
 
 
-@shared_task
-def poll_gen_prediction(api_key, example_id, prediction_id, model, cache_key):
-    client = replicate.Client(api_token=decrypt_key(api_key))
-    prediction = client.predictions.get(prediction_id)
-
-    if prediction.status == "succeeded":
-        handle_gen_output(api_key, example_id, prediction, model, cache_key)
-    elif prediction.status in ["failed", "canceled"]:
-        example = Example.objects.get(id=example_id)
-        example.gen_prediction_failed = True
-        example.save()
-    else:
-        poll_gen_prediction.apply_async(
-            args=[api_key, example_id, prediction_id, model, cache_key],
-            countdown=10,
-        )
-
-
 def get_file_extension(output):
     if isinstance(output, list):
         url = output[0]
@@ -124,40 +396,48 @@ def get_file_extension(output):
 
 
 def cached_url(cache_key, file_extension):
-    return (
-        f"https://fly.storage.tigris.dev/img-quality-eval/{cache_key}.{file_extension}"
-    )
+    return f"{settings.CACHE_PUBLIC_URL}/{cache_key}.{file_extension}"
 
 
-def get_cached_prediction(cache_key: str) -> tuple[str | None, dict | None, str | None]:
-    try:
-        metadata_file = s3.get_object(
-            Bucket="img-quality-eval", Key=f"{cache_key}.json"
-        )
-    except:
-        return None, None, None
-
-    metadata = json.loads(metadata_file["Body"].read())
-    file_extension = metadata["file_extension"]
-    output_url = cached_url(cache_key, file_extension)
-    return output_url, metadata["labels"], metadata["prediction_id"]
+def get_cached_predictions(cache_keys: list[str]) -> dict[str, CachedPrediction]:
+    """Which of these cache keys are in the bucket, in one indexed query."""
+    cached = CachedPrediction.objects.filter(cache_key__in=cache_keys)
+    return {c.cache_key: c for c in cached}
 
 
 def cache_prediction(
     cache_key: str, output_url: str, labels: dict, prediction_id, file_extension: str
 ) -> None:
-    with download(output_url) as local_path:
-        s3.upload_file(local_path, "img-quality-eval", f"{cache_key}.{file_extension}")
+    # Stream the HTTP body straight into a multipart upload, no tempfile
+    with http.get(output_url, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        s3.upload_fileobj(
+            response.raw,
+            settings.CACHE_BUCKET,
+            f"{cache_key}.{file_extension}",
+            Config=transfer_config,
+        )
 
     metadata = {
         "labels": labels,
         "file_extension": file_extension,
         "prediction_id": prediction_id,
     }
-    with tempfile.NamedTemporaryFile(mode="w", delete=False) as temp:
-        json.dump(metadata, temp)
-        temp.flush()
-        s3.upload_file(temp.name, "img-quality-eval", f"{cache_key}.json")
+    s3.put_object(
+        Bucket=settings.CACHE_BUCKET,
+        Key=f"{cache_key}.json",
+        Body=json.dumps(metadata).encode(),
+    )
+
+    CachedPrediction.objects.update_or_create(
+        cache_key=cache_key,
+        defaults={
+            "file_extension": file_extension,
+            "labels": labels,
+            "prediction_id": prediction_id,
+        },
+    )
 
 
 def row_is_complete(row: Row):
@@ -168,72 +448,546 @@ def row_is_complete(row: Row):
     )
 
 
-def handle_gen_output(api_key, example_id, prediction, model, cache_key):
-    output = prediction.output
-
-    predict_time = prediction.metrics["predict_time"]
+@shared_task(bind=True, max_retries=3, default_retry_delay=30)
+def transfer_output(
+    self, api_key, example_id, prediction_id, output, predict_time, model, cache_key
+):
+    """Copy a generated image into the cache bucket and attach it to its
+    example. Runs on the transfers queue, so that slow downloads and uploads
+    only hold up other transfers."""
+    try:
+        handle_gen_output(
+            api_key, example_id, prediction_id, output, predict_time, model, cache_key
+        )
+    except (requests.RequestException, BotoCoreError, ClientError) as e:
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e)
+        print(f"Failed to transfer output of prediction {prediction_id}: {e}")
+        fail_example(api_key, example_id)
 
-    # Save output to cache
-    file_extension = get_file_extension(output)
 
+def handle_gen_output(
+    api_key, example_id, prediction_id, output, predict_time, model, cache_key
+):
     example = Example.objects.get(id=example_id)
+    if example.image_url or example.gen_prediction_failed:
+        return  # Already done by an earlier delivery of this task
+
     if isinstance(output, list):
         image_url = output[0]
     elif isinstance(output, str):
         image_url = output
     else:
         print(f"Unexpected output format for model {model}: {output}")
+        fail_example(api_key, example_id)
         return
 
-    labels = example.labels
-    labels["predict_time"] = predict_time
-    cache_prediction(cache_key, image_url, labels, prediction.id, file_extension)
+    # Save output to cache
+    file_extension = get_file_extension(output)
+    labels = {**example.labels, "predict_time": predict_time}
+    cache_prediction(cache_key, image_url, labels, prediction_id, file_extension)
+
+    with transaction.atomic():
+        example = Example.objects.select_for_update().get(id=example_id)
+        if example.image_url or example.gen_prediction_failed:
+            return
 
-    example.image_url = cached_url(cache_key, file_extension)
-    example.labels = labels
-    example.save()
+        example.image_url = cached_url(cache_key, file_extension)
+        example.labels = labels
+        example.save()
+
+        record_predict_time(example)
+        example_done(api_key, example)
+
+
+def fail_example(api_key: str, example_id: int):
+    with transaction.atomic():
+        example = Example.objects.select_for_update().get(id=example_id)
+        if example.image_url or example.gen_prediction_failed:
+            return
 
-    row = example.row
-    if row_is_complete(row):
-        eval_id = row.evaluation.eval_id
-        evaluate_chunk.delay(api_key, eval_id, [row.id])
+        example.gen_prediction_failed = True
+        example.save()
+        example_done(api_key, example)
+
+
+def record_predict_time(example: Example):
+    value = image_predict_time(example.labels)
+    if value is not None:
+        update_aggregates(
+            example.row.evaluation,
+            [("predict_time", value, example.gen_model, example.labels, 1)],
+        )
 
 
-def dreamsim_create_prediction(client: replicate.Client, rows):
+def example_done(api_key: str, example: Example):
+    """Queue the example's row for evaluation if this was its last example."""
+    evaluation = example.row.evaluation
+    publish_rows(evaluation, [example.row_id])
+
+    if mark_row_generated(example.row_id):
+        eval_id = evaluation.eval_id
+        row_id = example.row_id
+        transaction.on_commit(lambda: add_completed_row(api_key, eval_id, row_id))
+
+    update_progress(
+        evaluation,
+        num_generated=1 if example.image_url else 0,
+        num_failed=1 if example.gen_prediction_failed else 0,
+    )
+
+
+def mark_row_generated(row_id: int) -> bool:
+    """Move a row from pending to generated once every example has an
+    image or has failed. Returns True for exactly one caller per row,
+    however many examples of the row complete concurrently."""
+    with transaction.atomic():
+        row = Row.objects.select_for_update().get(id=row_id)
+        if row.status != Row.PENDING or not row_is_complete(row):
+            return False
+
+        row.status = Row.GENERATED
+        row.save(update_fields=["status"])
+        return True
+
+
+def mark_rows_scored(tracked: Prediction) -> int:
+    """Move the chunk's rows to scored once all of its evaluation
+    predictions have finished, returning how many were moved. Must be
+    called inside a transaction."""
+    # Lock the rows so that the chunk's DreamSim and FlashEval completions
+    # serialize here, and the second one sees the first as finished
+    list(
+        Row.objects.select_for_update()
+        .filter(id__in=tracked.row_ids)
+        .order_by("id")
+        .values_list("id", flat=True)
+    )
+    unfinished = (
+        Prediction.objects.filter(
+            evaluation_id=tracked.evaluation_id, row_ids=tracked.row_ids
+        )
+        .exclude(id=tracked.id)
+        .exclude(kind="generation")
+        .exclude(status__in=TERMINAL_STATUSES)
+    )
+    if unfinished.exists():
+        return 0
+    return Row.objects.filter(id__in=tracked.row_ids, status=Row.EVALUATING).update(
+        status=Row.SCORED
+    )
+
+
+def add_completed_row(api_key: str, eval_id: str, row_id: int):
+    """Queue a generated row for evaluation.
+
+    Rows are evaluated in chunks of CHUNK_SIZE, or whatever has
+    accumulated after ROW_LINGER_SECONDS, rather than one prediction per
+    row per evaluation model. If Redis is unavailable, the row is
+    evaluated on its own.
+    """
+    redis_client = get_redis()
+    key = f"completed_rows:{eval_id}"
+
+    try:
+        pipe = redis_client.pipeline()
+        pipe.rpush(key, row_id)
+        pipe.expire(key, COMPLETED_ROWS_TTL)
+        # For flush_stranded_rows, should the linger flush be lost
+        pipe.set(f"{key}:api_key", api_key, ex=COMPLETED_ROWS_TTL)
+        length, _, _ = pipe.execute()
+    except redis.RedisError as e:
+        print(f"Failed to queue row {row_id} for evaluation, evaluating it now: {e}")
+        schedule(eval_id, evaluate_chunk, [[api_key, eval_id, [row_id]]])
+        return
+
+    if length >= CHUNK_SIZE:
+        flush_completed_rows(api_key, eval_id, full_chunks_only=True)
+    elif redis_client.set(
+        f"{key}:scheduled", 1, nx=True, ex=settings.ROW_LINGER_SECONDS * 10
+    ):
+        flush_completed_rows.apply_async(
+            args=[api_key, eval_id], countdown=settings.ROW_LINGER_SECONDS
+        )
+
+
+@shared_task
+def flush_completed_rows(api_key: str, eval_id: str, full_chunks_only=False):
+    redis_client = get_redis()
+    key = f"completed_rows:{eval_id}"
+
+    if not full_chunks_only:
+        # Clear the flag first so rows added after the pops below schedule
+        # a new linger flush instead of being stranded
+        redis_client.delete(f"{key}:scheduled")
+
+    chunks = []
+    while not full_chunks_only or redis_client.llen(key) >= CHUNK_SIZE:
+        # MULTI/EXEC, so concurrent flushes never share rows
+        pipe = redis_client.pipeline()
+        pipe.lrange(key, 0, CHUNK_SIZE - 1)
+        pipe.ltrim(key, CHUNK_SIZE, -1)
+        row_ids, _ = pipe.execute()
+        if not row_ids:
+            break
+
+        chunks.append([api_key, eval_id, [int(row_id) for row_id in row_ids]])
+        if len(row_ids) < CHUNK_SIZE:
+            break
+    schedule(eval_id, evaluate_chunk, chunks)
+
+
+@shared_task
+def flush_stranded_rows():
+    """Flush completed rows whose linger flush was lost, with a worker or
+    the broker, once its flag has expired. Runs every ROW_FLUSH_TICK
+    seconds from celery beat."""
+    redis_client = get_redis()
+    for key in redis_client.scan_iter("completed_rows:*"):
+        key = key.decode()
+        if key.endswith((":scheduled", ":api_key")):
+            continue
+        if redis_client.exists(f"{key}:scheduled"):
+            continue
+
+        eval_id = key.removeprefix("completed_rows:")
+        api_key = redis_client.get(f"{key}:api_key")
+        if api_key is None:
+            print(f"No API key to flush completed rows of {eval_id}")
+            continue
+        print(f"Flushing stranded completed rows of {eval_id}")
+        flush_completed_rows(api_key.decode(), eval_id)
+
+
+def complete_prediction(prediction: ReplicatePrediction):
+    """Run the completion handler for a finished prediction exactly once,
+    however many webhooks and polls report it."""
+    with transaction.atomic():
+        # Only lock the prediction, the evaluation's lock comes last (see
+        # update_progress)
+        tracked = (
+            Prediction.objects.select_for_update(of=("self",))
+            .select_related("evaluation")
+            .filter(replicate_id=prediction.id)
+            .first()
+        )
+        if tracked is None:
+            print(f"Unknown prediction {prediction.id}")
+            return
+        if tracked.status in TERMINAL_STATUSES:
+            return
+
+        scored_row_ids = set()
+        received_scores = {}
+
+        if prediction.status == "succeeded":
+            if tracked.kind == "generation":
+                transfer_args = [
+                    tracked.api_key,
+                    tracked.example_id,
+                    prediction.id,
+                    prediction.output,
+                    prediction.metrics["predict_time"],
+                    tracked.model,
+                    tracked.cache_key,
+                ]
+                transaction.on_commit(lambda: transfer_output.delay(*transfer_args))
+            else:
+                output = cast(list[dict], prediction.output)
+                scored_row_ids, received_scores = save_model_score(
+                    tracked.evaluation, output, tracked.kind, tracked.row_ids
+                )
+        elif tracked.kind == "generation":
+            fail_example(tracked.api_key, tracked.example_id)
+        else:
+            print(f"{tracked.kind} prediction failed or was canceled for chunk")
+
+        # Finished predictions no longer need the API key, so don't keep it
+        api_key, tracked_pk = tracked.api_key, tracked.pk
+        tracked.status = prediction.status
+        tracked.api_key = None
+        tracked.save(update_fields=["status", "api_key", "updated_at"])
+        transaction.on_commit(lambda: throttle.release(api_key, tracked_pk))
+
+        if tracked.kind != "generation":
+            num_scored = mark_rows_scored(tracked)
+            update_progress(
+                tracked.evaluation,
+                num_scored_rows=num_scored,
+                received_scores=received_scores,
+            )
+            publish_rows(tracked.evaluation, set(tracked.row_ids) | scored_row_ids)
+
+
+def complete_predictions(predictions: list[ReplicatePrediction]):
+    """Complete several predictions with overlapping database writes."""
+    if len(predictions) <= 1:
+        for prediction in predictions:
+            complete_prediction(prediction)
+        return
+
+    def complete_in_thread(prediction):
+        try:
+            complete_prediction(prediction)
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=settings.TRANSFER_CONCURRENCY) as executor:
+        list(executor.map(complete_in_thread, predictions))
+
+
+@shared_task
+def handle_prediction_webhook(prediction_pk: int, payload: dict):
+    prediction = ReplicatePrediction(**payload)
+
+    # The webhook can arrive before create_prediction has stored the ID
+    Prediction.objects.filter(id=prediction_pk, replicate_id__isnull=True).update(
+        replicate_id=prediction.id
+    )
+    if prediction.status in TERMINAL_STATUSES:
+        complete_prediction(prediction)
+
+
+@shared_task
+def poll_gen_prediction(api_key, example_id, prediction_id, model, cache_key):
+    """Hand a poll task queued before poll_predictions over to it."""
+    evaluation = Evaluation.objects.get(rows__examples__id=example_id)
+    Prediction.objects.get_or_create(
+        replicate_id=prediction_id,
+        defaults={
+            "evaluation": evaluation,
+            "example_id": example_id,
+            "kind": "generation",
+            "model": model,
+            "cache_key": cache_key,
+            "api_key": api_key,
+            "next_poll_at": timezone.now(),
+        },
+    )
+
+
+@shared_task
+def poll_eval_prediction(api_key, eval_id, prediction_id, model_type):
+    """Hand a poll task queued before poll_predictions over to it. Its rows
+    are unknown, so scores are matched across the evaluation (see
+    save_model_score)."""
+    Prediction.objects.get_or_create(
+        replicate_id=prediction_id,
+        defaults={
+            "evaluation": Evaluation.objects.get(eval_id=eval_id),
+            "kind": model_type,
+            "api_key": api_key,
+            "next_poll_at": timezone.now(),
+        },
+    )
+
+
+@shared_task
+def poll_predictions():
+    """Poll all outstanding predictions that are due, in bulk per API key.
+
+    Runs every PREDICTION_POLL_TICK seconds from celery beat and replaces
+    one self-rescheduling task per prediction.
+    """
+    now = timezone.now()
+    retry_unsubmitted_predictions(now)
+
+    with transaction.atomic():
+        due = list(
+            Prediction.objects.select_for_update(skip_locked=True)
+            .filter(replicate_id__isnull=False, next_poll_at__lte=now)
+            .exclude(status__in=TERMINAL_STATUSES)
+            .order_by("next_poll_at")[: settings.PREDICTION_POLL_BATCH_SIZE]
+        )
+        # Lease the batch so that an overlapping run skips it
+        Prediction.objects.filter(id__in=[tracked.id for tracked in due]).update(
+            next_poll_at=now + timedelta(seconds=settings.PREDICTION_POLL_LEASE)
+        )
+
+    by_api_key = defaultdict(list)
+    for tracked in due:
+        by_api_key[tracked.api_key].append(tracked)
+
+    for api_key, batch in by_api_key.items():
+        try:
+            poll_batch(api_key, batch, now)
+        except Exception as e:
+            # Don't let one API key's errors hold up everyone else's polls
+            print(f"Failed to poll {len(batch)} predictions, backing off: {e}")
+            retry_at = now + timedelta(seconds=settings.PREDICTION_POLL_MAX_INTERVAL)
+            Prediction.objects.filter(id__in=[tracked.id for tracked in batch]).exclude(
+                status__in=TERMINAL_STATUSES
+            ).update(next_poll_at=retry_at)
+
+
+def retry_unsubmitted_predictions(now: datetime):
+    """Create again predictions that got no Replicate ID within
+    PREDICTION_CREATE_TIMEOUT seconds, because the task creating them
+    crashed or was lost, so that their example or chunk is not blocked
+    waiting for them forever."""
+    cutoff = now - timedelta(seconds=settings.PREDICTION_CREATE_TIMEOUT)
+    unsubmitted = (
+        Prediction.objects.filter(replicate_id__isnull=True, updated_at__lt=cutoff)
+        .exclude(status__in=TERMINAL_STATUSES)
+        .select_related("evaluation")
+        .order_by("updated_at")[: settings.PREDICTION_POLL_BATCH_SIZE]
+    )
+
+    generations = defaultdict(list)
+    chunks = defaultdict(set)
+    for tracked in unsubmitted:
+        # Conditional, so that an overlapping run retries each only once
+        retryable = Prediction.objects.filter(
+            id=tracked.id, replicate_id__isnull=True, updated_at=tracked.updated_at
+        )
+        eval_id = tracked.evaluation.eval_id
+        print(f"Retrying unsubmitted {tracked.kind} prediction {tracked.id}")
+        if tracked.kind == "generation":
+            # generate_images skips examples that have a tracked prediction
+            deleted, _ = retryable.delete()
+            if not deleted:
+                continue
+            if tracked.input is None:
+                fail_example(tracked.api_key, tracked.example_id)
+            else:
+                generations[(tracked.api_key, eval_id, tracked.model)].append(
+                    (tracked.example_id, tracked.input)
+                )
+        elif retryable.update(status=DEFERRED, updated_at=now):
+            # evaluate_chunk creates the chunk's deferred predictions
+            chunks[eval_id].add((tracked.api_key, tuple(tracked.row_ids)))
+
+    for (api_key, eval_id, model), jobs in generations.items():
+        schedule(eval_id, generate_images, [[api_key, eval_id, model, jobs]])
+    for eval_id, keyed_row_ids in chunks.items():
+        schedule(
+            eval_id,
+            evaluate_chunk,
+            [[api_key, eval_id, list(row_ids)] for api_key, row_ids in keyed_row_ids],
+        )
+
+
+def poll_batch(api_key: str, batch: list[Prediction], now: datetime):
+    client = get_client(api_key)
+    statuses = fetch_prediction_statuses(client, batch)
+
+    completed = []
+    for tracked in batch:
+        status = statuses[tracked.replicate_id]
+        if status in TERMINAL_STATUSES:
+            # Fetch the full prediction, list results may omit the output
+            completed.append(client.predictions.get(tracked.replicate_id))
+            continue
+
+        age = (now - tracked.created_at).total_seconds()
+        Prediction.objects.filter(id=tracked.id).exclude(
+            status__in=TERMINAL_STATUSES
+        ).update(
+            status=status,
+            next_poll_at=now + timedelta(seconds=next_poll_delay(age)),
+            updated_at=now,
+        )
+
+    complete_predictions(completed)
+
+
+def fetch_prediction_statuses(
+    client: replicate.Client, batch: list[Prediction]
+) -> dict[str, str]:
+    """Current status of each prediction in batch, using as few requests as
+    possible: large batches page through the prediction list (newest
+    first), and only predictions not found there are fetched one by one."""
+    wanted = {tracked.replicate_id for tracked in batch}
+    statuses = {}
+
+    if len(wanted) >= settings.PREDICTION_POLL_LIST_THRESHOLD:
+        oldest = min(tracked.created_at for tracked in batch)
+        page = client.predictions.list()
+        for _ in range(settings.PREDICTION_POLL_MAX_PAGES):
+            for prediction in page.results:
+                if prediction.id in wanted:
+                    statuses[prediction.id] = prediction.status
+
+            if not page.next or wanted <= statuses.keys():
+                break
+            last_created_at = parse_datetime(page.results[-1].created_at or "")
+            if last_created_at and last_created_at < oldest - timedelta(minutes=1):
+                break
+            page = client.predictions.list(cursor=page.next)
+
+    for prediction_id in wanted - statuses.keys():
+        statuses[prediction_id] = client.predictions.get(prediction_id).status
+
+    return statuses
+
+
+def next_poll_delay(age: float) -> int:
+    """Seconds until a prediction of the given age should be polled again.
+    With webhooks, polling is only a slow fallback for lost deliveries."""
+    if settings.REPLICATE_WEBHOOK_BASE_URL:
+        return settings.PREDICTION_SWEEP_INTERVAL
+
+    for max_age, delay in settings.PREDICTION_POLL_INTERVALS:
+        if age < max_age:
+            return delay
+    return settings.PREDICTION_POLL_MAX_INTERVAL
+
+
+def outstanding_prediction_counts() -> dict[str, dict[str, int]]:
+    counts = defaultdict(dict)
+    outstanding = (
+        Prediction.objects.exclude(status__in=TERMINAL_STATUSES)
+        .values("kind", "status")
+        .annotate(count=Count("id"))
+    )
+    for row in outstanding:
+        counts[row["kind"]][row["status"]] = row["count"]
+    return dict(counts)
+
+
+def dreamsim_create_prediction(
+    client: replicate.Client, api_key: str, evaluation: Evaluation, rows
+):
     image_separator = "|||"
-    dreamsim_version = client.models.get("andreasjansson/dreamsim").latest_version
-    assert dreamsim_version
+    dreamsim_version_id = resolve_version(client, "andreasjansson/dreamsim")
 
     input_strings = []
     for row in rows:
-        examples = row.examples.all().order_by("id")
-        images = [example.image_url for example in examples]
+        examples = row.examples.all()
+        images = [example.image_url for example in examples if example.image_url]
         input_strings.append(image_separator.join(images))
 
     input_str = "\n".join(input_strings)
 
-    prediction = client.predictions.create(
-        version=dreamsim_version.id,
+    prediction = create_prediction(
+        client,
+        api_key,
+        evaluation,
+        "DreamSim",
+        version=dreamsim_version_id,
         input={"images": input_str, "separator": image_separator},
+        row_ids=[row.id for row in rows],
     )
 
-    print(f"Running dreamsim prediction: https://replicate.com/p/{prediction.id}")
+    if prediction:
+        print(f"Running dreamsim prediction: https://replicate.com/p/{prediction.id}")
 
     return prediction
 
 
-def flash_eval_create_prediction(client, rows, models):
+def flash_eval_create_prediction(client, api_key, evaluation, rows, models):
     prompt_images_separator = ":::"
     image_separator = "|||"
 
-    flash_eval_version = client.models.get("andreasjansson/flash-eval").latest_version
-    assert flash_eval_version
+    flash_eval_version_id = resolve_version(client, "andreasjansson/flash-eval")
 
     prompts_and_images = []
     for row in rows:
         prompt = row.prompt or ""
         prompt = prompt.strip().replace("\n", " ")
-        images = [example.image_url for example in row.examples.all()]
+        images = [
+            example.image_url for example in row.examples.all() if example.image_url
+        ]
         prompts_and_images.append(
             f"{prompt}{prompt_images_separator}{image_separator.join(images)}"
         )
@@ -245,75 +999,125 @@ def flash_eval_create_prediction(client, rows, models):
         "image_separator": image_separator,
     }
 
-    prediction = client.predictions.create(
-        version=flash_eval_version.id, input=input_data
+    prediction = create_prediction(
+        client,
+        api_key,
+        evaluation,
+        "FlashEval",
+        version=flash_eval_version_id,
+        input=input_data,
+        row_ids=[row.id for row in rows],
     )
 
-    print(f"Running flash-eval prediction: https://replicate.com/p/{prediction.id}")
+    if prediction:
+        print(f"Running flash-eval prediction: https://replicate.com/p/{prediction.id}")
 
     return prediction
 
 
-@shared_task
-def poll_eval_prediction(api_key, eval_id, prediction_id, model_type):
-    client = replicate.Client(api_token=decrypt_key(api_key))
-    prediction = client.predictions.get(prediction_id)
-    evaluation = Evaluation.objects.get(eval_id=eval_id)
-
-    if prediction.status == "succeeded":
-        output = cast(list[dict], prediction.output)
-        save_model_score(evaluation, output, model_type)
-    elif prediction.status in ["failed", "canceled"]:
-        print(f"{model_type} prediction failed or was canceled for chunk")
+def save_model_score(
+    evaluation: Evaluation,
+    output: list[dict],
+    model_type: str,
+    row_ids: list[int] | None = None,
+) -> tuple[set[int], dict[str, int]]:
+    """Upsert the scores from an evaluation prediction's output, resolving
+    image URLs to the chunk's examples. Returns the ids of the scored rows
+    and the number of new (not overwritten) scores per model. Predictions
+    from before row_ids was tracked fall back to matching URLs across the
+    evaluation."""
+    if row_ids:
+        examples = Example.objects.filter(row_id__in=row_ids)
     else:
-        # Re-queue the task to check again later
-        poll_eval_prediction.apply_async(
-            args=[api_key, eval_id, prediction_id, model_type],
-            countdown=10,  # Wait 10 seconds before checking again
-        )
-
-
-def save_model_score(evaluation: Evaluation, output: list[dict], model_type: str):
+        examples = Example.objects.filter(row__evaluation=evaluation)
+
+    # One query per chunk: image URL -> row id -> example ids
+    examples_by_url = defaultdict(lambda: defaultdict(list))
+    example_groups = {}
+    for example_id, row_id, image_url, gen_model, labels in examples.order_by(
+        "id"
+    ).values_list("id", "row_id", "image_url", "gen_model", "labels"):
+        examples_by_url[image_url][row_id].append(example_id)
+        example_groups[example_id] = (gen_model, labels)
+
+    def record_rows(image_urls: list[str]) -> set[int]:
+        # A URL can appear in several rows, so a record belongs to the
+        # rows that contain all of its images
+        rows = None
+        for image_url in image_urls:
+            url_rows = set(examples_by_url.get(image_url, {}))
+            rows = url_rows if rows is None else rows & url_rows
+        if not rows:
+            print(f"No row for {model_type} images {image_urls}, skipping")
+        return rows or set()
+
+    # Keyed on the unique constraint, so a score repeated within the output
+    # collapses to its last value instead of conflicting with itself
+    scores = {}
+    scored_row_ids = set()
     if model_type == "DreamSim" and output:
         for record in output:
-            for test_image, score in record["distances"].items():
-                ModelScore.objects.create(
-                    evaluation=evaluation,
-                    image_url=test_image,
-                    model="DreamSim",
-                    score=score,
-                    ref_image=record["reference"],
-                )
+            reference = record["reference"]
+            for row_id in record_rows([reference, *record["distances"]]):
+                scored_row_ids.add(row_id)
+                ref_example_id = examples_by_url[reference][row_id][0]
+                for test_image, score in record["distances"].items():
+                    for example_id in examples_by_url[test_image][row_id]:
+                        scores[(example_id, "DreamSim", ref_example_id)] = ModelScore(
+                            evaluation=evaluation,
+                            example_id=example_id,
+                            ref_example_id=ref_example_id,
+                            image_url=test_image,
+                            model="DreamSim",
+                            score=score,
+                            ref_image=reference,
+                        )
     elif model_type == "FlashEval":
         for record in output:
-            for image_url, model_scores in record["scores"].items():
-                for model, score in model_scores.items():
-                    ModelScore.objects.create(
-                        evaluation=evaluation,
-                        image_url=image_url,
-                        model=model,
-                        score=score,
-                        prompt=record["prompt"],
-                    )
-
-    print(f"Processed {model_type} results for chunk")
-
-
-@contextmanager
-def download(url: str) -> Iterator[str]:
-    with tempfile.NamedTemporaryFile(
-        delete=False, suffix=get_url_extension(url)
-    ) as temp_file:
-        response = requests.get(url)
-        response.raise_for_status()
-        temp_file.write(response.content)
-
-    try:
-        yield temp_file.name
-    finally:
-        os.remove(temp_file.name)
+            for row_id in record_rows(list(record["scores"])):
+                scored_row_ids.add(row_id)
+                for image_url, model_scores in record["scores"].items():
+                    for example_id in examples_by_url[image_url][row_id]:
+                        for model, score in model_scores.items():
+                            scores[(example_id, model, None)] = ModelScore(
+                                evaluation=evaluation,
+                                example_id=example_id,
+                                image_url=image_url,
+                                model=model,
+                                score=score,
+                                prompt=record["prompt"],
+                            )
+
+    # Overwritten scores are taken back out of the aggregates
+    previous_scores = {
+        (example_id, model, ref_example_id): score
+        for example_id, model, ref_example_id, score in ModelScore.objects.filter(
+            example_id__in={key[0] for key in scores},
+            model__in={key[1] for key in scores},
+        ).values_list("example_id", "model", "ref_example_id", "score")
+    }
+    observations = []
+    received_scores = Counter()
+    for key, model_score in scores.items():
+        gen_model, labels = example_groups[model_score.example_id]
+        if key in previous_scores:
+            observations.append(
+                (model_score.model, previous_scores[key], gen_model, labels, -1)
+            )
+        else:
+            received_scores[model_score.model] += 1
+        observations.append(
+            (model_score.model, model_score.score, gen_model, labels, 1)
+        )
 
+    ModelScore.objects.bulk_create(
+        scores.values(),
+        batch_size=SCORE_BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=["example", "model", "ref_example"],
+        update_fields=["score", "prompt", "updated_at"],
+    )
+    update_aggregates(evaluation, observations)
 
-def get_url_extension(url):
-    path = urlparse(url).path
-    return os.path.splitext(path)[1]
+    print(f"Processed {model_type} results for chunk")
+    return scored_row_ids, dict(received_scores)
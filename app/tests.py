@@ -1,3 +1,620 @@
-from django.test import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from itertools import count
+from types import SimpleNamespace
+import json
+import uuid
+from unittest import mock
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+import redis
+from replicate.prediction import Prediction as ReplicatePrediction
+from .aggregates import rebuild_aggregates
+from .encryption import encrypt_key, hash_api_key
+from .models import (
+    Evaluation,
+    Row,
+    Example,
+    ModelScore,
+    Prediction,
+    CachedPrediction,
+    LeaderboardRollup,
+)
+from .progress import COUNTER_FIELDS, recompute_progress
+from .results import search_rows
+from .results_cache import invalidate_results
+from .redis_client import get_redis
+from .scheduler import next_job, submit_jobs
+from .schemas import RowData
+from .versions import resolve_version
+from . import tasks, throttle
 
-# Create your tests here.
+
+def run_concurrently(fn, args_list, workers=8):
+    def run(args):
+        try:
+            return fn(*args)
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run, args_list))
+
+
+def replicate_prediction(prediction_id, status="succeeded", output=None):
+    return ReplicatePrediction(
+        id=prediction_id,
+        model="owner/model",
+        version="v",
+        status=status,
+        input={},
+        output=output,
+        logs="",
+        metrics={"predict_time": 1.0},
+        created_at="2024-01-01T00:00:00Z",
+        urls={},
+    )
+
+
+class FakePredictions:
+    def __init__(self):
+        self.ids = count()
+        self.created = []
+
+    def create(self, version, input, **kwargs):
+        self.created.append(input)
+        return SimpleNamespace(id=f"eval-{next(self.ids)}")
+
+
+class ExactlyOnceEvaluationTest(TransactionTestCase):
+    num_rows = 4
+    examples_per_row = 6
+
+    def setUp(self):
+        self.evaluation = Evaluation.objects.create(
+            eval_id="test-eval",
+            title="Test",
+            enabled_models=["DreamSim", "ImageReward"],
+        )
+        self.rows = []
+        for i in range(self.num_rows):
+            row = Row.objects.create(evaluation=self.evaluation, prompt=f"p{i}")
+            self.rows.append(row)
+            for j in range(self.examples_per_row):
+                example = Example.objects.create(row=row, gen_model="owner/model")
+                Prediction.objects.create(
+                    evaluation=self.evaluation,
+                    example=example,
+                    replicate_id=f"gen-{example.id}",
+                    kind="generation",
+                    model="owner/model",
+                    cache_key=f"v/{example.id}",
+                    api_key="key",
+                )
+        recompute_progress(self.evaluation)
+
+    def assertProgressMatchesRecount(self):
+        self.evaluation.refresh_from_db()
+        counted = Evaluation.objects.values(
+            *COUNTER_FIELDS, "expected_scores", "received_scores"
+        ).get(id=self.evaluation.id)
+        recompute_progress(self.evaluation)
+        recounted = Evaluation.objects.values(
+            *COUNTER_FIELDS, "expected_scores", "received_scores"
+        ).get(id=self.evaluation.id)
+        self.assertEqual(counted, recounted)
+
+    @mock.patch("app.tasks.add_completed_row")
+    @mock.patch("app.tasks.cache_prediction")
+    @mock.patch("app.tasks.transfer_output.delay")
+    def test_concurrent_generation_completions_queue_each_row_once(
+        self, transfer_output, cache_prediction, add_completed_row
+    ):
+        transfer_output.side_effect = tasks.transfer_output
+        predictions = []
+        for tracked in Prediction.objects.filter(kind="generation"):
+            # Fail a few generations, and deliver every completion three times
+            status = "failed" if tracked.example_id % 5 == 0 else "succeeded"
+            prediction = replicate_prediction(
+                tracked.replicate_id, status, ["https://example.com/out.png"]
+            )
+            predictions.extend([(prediction,)] * 3)
+
+        run_concurrently(tasks.complete_prediction, predictions)
+
+        queued = [call.args[2] for call in add_completed_row.call_args_list]
+        self.assertCountEqual(queued, [row.id for row in self.rows])
+        self.assertEqual(
+            Row.objects.filter(status=Row.GENERATED).count(), self.num_rows
+        )
+        self.assertProgressMatchesRecount()
+        self.assertEqual(
+            self.evaluation.num_generated + self.evaluation.num_failed,
+            self.num_rows * self.examples_per_row,
+        )
+
+    def generate_images(self) -> dict[int, list[str]]:
+        """Finish generation, failing a few examples, and return each row's
+        image URLs."""
+        for i, example in enumerate(Example.objects.order_by("id")):
+            if i % 7 == 0:
+                example.gen_prediction_failed = True
+            else:
+                example.image_url = f"https://example.com/{example.id}.png"
+            example.save()
+        Row.objects.update(status=Row.GENERATED)
+        recompute_progress(self.evaluation)
+        return {
+            row.id: list(
+                row.examples.exclude(image_url=None)
+                .order_by("id")
+                .values_list("image_url", flat=True)
+            )
+            for row in self.rows
+        }
+
+    def evaluation_outputs(self, urls_by_row: dict[int, list[str]]) -> dict:
+        dreamsim_output = [
+            {"reference": urls[0], "distances": {url: 0.5 for url in urls[1:]}}
+            for urls in urls_by_row.values()
+        ]
+        flash_eval_output = [
+            {"prompt": "p", "scores": {url: {"ImageReward": 1.0} for url in urls}}
+            for urls in urls_by_row.values()
+        ]
+        return {"DreamSim": dreamsim_output, "FlashEval": flash_eval_output}
+
+    def test_queued_poll_tasks_hand_predictions_to_poll_predictions(self):
+        tracked = Prediction.objects.filter(kind="generation").first()
+        tasks.poll_gen_prediction(
+            "key", tracked.example_id, tracked.replicate_id, "owner/model", "v/1"
+        )
+        tasks.poll_eval_prediction("key", "test-eval", "untracked", "DreamSim")
+
+        self.assertEqual(
+            Prediction.objects.filter(replicate_id=tracked.replicate_id).count(), 1
+        )
+        untracked = Prediction.objects.get(replicate_id="untracked")
+        self.assertEqual(untracked.kind, "DreamSim")
+        self.assertLessEqual(untracked.next_poll_at, timezone.now())
+
+    @mock.patch("app.tasks.schedule")
+    def test_unsubmitted_predictions_are_created_again(self, schedule):
+        generation = Prediction.objects.filter(kind="generation").first()
+        Prediction.objects.filter(id=generation.id).update(
+            replicate_id=None, input={"prompt": "p0"}
+        )
+        row_ids = [row.id for row in self.rows]
+        tasks.reserve_chunk_predictions(self.evaluation, "key", ["DreamSim"], row_ids)
+        Prediction.objects.filter(kind="DreamSim").update(status="starting")
+        long_ago = timezone.now() - timedelta(seconds=3600)
+        Prediction.objects.filter(replicate_id=None).update(updated_at=long_ago)
+
+        tasks.retry_unsubmitted_predictions(timezone.now())
+
+        self.assertFalse(Prediction.objects.filter(id=generation.id).exists())
+        self.assertEqual(Prediction.objects.get(kind="DreamSim").status, tasks.DEFERRED)
+        schedule.assert_any_call(
+            "test-eval",
+            tasks.generate_images,
+            [
+                [
+                    "key",
+                    "test-eval",
+                    "owner/model",
+                    [(generation.example_id, {"prompt": "p0"})],
+                ]
+            ],
+        )
+        schedule.assert_any_call(
+            "test-eval", tasks.evaluate_chunk, [["key", "test-eval", row_ids]]
+        )
+
+        # Created again, they are not retried until they time out again
+        schedule.reset_mock()
+        tasks.retry_unsubmitted_predictions(timezone.now())
+        schedule.assert_not_called()
+
+    @mock.patch("app.tasks.fetch_prediction_statuses")
+    @mock.patch("app.tasks.get_client")
+    def test_poll_errors_back_off_only_their_api_key(
+        self, get_client, fetch_prediction_statuses
+    ):
+        revoked = Prediction.objects.filter(example__row=self.rows[0])
+        revoked.update(api_key="revoked")
+
+        def client_for(api_key):
+            if api_key == "revoked":
+                raise ValueError("Invalid API key")
+            return mock.Mock()
+
+        get_client.side_effect = client_for
+        fetch_prediction_statuses.side_effect = lambda client, batch: {
+            tracked.replicate_id: "processing" for tracked in batch
+        }
+        tasks.poll_predictions()
+
+        self.assertEqual(
+            Prediction.objects.filter(status="processing").count(),
+            (self.num_rows - 1) * self.examples_per_row,
+        )
+        backed_off = timezone.now() + timedelta(seconds=60)
+        self.assertFalse(revoked.filter(next_poll_at__lt=backed_off).exists())
+
+    @mock.patch("app.tasks.resolve_version", return_value="v")
+    @mock.patch("app.tasks.get_client")
+    def test_redelivered_chunks_create_predictions_and_scores_once(
+        self, get_client, resolve_version
+    ):
+        urls_by_row = self.generate_images()
+        get_client.return_value.predictions = fake = FakePredictions()
+        row_ids = [row.id for row in self.rows]
+        run_concurrently(tasks.evaluate_chunk, [("key", "test-eval", row_ids)] * 10)
+
+        self.assertEqual(len(fake.created), 2)
+        evaluation_predictions = Prediction.objects.exclude(kind="generation")
+        self.assertCountEqual(
+            evaluation_predictions.values_list("kind", flat=True),
+            ["DreamSim", "FlashEval"],
+        )
+        self.assertEqual(
+            Row.objects.filter(status=Row.EVALUATING).count(), self.num_rows
+        )
+        self.assertProgressMatchesRecount()
+
+        outputs = self.evaluation_outputs(urls_by_row)
+        completions = [
+            (replicate_prediction(tracked.replicate_id, output=outputs[tracked.kind]),)
+            for tracked in evaluation_predictions
+        ] * 4
+
+        run_concurrently(tasks.complete_prediction, completions)
+
+        num_images = sum(len(urls) for urls in urls_by_row.values())
+        self.assertEqual(
+            ModelScore.objects.filter(model="DreamSim").count(),
+            num_images - self.num_rows,
+        )
+        self.assertEqual(
+            ModelScore.objects.filter(model="ImageReward").count(), num_images
+        )
+        self.assertEqual(Row.objects.filter(status=Row.SCORED).count(), self.num_rows)
+        self.assertProgressMatchesRecount()
+        self.assertEqual(self.evaluation.num_scored_rows, self.num_rows)
+        self.assertEqual(
+            self.evaluation.received_scores, self.evaluation.expected_scores
+        )
+        self.assertFalse(evaluation_predictions.exclude(api_key=None).exists())
+
+    @mock.patch("app.tasks.evaluate_chunk.apply_async")
+    @mock.patch("app.tasks.throttle.acquire")
+    @mock.patch("app.tasks.resolve_version", return_value="v")
+    @mock.patch("app.tasks.get_client")
+    def test_rows_wait_for_deferred_evaluation_predictions(
+        self, get_client, resolve_version, acquire, apply_async
+    ):
+        urls_by_row = self.generate_images()
+        outputs = self.evaluation_outputs(urls_by_row)
+        get_client.return_value.predictions = fake = FakePredictions()
+
+        # DreamSim is created, FlashEval is throttled, then DreamSim finishes
+        acquire.side_effect = [None, throttle.Throttled(5)]
+        tasks.evaluate_chunk("key", "test-eval", [row.id for row in self.rows])
+        self.assertEqual(len(fake.created), 1)
+        self.assertEqual(apply_async.call_args.kwargs["countdown"], 5)
+        dreamsim = Prediction.objects.get(kind="DreamSim")
+        tasks.complete_prediction(
+            replicate_prediction(dreamsim.replicate_id, output=outputs["DreamSim"])
+        )
+        self.assertEqual(
+            Row.objects.filter(status=Row.EVALUATING).count(), self.num_rows
+        )
+
+        acquire.side_effect = None
+        tasks.evaluate_chunk(*apply_async.call_args.kwargs["args"])
+        self.assertEqual(len(fake.created), 2)
+        flash_eval = Prediction.objects.get(kind="FlashEval")
+        tasks.complete_prediction(
+            replicate_prediction(flash_eval.replicate_id, output=outputs["FlashEval"])
+        )
+
+        num_images = sum(len(urls) for urls in urls_by_row.values())
+        self.assertEqual(
+            ModelScore.objects.filter(model="ImageReward").count(), num_images
+        )
+        self.assertEqual(Row.objects.filter(status=Row.SCORED).count(), self.num_rows)
+        self.assertProgressMatchesRecount()
+        self.assertEqual(
+            self.evaluation.received_scores, self.evaluation.expected_scores
+        )
+
+
+class BatchedGenerationTest(TransactionTestCase):
+    def setUp(self):
+        # Throttling budgets are per API key and kept in Redis across runs
+        self.api_key = f"key-{uuid.uuid4()}"
+        self.evaluation = Evaluation.objects.create(
+            eval_id="test-eval", title="Test", enabled_models=["ImageReward"]
+        )
+        self.jobs = []
+        for i in range(10):
+            row = Row.objects.create(evaluation=self.evaluation, prompt=f"p{i}")
+            example = Example.objects.create(row=row, gen_model="owner/model")
+            self.jobs.append((example.id, {"prompt": f"p{i}"}))
+
+        cached_inputs = self.jobs[0][1]
+        CachedPrediction.objects.create(
+            cache_key=f"v/{tasks.compute_input_hash(cached_inputs)}",
+            file_extension="png",
+            labels={},
+            prediction_id="cached",
+        )
+        recompute_progress(self.evaluation)
+
+    @mock.patch("app.tasks.add_completed_row")
+    @mock.patch("app.tasks.resolve_version", return_value="v")
+    @mock.patch("app.tasks.get_client")
+    def test_redelivered_batches_create_each_prediction_once(
+        self, get_client, resolve_version, add_completed_row
+    ):
+        get_client.return_value.predictions = fake = FakePredictions()
+        for _ in range(3):
+            tasks.generate_images(self.api_key, "test-eval", "owner/model", self.jobs)
+
+        self.assertEqual(len(fake.created), len(self.jobs) - 1)
+        self.assertEqual(resolve_version.call_count, 3)
+        cached = Example.objects.get(id=self.jobs[0][0])
+        self.assertEqual(cached.gen_prediction_id, "cached")
+        self.assertEqual(
+            Example.objects.filter(gen_prediction_id__startswith="eval-").count(),
+            len(self.jobs) - 1,
+        )
+        add_completed_row.assert_called_once()
+        self.evaluation.refresh_from_db()
+        self.assertEqual(self.evaluation.num_generated, 1)
+
+    @override_settings(REPLICATE_RATE_LIMIT=0.01, REPLICATE_RATE_BURST=3)
+    @mock.patch("app.tasks.generate_images.apply_async")
+    @mock.patch("app.tasks.resolve_version", return_value="v")
+    @mock.patch("app.tasks.get_client")
+    def test_throttled_predictions_are_deferred(
+        self, get_client, resolve_version, apply_async
+    ):
+        get_client.return_value.predictions = fake = FakePredictions()
+        tasks.generate_images(self.api_key, "test-eval", "owner/model", self.jobs)
+
+        self.assertEqual(len(fake.created), 3)
+        deferred_jobs = apply_async.call_args.kwargs["args"][3]
+        self.assertEqual(len(deferred_jobs), len(self.jobs) - 1 - 3)
+        self.assertGreater(apply_async.call_args.kwargs["countdown"], 0)
+        self.assertFalse(Example.objects.filter(gen_prediction_failed=True).exists())
+        self.assertEqual(
+            Prediction.objects.filter(kind="generation").count(), len(fake.created)
+        )
+
+
+class ResultsDeltaTest(TransactionTestCase):
+    def test_unchanged_results_answer_delta_polls_with_304(self):
+        # Results versions are kept in Redis across runs
+        eval_id = uuid.uuid4().hex
+        Evaluation.objects.create(eval_id=eval_id, title="Test", enabled_models=[])
+        url = f"/api/results/{eval_id}/"
+
+        response = self.client.get(url, {"since": "0"})
+        self.assertEqual(response.status_code, 200)
+        since, etag = response.json()["cursor"], response["ETag"]
+
+        response = self.client.get(url, {"since": since}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        invalidate_results(eval_id)
+        response = self.client.get(url, {"since": since}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class SchedulerTest(TransactionTestCase):
+    def setUp(self):
+        self.prefix = f"test_scheduler:{uuid.uuid4().hex}"
+
+    def tearDown(self):
+        redis_client = get_redis()
+        for key in redis_client.scan_iter(f"{self.prefix}:*"):
+            redis_client.delete(key)
+
+    def submit(self, eval_id, user, small, num_jobs):
+        jobs = [
+            {"id": uuid.uuid4().hex, "task": "t", "args": [eval_id]}
+            for _ in range(num_jobs)
+        ]
+        submit_jobs(eval_id, user, small, jobs, prefix=self.prefix)
+
+    @override_settings(SCHEDULER_MAX_DISPATCHED=0, SCHEDULER_SMALL_BURST=2)
+    def test_small_evaluations_go_first_without_starving_large_ones(self):
+        self.submit("large", "user-1", False, 3)
+        self.submit("small", "user-2", True, 5)
+
+        order = []
+        while job := next_job(self.prefix):
+            order.append(job["args"][0])
+        self.assertEqual(
+            order,
+            ["small", "small", "large", "small", "small", "large", "small", "large"],
+        )
+
+
+class UploadEvaluateImagesTest(TransactionTestCase):
+    def upload(self, rows, failure):
+        def load_input_data(uploaded_file):
+            yield from rows
+            raise failure
+
+        with mock.patch("app.views.load_input_data", load_input_data):
+            with self.assertRaises(type(failure)):
+                self.client.post(
+                    "/api/evaluate-images/upload",
+                    {
+                        "api_key": "key",
+                        "title": "Test",
+                        "eval_models": ["ImageReward"],
+                        "data": SimpleUploadedFile("data.jsonl", b""),
+                    },
+                )
+
+    @mock.patch("app.views.CHUNK_SIZE", 2)
+    @mock.patch("app.ingest.dispatch_evaluate_chunks")
+    def test_failed_uploads_keep_committed_rows_and_stop_ingesting(self, dispatch):
+        rows = [
+            RowData(prompt=f"p{i}", images=[{"url": f"https://example.com/{i}.png"}])
+            for i in range(3)
+        ]
+        self.upload(rows, ConnectionResetError("Client disconnected"))
+
+        evaluation = Evaluation.objects.get()
+        self.assertFalse(evaluation.ingesting)
+        self.assertEqual(evaluation.rows.count(), 2)
+
+    def test_failed_uploads_without_rows_are_deleted(self):
+        self.upload([], ConnectionResetError("Client disconnected"))
+
+        self.assertFalse(Evaluation.objects.exists())
+
+
+class CompletedRowsTest(TransactionTestCase):
+    def setUp(self):
+        # Completed rows are queued in Redis, which is kept across runs
+        self.eval_id = uuid.uuid4().hex
+
+    def tearDown(self):
+        redis_client = get_redis()
+        for key in redis_client.scan_iter(f"completed_rows:{self.eval_id}*"):
+            redis_client.delete(key)
+
+    @mock.patch("app.tasks.schedule")
+    @mock.patch("app.tasks.flush_completed_rows.apply_async")
+    def test_rows_are_flushed_if_the_linger_flush_is_lost(self, apply_async, schedule):
+        for row_id in [1, 2, 3]:
+            tasks.add_completed_row("key", self.eval_id, row_id)
+        apply_async.assert_called_once()
+
+        tasks.flush_stranded_rows()
+        schedule.assert_not_called()
+
+        # The linger flush never ran, and its flag has expired
+        get_redis().delete(f"completed_rows:{self.eval_id}:scheduled")
+        tasks.flush_stranded_rows()
+        schedule.assert_any_call(
+            self.eval_id, tasks.evaluate_chunk, [["key", self.eval_id, [1, 2, 3]]]
+        )
+
+    @mock.patch("app.tasks.schedule")
+    @mock.patch("app.tasks.get_redis")
+    def test_rows_are_evaluated_at_once_without_redis(self, get_redis, schedule):
+        get_redis.return_value.pipeline.return_value.execute.side_effect = (
+            redis.ConnectionError("Redis is down")
+        )
+        tasks.add_completed_row("key", self.eval_id, 1)
+
+        schedule.assert_called_once_with(
+            self.eval_id, tasks.evaluate_chunk, [["key", self.eval_id, [1]]]
+        )
+
+
+class ResolveVersionTest(TransactionTestCase):
+    def setUp(self):
+        # Latest versions are cached in-process and in Redis
+        self.model = f"owner/model-{uuid.uuid4().hex}"
+        self.client = mock.Mock()
+        self.client.models.get.return_value.latest_version.id = "latest"
+
+    @mock.patch("app.versions.get_redis")
+    def test_pinned_versions_stay_off_the_network(self, get_redis):
+        self.assertEqual(resolve_version(self.client, f"{self.model}:pinned"), "pinned")
+        get_redis.assert_not_called()
+        self.client.models.get.assert_not_called()
+
+    @mock.patch("app.versions.get_redis")
+    def test_lock_failures_fall_back_to_the_api(self, get_redis):
+        get_redis.return_value.lock.return_value.__enter__.side_effect = (
+            redis.exceptions.LockError("Unable to acquire lock")
+        )
+        self.assertEqual(resolve_version(self.client, self.model), "latest")
+
+        # And the result is cached in-process
+        self.assertEqual(resolve_version(self.client, self.model), "latest")
+        self.client.models.get.assert_called_once_with(self.model)
+
+
+class LeaderboardTest(TransactionTestCase):
+    def setUp(self):
+        hashed_api_key = hash_api_key(encrypt_key("key"))
+        for group_value, count in [("emptied", 0), ("scored", 2)]:
+            LeaderboardRollup.objects.create(
+                hashed_api_key=hashed_api_key,
+                metric="ImageReward",
+                group_key="gen_model",
+                group_value=group_value,
+                count=count,
+                total=count * 0.5,
+                histogram={"0": count} if count else {},
+            )
+
+    def leaderboard(self, **data):
+        return self.client.post(
+            "/api/leaderboard/",
+            json.dumps({"api_key": "key", **data}),
+            content_type="application/json",
+        )
+
+    def test_groups_without_scores_are_not_ranked(self):
+        response = self.leaderboard()
+        self.assertEqual(response.status_code, 200)
+        ranked = response.json()["metrics"]["ImageReward"]
+        self.assertEqual([entry["value"] for entry in ranked], ["scored"])
+
+    def test_min_count_below_one_is_rejected(self):
+        self.assertEqual(self.leaderboard(min_count=0).status_code, 400)
+
+
+class RebuildAggregatesTest(TransactionTestCase):
+    def test_predict_time_is_only_rebuilt_from_generated_images(self):
+        evaluation = Evaluation.objects.create(
+            eval_id="test-eval", title="Test", enabled_models=["ImageReward"]
+        )
+        row = Row.objects.create(evaluation=evaluation, prompt="p")
+        for gen_prediction_id, predict_time in [
+            ("gen", 2.0),  # Generated
+            (None, 5.0),  # Uploaded, with a predict_time label
+            (None, "fast"),
+        ]:
+            Example.objects.create(
+                row=row,
+                gen_model="owner/model",
+                gen_prediction_id=gen_prediction_id,
+                image_url=f"https://example.com/{predict_time}.png",
+                labels={"predict_time": predict_time},
+            )
+
+        rebuild_aggregates(evaluation)
+
+        overall = evaluation.aggregates.get(metric="predict_time", group_key="")
+        self.assertEqual((overall.count, overall.total), (1, 2.0))
+
+
+class SearchRowsTest(TransactionTestCase):
+    def test_prompts_match_substrings_ignoring_case(self):
+        evaluation = Evaluation.objects.create(
+            eval_id="test-eval", title="Test", enabled_models=[]
+        )
+        for prompt in ["A ripe Tomato", "potato salad", None]:
+            Row.objects.create(evaluation=evaluation, prompt=prompt)
+
+        matches = search_rows(Row.objects.filter(evaluation=evaluation), "ATO")
+        self.assertCountEqual(
+            matches.values_list("prompt", flat=True), ["A ripe Tomato", "potato salad"]
+        )
+        matches = search_rows(Row.objects.filter(evaluation=evaluation), "e tom")
+        self.assertEqual(
+            list(matches.values_list("prompt", flat=True)), ["A ripe Tomato"]
+        )
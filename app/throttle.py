@@ -0,0 +1,118 @@
+import redis
+from django.conf import settings
+from .encryption import hash_api_key
+from .redis_client import get_redis
+
+# Takes a token from the API key's bucket and an in-flight slot together, or
+# neither. Returns {1, 0} if both were taken, else {0, seconds to wait}.
+# Uses the Redis clock, so that workers with skewed clocks share one bucket.
+ACQUIRE_SCRIPT = """
+local bucket, inflight = KEYS[1], KEYS[2]
+local rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+local max_inflight, inflight_ttl = tonumber(ARGV[3]), tonumber(ARGV[4])
+local member, retry_delay = ARGV[5], ARGV[6]
+
+local time = redis.call("TIME")
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+redis.call("ZREMRANGEBYSCORE", inflight, "-inf", now - inflight_ttl)
+if max_inflight > 0 and redis.call("ZCARD", inflight) >= max_inflight then
+    return {0, retry_delay}
+end
+
+local tokens = burst
+local state = redis.call("HMGET", bucket, "tokens", "updated_at")
+if state[1] then
+    tokens = math.min(burst, tonumber(state[1]) + (now - tonumber(state[2])) * rate)
+end
+local wait = 0
+if tokens < 1 then
+    wait = (1 - tokens) / rate
+else
+    tokens = tokens - 1
+    redis.call("ZADD", inflight, now, member)
+    redis.call("EXPIRE", inflight, inflight_ttl)
+end
+redis.call("HSET", bucket, "tokens", tokens, "updated_at", now)
+redis.call("EXPIRE", bucket, math.ceil(burst / rate) + 60)
+if wait > 0 then
+    return {0, tostring(wait)}
+end
+return {1, 0}
+"""
+
+_acquire_script = None
+
+
+class Throttled(Exception):
+    """The API key is over its prediction budget. Defer the work by
+    retry_after seconds rather than failing it."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Throttled, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+def acquire(api_key: str, prediction_pk: int):
+    """Take a token and an in-flight slot for a prediction about to be
+    created with this (encrypted) API key, or raise Throttled.
+
+    Predictions hold their slot until release() or, if that is lost, for
+    REPLICATE_INFLIGHT_TTL seconds. If Redis is unavailable, predictions
+    are not throttled.
+    """
+    global _acquire_script
+    redis_client = get_redis()
+    if _acquire_script is None:
+        _acquire_script = redis_client.register_script(ACQUIRE_SCRIPT)
+
+    hashed_key = hash_api_key(api_key)
+    try:
+        acquired, wait = _acquire_script(
+            keys=[f"throttle:{hashed_key}:bucket", f"throttle:{hashed_key}:inflight"],
+            args=[
+                settings.REPLICATE_RATE_LIMIT,
+                settings.REPLICATE_RATE_BURST,
+                settings.REPLICATE_MAX_INFLIGHT,
+                settings.REPLICATE_INFLIGHT_TTL,
+                prediction_pk,
+                settings.REPLICATE_THROTTLE_RETRY_DELAY,
+            ],
+        )
+    except redis.RedisError as e:
+        print(f"Failed to throttle predictions, creating anyway: {e}")
+        return
+    if not acquired:
+        raise Throttled(float(wait))
+
+
+def release(api_key: str, prediction_pk: int):
+    """Free the in-flight slot of a prediction that has finished, or that
+    was never created."""
+    hashed_key = hash_api_key(api_key)
+    try:
+        get_redis().zrem(f"throttle:{hashed_key}:inflight", prediction_pk)
+    except redis.RedisError as e:
+        print(f"Failed to release in-flight prediction {prediction_pk}: {e}")
+
+
+def record_deferral(seconds: float, num_predictions: int = 1):
+    """Count predictions deferred by throttling, and the time they were
+    deferred for."""
+    try:
+        pipe = get_redis().pipeline()
+        pipe.hincrby("throttle_stats", "deferred_predictions", num_predictions)
+        pipe.hincrbyfloat(
+            "throttle_stats", "throttled_seconds", seconds * num_predictions
+        )
+        pipe.execute()
+    except redis.RedisError as e:
+        print(f"Failed to record throttling: {e}")
+
+
+def throttle_stats() -> dict[str, float]:
+    stats = get_redis().hgetall("throttle_stats")
+    return {
+        "deferred_predictions": int(stats.get(b"deferred_predictions", 0)),
+        "throttled_seconds": round(float(stats.get(b"throttled_seconds", 0)), 1),
+    }
@@ -5,14 +5,41 @@ urlpatterns = [
     path("", views.index, name="index"),
     path("data-form/", views.data_form, name="data_form"),
     path("api/evaluate-images", views.evaluate_images, name="evaluate_images"),
+    path(
+        "api/evaluate-images/upload",
+        views.upload_evaluate_images,
+        name="upload_evaluate_images",
+    ),
     path(
         "api/generate-and-evaluate",
         views.generate_and_evaluate,
         name="generate_and_evaluate",
     ),
+    path(
+        "api/webhooks/replicate/<str:token>",
+        views.replicate_webhook,
+        name="replicate_webhook",
+    ),
+    path("api/predictions/", views.prediction_stats, name="prediction_stats"),
     path("results/<str:eval_id>/", views.results, name="results"),
     path("api/results/<str:eval_id>/", views.api_results, name="api_results"),
+    path(
+        "api/results/<str:eval_id>/summary",
+        views.api_summary,
+        name="api_summary",
+    ),
+    path(
+        "api/results/<str:eval_id>/events",
+        views.results_events,
+        name="results_events",
+    ),
+    path(
+        "api/results/<str:eval_id>/export",
+        views.export_results,
+        name="export_results",
+    ),
     path("api-docs/", views.api_docs, name="api_docs"),
     path("evaluations/", views.evaluations, name="evaluations"),
     path("api/evaluations/", views.fetch_evaluations, name="fetch_evaluations"),
+    path("api/leaderboard/", views.api_leaderboard, name="api_leaderboard"),
 ]
@@ -0,0 +1,124 @@
+from collections import Counter
+import threading
+import time
+from celery.signals import task_postrun
+from django.conf import settings
+import redis
+import replicate
+from .redis_client import get_redis
+
+# Process-local cache of "owner/name" -> (latest version ID, expiry)
+_latest_versions: dict[str, tuple[str, float]] = {}
+_locks: dict[str, threading.Lock] = {}
+_locks_lock = threading.Lock()
+
+LOOKUPS = ["pinned", "local_hits", "redis_hits", "misses"]
+# Lookups are counted in-process, so that cache hits stay off the network,
+# and added to Redis after a task at most every LOOKUPS_FLUSH_INTERVAL seconds
+LOOKUPS_FLUSH_INTERVAL = 60
+_lookups = Counter()
+_lookups_lock = threading.Lock()
+_lookups_flushed_at = time.monotonic()
+
+
+def resolve_version(client: replicate.Client, model: str) -> str:
+    """Version ID for "owner/name" or "owner/name:version".
+
+    Pinned versions never touch the network. Latest versions are cached
+    in-process and in Redis for VERSION_CACHE_TTL seconds, and concurrent
+    lookups of the same model share a single API call. If Redis is
+    unavailable, or the lookup can't get its lock in time, the version is
+    looked up directly.
+    """
+    model_name, _, version_id = model.partition(":")
+    if version_id:
+        record_lookup("pinned")
+        return version_id
+
+    version_id = _get_local(model_name)
+    if version_id:
+        record_lookup("local_hits")
+        return version_id
+
+    with _lock(model_name):
+        # Another thread may have resolved it while we waited
+        version_id = _get_local(model_name)
+        if version_id:
+            record_lookup("local_hits")
+            return version_id
+
+        redis_client = get_redis()
+        key = f"version:{model_name}"
+        try:
+            with redis_client.lock(f"lock:{key}", timeout=30, blocking_timeout=30):
+                cached = redis_client.get(key)
+                if cached:
+                    record_lookup("redis_hits")
+                    version_id = cached.decode()
+                else:
+                    record_lookup("misses")
+                    version_id = _latest_version(client, model_name)
+                    redis_client.set(key, version_id, ex=settings.VERSION_CACHE_TTL)
+        except redis.RedisError as e:
+            # Including LockError, if another process held the lock too long
+            print(f"Failed to share the version of {model_name}: {e}")
+            if not version_id:
+                record_lookup("misses")
+                version_id = _latest_version(client, model_name)
+
+        _latest_versions[model_name] = (
+            version_id,
+            time.monotonic() + settings.VERSION_CACHE_TTL,
+        )
+        return version_id
+
+
+def _latest_version(client: replicate.Client, model_name: str) -> str:
+    version = client.models.get(model_name).latest_version
+    assert version
+    return version.id
+
+
+def _get_local(model_name: str) -> str | None:
+    cached = _latest_versions.get(model_name)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+    return None
+
+
+def _lock(model_name: str) -> threading.Lock:
+    with _locks_lock:
+        return _locks.setdefault(model_name, threading.Lock())
+
+
+def record_lookup(lookup: str):
+    """Count a version lookup by how it was resolved (see LOOKUPS)."""
+    with _lookups_lock:
+        _lookups[lookup] += 1
+
+
+@task_postrun.connect
+def flush_lookups(**kwargs):
+    """Add the lookups counted in this process to the counts shared by all
+    workers, if LOOKUPS_FLUSH_INTERVAL has passed since the last flush."""
+    global _lookups_flushed_at
+    with _lookups_lock:
+        now = time.monotonic()
+        if not _lookups or now - _lookups_flushed_at < LOOKUPS_FLUSH_INTERVAL:
+            return
+        lookups = dict(_lookups)
+        _lookups.clear()
+        _lookups_flushed_at = now
+
+    try:
+        pipe = get_redis().pipeline()
+        for lookup, count in lookups.items():
+            pipe.hincrby("version_stats", lookup, count)
+        pipe.execute()
+    except redis.RedisError as e:
+        print(f"Failed to record version lookups: {e}")
+
+
+def version_stats() -> dict[str, int]:
+    stats = get_redis().hgetall("version_stats")
+    return {lookup: int(stats.get(lookup.encode(), 0)) for lookup in LOOKUPS}
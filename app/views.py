@@ -1,23 +1,49 @@
-# TODO:
-# * aggregate predict_time and scores
-
 import json
 import hashlib
-import random
 import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
 from django.shortcuts import render, get_object_or_404
-from django.http import JsonResponse
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.urls import reverse
-from django.db.models import Prefetch
+from django.core.paginator import Paginator
+from django.core.signing import BadSignature
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.views.decorators.http import condition
 import pydantic
-from .models import Evaluation, Row, Example, ModelScore
-from .tasks import evaluate_chunk, generate_image
-from .encryption import encrypt_key
+from asgiref.sync import sync_to_async
+from .models import Evaluation, Row, Example, ModelScore, Prediction
+from .aggregates import evaluation_summary, leaderboard
+from .encryption import encrypt_key, hash_api_key
+from .events import stream_results
+from .export import EXPORT_FORMATS, aexport_chunks
+from .data import load_input_data, InputDataError
+from .ingest import ingest_images, ingest_generations
+from .progress import evaluation_progress, is_completed
+from .results_cache import (
+    cached_results,
+    invalidate_results_on_commit,
+    results_version,
+)
+from .results import (
+    serialize_rows,
+    columnar_rows,
+    evaluation_completed,
+    search_rows,
+    sort_rows,
+)
+from .tasks import CHUNK_SIZE, handle_prediction_webhook, outstanding_prediction_counts
+from .queue_metrics import queue_stats
+from .scheduler import scheduler_stats
+from .throttle import throttle_stats
+from .versions import version_stats
+from .webhooks import unsign_webhook_token
 from .schemas import GenerateAndEvaluateRequest, EvaluateImagesRequest
 
-CHUNK_SIZE = 100
-
 
 def index(request):
     return render(request, "index.html")
@@ -48,30 +74,14 @@ def evaluate_images(request):
             )
 
         eval_id = str(uuid.uuid4())
-        evaluation = Evaluation.objects.create(
-            eval_id=eval_id,
-            title=title,
-            enabled_models=data.eval_models,
-            hashed_api_key=hashed_api_key,
-        )
-
-        row_ids = []
-        for row_data in input_data:
-            seed = row_data.seed or random.randint(0, 1000000)
-            row = Row.objects.create(
-                evaluation=evaluation, prompt=row_data.prompt, seed=seed
+        with transaction.atomic():
+            evaluation = Evaluation.objects.create(
+                eval_id=eval_id,
+                title=title,
+                enabled_models=data.eval_models,
+                hashed_api_key=hashed_api_key,
             )
-            for image_data in row_data.images:
-                Example.objects.create(
-                    row=row,
-                    image_url=image_data.url,
-                    labels=image_data.labels,
-                )
-            row_ids.append(row.id)
-
-        for i in range(0, len(row_ids), CHUNK_SIZE):
-            chunk = row_ids[i : i + CHUNK_SIZE]
-            evaluate_chunk.delay(api_key, eval_id, chunk)
+            ingest_images(api_key, evaluation, input_data)
 
         results_url = request.build_absolute_uri(reverse("results", args=[eval_id]))
         return JsonResponse({"evaluation_id": eval_id, "results_url": results_url})
@@ -79,6 +89,79 @@ def evaluate_images(request):
     return JsonResponse({"error": "Invalid request method"}, status=405)
 
 
+@csrf_exempt
+def upload_evaluate_images(request):
+    """Multipart variant of evaluate_images that streams a JSONL file.
+
+    Rows are validated line by line and committed in CHUNK_SIZE batches,
+    each of which is dispatched to evaluate_chunk as soon as it lands.
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "Invalid request method"}, status=405)
+
+    api_key = request.POST.get("api_key")
+    title = request.POST.get("title")
+    eval_models = request.POST.getlist("eval_models")
+    uploaded_file = request.FILES.get("data")
+    if not api_key or not title or not eval_models or not uploaded_file:
+        return JsonResponse(
+            {"error": "api_key, title, eval_models and data are required"},
+            status=400,
+        )
+
+    api_key = encrypt_key(api_key)
+    eval_id = str(uuid.uuid4())
+    evaluation = Evaluation.objects.create(
+        eval_id=eval_id,
+        title=title,
+        enabled_models=eval_models,
+        hashed_api_key=hash_api_key(api_key),
+        ingesting=True,
+    )
+    results_url = request.build_absolute_uri(reverse("results", args=[eval_id]))
+
+    num_rows = 0
+    batch = []
+    error = None
+    try:
+        try:
+            for row_data in load_input_data(uploaded_file):
+                batch.append(row_data)
+                if len(batch) == CHUNK_SIZE:
+                    with transaction.atomic():
+                        ingest_images(api_key, evaluation, batch)
+                    num_rows += len(batch)
+                    batch = []
+        except InputDataError as e:
+            error = {"error": str(e), "line_number": e.line_number}
+
+        # Rows before a bad line are valid, so they are kept
+        if batch:
+            with transaction.atomic():
+                ingest_images(api_key, evaluation, batch)
+            num_rows += len(batch)
+    finally:
+        # Whatever stopped the upload, the evaluation must not be left
+        # ingesting. Batches already committed are kept and evaluated.
+        if Row.objects.filter(evaluation=evaluation).exists():
+            Evaluation.objects.filter(id=evaluation.id).update(ingesting=False)
+            invalidate_results_on_commit(evaluation.eval_id)
+        else:
+            evaluation.delete()
+
+    if num_rows == 0:
+        return JsonResponse(error or {"error": "No rows in data"}, status=400)
+
+    response = {
+        "evaluation_id": eval_id,
+        "results_url": results_url,
+        "num_rows": num_rows,
+    }
+    if error:
+        return JsonResponse({**response, **error}, status=400)
+    return JsonResponse(response)
+
+
 @csrf_exempt
 def generate_and_evaluate(request):
     if request.method == "POST":
@@ -92,34 +175,14 @@ def generate_and_evaluate(request):
         title = data.title
 
         eval_id = str(uuid.uuid4())
-        evaluation = Evaluation.objects.create(
-            eval_id=eval_id,
-            title=title,
-            enabled_models=data.eval_models,
-            hashed_api_key=hashed_api_key,
-        )
-
-        for row_data in data.rows:
-            seed = row_data.seed or random.randint(0, 1000000)
-            prompt = row_data.prompt
-            row = Row.objects.create(evaluation=evaluation, prompt=prompt, seed=seed)
-
-            for example_data in row_data.examples:
-                labels = {k: v for k, v in example_data.inputs.items()}  # clone
-                example = Example.objects.create(
-                    row=row, labels=labels, gen_model=example_data.model
-                )
-
-                inputs = example_data.inputs
-                inputs[example_data.prompt_input] = row_data.prompt
-                inputs[example_data.seed_input] = seed
-
-                generate_image.delay(
-                    api_key=api_key,
-                    example_id=example.id,
-                    model=example_data.model,
-                    inputs=example_data.inputs,
-                )
+        with transaction.atomic():
+            evaluation = Evaluation.objects.create(
+                eval_id=eval_id,
+                title=title,
+                enabled_models=data.eval_models,
+                hashed_api_key=hashed_api_key,
+            )
+            ingest_generations(api_key, evaluation, data.rows)
 
         results_url = request.build_absolute_uri(reverse("results", args=[eval_id]))
         return JsonResponse({"evaluation_id": eval_id, "results_url": results_url})
@@ -127,6 +190,43 @@ def generate_and_evaluate(request):
     return JsonResponse({"error": "Invalid request method"}, status=405)
 
 
+@csrf_exempt
+def replicate_webhook(request, token):
+    if request.method != "POST":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+    try:
+        prediction_pk = unsign_webhook_token(token)
+    except BadSignature:
+        return JsonResponse({"error": "Invalid signature"}, status=403)
+
+    try:
+        payload = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+
+    tracked = Prediction.objects.filter(pk=prediction_pk).first()
+    if tracked is None:
+        return JsonResponse({"error": "Unknown prediction"}, status=404)
+    if tracked.replicate_id and tracked.replicate_id != payload.get("id"):
+        return JsonResponse({"error": "Prediction ID mismatch"}, status=400)
+
+    handle_prediction_webhook.delay(prediction_pk, payload)
+    return JsonResponse({"status": "ok"})
+
+
+def prediction_stats(request):
+    return JsonResponse(
+        {
+            "outstanding": outstanding_prediction_counts(),
+            "throttling": throttle_stats(),
+            "scheduler": scheduler_stats(),
+            "queues": queue_stats(),
+            "versions": version_stats(),
+        }
+    )
+
+
 def evaluations(request):
     if request.method == "GET":
         return render(request, "evaluations.html")
@@ -151,7 +251,9 @@ def fetch_evaluations(request):
                     "title": evaluation.title,
                     "enabled_models": evaluation.enabled_models,
                     "created_at": evaluation.created_at,
-                    "num_rows": Row.objects.filter(evaluation=evaluation).count()
+                    "num_rows": evaluation.num_rows,
+                    "completed": is_completed(evaluation),
+                    "progress": evaluation_progress(evaluation),
                 }
                 evaluations.append(eval_data)
 
@@ -165,6 +267,45 @@ def fetch_evaluations(request):
     return JsonResponse({"error": "Method not allowed"}, status=405)
 
 
+@csrf_exempt
+def api_leaderboard(request):
+    """Rank gen_model (or label, with "group": "label:<key>") values by each
+    metric across all evaluations of an API key."""
+    if request.method != "POST":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+
+    api_key = data.get("api_key")
+    if not api_key:
+        return JsonResponse({"error": "API key is required"}, status=400)
+
+    group = data.get("group", "gen_model")
+    if group != "gen_model" and not group.startswith("label:"):
+        return JsonResponse(
+            {"error": 'group must be "gen_model" or "label:<key>"'}, status=400
+        )
+
+    try:
+        min_count = int(data.get("min_count", 1))
+    except (TypeError, ValueError):
+        return JsonResponse({"error": "min_count must be an integer"}, status=400)
+    if min_count < 1:
+        return JsonResponse({"error": "min_count must be at least 1"}, status=400)
+
+    rankings = leaderboard(
+        hash_api_key(encrypt_key(api_key)),
+        group_key=group,
+        metric=data.get("metric"),
+        ascending=bool(data.get("ascending", False)),
+        min_count=min_count,
+    )
+    return JsonResponse({"group": group, "metrics": rankings})
+
+
 def results(request, eval_id):
     evaluation = Evaluation.objects.get(eval_id=eval_id)
     return render(
@@ -172,72 +313,199 @@ def results(request, eval_id):
     )
 
 
+def results_etag(request, eval_id):
+    """Changes whenever the evaluation's results change (see
+    invalidate_results), so an unchanged evaluation can be answered with
+    304 Not Modified.
+
+    The delta cursor is left out: every response carries a new one, and a
+    viewer holding the current version has no changes to fetch since any
+    cursor."""
+    if not Evaluation.objects.filter(eval_id=eval_id).exists():
+        return None
+
+    version = results_version(eval_id)
+    if version is None:
+        return None
+    query = request.GET.copy()
+    query.pop("since", None)
+    return hashlib.sha256(f"{version}:{query.urlencode()}".encode()).hexdigest()
+
+
+class InvalidResultsQuery(ValueError):
+    pass
+
+
+@condition(etag_func=results_etag)
 def api_results(request, eval_id):
+    """All rows of an evaluation, or with ?since=<cursor> only the rows with
+    images or scores changed since that cursor. Every response carries a
+    cursor for the next delta request.
+
+    ?q=<text> only returns rows whose prompt contains it, ?sort=<metric> (or
+    -<metric> for descending) orders rows by their mean score, and
+    ?limit=<n>&page=<n> returns one page of rows rather than all of them.
+    ?format=columnar returns "columns" (see columnar_rows) instead of "rows".
+
+    Responses are cached in Redis until the results change. Completed
+    evaluations no longer change, so browsers and CDNs may keep them too.
+    """
     evaluation = get_object_or_404(Evaluation, eval_id=eval_id)
 
-    rows = (
-        Row.objects.filter(evaluation=evaluation)
-        .order_by("id")
-        .prefetch_related(
-            Prefetch(
-                "examples",
-                queryset=Example.objects.order_by("id"),
-                to_attr="ordered_examples",
+    try:
+        if request.GET.get("since"):
+            # Every viewer has its own cursor, so deltas are not worth caching
+            body, completed = build_results(request, evaluation)
+        else:
+            body, completed = cached_results(
+                eval_id,
+                request.GET.urlencode(),
+                lambda: build_results(request, evaluation),
             )
+    except InvalidResultsQuery as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    response = HttpResponse(body, content_type="application/json")
+    if completed:
+        response["Cache-Control"] = (
+            f"public, max-age={settings.RESULTS_COMPLETED_MAX_AGE}, immutable"
         )
-    )
+    else:
+        response["Cache-Control"] = "public, no-cache"
+    return response
+
+
+def build_results(request, evaluation: Evaluation) -> tuple[bytes, bool]:
+    """The api_results response body, and whether the evaluation has
+    completed."""
+    response_format = request.GET.get("format", "rows")
+    if response_format not in ("rows", "columnar"):
+        raise InvalidResultsQuery("Unknown format")
 
-    # Fetch all ModelScores for this evaluation in one query
+    # Overlap consecutive deltas so that writes which committed after the
+    # previous request, but were stamped before it, are not missed
+    cursor = timezone.now() - timedelta(seconds=settings.RESULTS_CURSOR_OVERLAP)
+
+    rows = Row.objects.filter(evaluation=evaluation)
     model_scores = ModelScore.objects.filter(evaluation=evaluation)
 
-    # Create a dictionary for fast lookup
-    score_lookup = {}
-    for score in model_scores:
-        score_lookup.setdefault(score.image_url, {})[score.model] = score
+    search = request.GET.get("q", "").strip()
+    if search:
+        rows = search_rows(rows, search)
+
+    sort = request.GET.get("sort")
+    if sort:
+        metric = sort.removeprefix("-")
+        if metric not in evaluation.enabled_models:
+            raise InvalidResultsQuery(f"Unknown sort metric {metric}")
+        rows = sort_rows(rows, metric, descending=sort.startswith("-"))
+    else:
+        rows = rows.order_by("id")
+
+    since = request.GET.get("since")
+    if since:
+        try:
+            since = datetime.fromtimestamp(float(since), tz=dt_timezone.utc)
+        except (ValueError, OverflowError):
+            raise InvalidResultsQuery("Invalid cursor")
+
+        changed_examples = Example.objects.filter(
+            row__evaluation=evaluation, updated_at__gt=since
+        ).values("row_id")
+        changed_scores = model_scores.filter(updated_at__gt=since).values(
+            "example__row_id"
+        )
+        rows = rows.filter(Q(id__in=changed_examples) | Q(id__in=changed_scores))
 
+    # Deltas are small already, so only full results are paginated
+    pagination = {}
+    limit = request.GET.get("limit")
+    if limit and not since:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise InvalidResultsQuery("Invalid limit")
+        limit = max(1, min(limit, settings.RESULTS_MAX_PAGE_SIZE))
+
+        paginator = Paginator(rows, limit)
+        page = paginator.get_page(request.GET.get("page"))
+        rows = page.object_list
+        pagination = {
+            "page": page.number,
+            "num_pages": paginator.num_pages,
+            "num_rows": paginator.count,
+        }
+
+    if since or search or pagination:
+        model_scores = model_scores.filter(example__row__in=rows.values("id"))
+
+    rows_data = serialize_rows(evaluation, rows, model_scores)
+    if response_format == "columnar":
+        rows_data = {"columns": columnar_rows(rows_data, evaluation.enabled_models)}
+    else:
+        rows_data = {"rows": rows_data}
+
+    completed = evaluation_completed(evaluation)
     results = {
-        "rows": [],
+        **rows_data,
         "enabled_models": evaluation.enabled_models,
-        "completed": True,
+        "completed": completed,
+        "progress": evaluation_progress(evaluation),
         "title": evaluation.title,
+        "cursor": str(cursor.timestamp()),
+        "delta": bool(since),
+        **pagination,
     }
+    return json.dumps(results, cls=DjangoJSONEncoder).encode(), completed
 
-    for row in rows:
-        row_data = {"prompt": row.prompt, "seed": row.seed, "images": []}
-
-        for index, example in enumerate(row.ordered_examples):
-            if not example.image_url:
-                results["completed"] = False
 
-            image_data = {
-                "url": example.image_url,
-                "labels": example.labels,
-                "scores": {},
-                "gen_prediction_id": example.gen_prediction_id,
-                "gen_model": example.gen_model,
-            }
+def api_summary(request, eval_id):
+    evaluation = get_object_or_404(Evaluation, eval_id=eval_id)
+    return JsonResponse(
+        {
+            "evaluation_id": eval_id,
+            "metrics": evaluation_summary(evaluation),
+        }
+    )
 
-            for model in evaluation.enabled_models:
-                score = score_lookup.get(example.image_url, {}).get(model)
-                if score:
-                    if model == "DreamSim" and index > 0:
-                        if score.ref_image == row.ordered_examples[0].image_url:
-                            image_data["scores"][model] = score.score
-                        else:
-                            image_data["scores"][model] = None
-                            results["completed"] = False
-                    else:
-                        image_data["scores"][model] = score.score
-                else:
-                    image_data["scores"][model] = None
-                    if model != "DreamSim" or index > 0:
-                        results["completed"] = False
 
-            row_data["images"].append(image_data)
+async def results_events(request, eval_id):
+    evaluation = await Evaluation.objects.filter(eval_id=eval_id).afirst()
+    if evaluation is None:
+        return JsonResponse({"error": "Evaluation not found"}, status=404)
 
-        results["rows"].append(row_data)
+    # The stream only reads from Redis, so don't hold a database connection
+    # for as long as the viewer stays connected
+    await sync_to_async(connections.close_all)()
 
-    return JsonResponse(results)
+    response = StreamingHttpResponse(
+        stream_results(eval_id), content_type="text/event-stream"
+    )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+async def export_results(request, eval_id):
+    """Every image of an evaluation with its prompt, labels and scores, as
+    ?format=csv (the default), jsonl or parquet. Streamed, so memory use
+    does not grow with the size of the evaluation."""
+    export_format = request.GET.get("format", "csv")
+    if export_format not in EXPORT_FORMATS:
+        return JsonResponse({"error": "Unknown format"}, status=400)
+
+    evaluation = await Evaluation.objects.filter(eval_id=eval_id).afirst()
+    if evaluation is None:
+        return JsonResponse({"error": "Evaluation not found"}, status=404)
+
+    response = StreamingHttpResponse(
+        aexport_chunks(evaluation, export_format),
+        content_type=EXPORT_FORMATS[export_format],
+    )
+    response["Content-Disposition"] = (
+        f'attachment; filename="{eval_id}.{export_format}"'
+    )
+    return response
 
 
 def api_docs(request):
@@ -257,7 +525,3 @@ def get_prompts(prompt_dataset, custom_prompts):
         return custom_prompts.splitlines()
     else:
         raise ValueError("Invalid prompt dataset")
-
-
-def hash_api_key(api_key):
-    return hashlib.sha256(api_key.encode()).hexdigest()
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.signing import Signer
+from django.urls import reverse
+
+signer = Signer(salt="replicate-webhook")
+
+
+def webhook_url(prediction_pk: int) -> str | None:
+    """Signed completion webhook URL for a tracked prediction, or None if
+    webhooks are not configured (predictions are then polled)."""
+    if not settings.REPLICATE_WEBHOOK_BASE_URL:
+        return None
+
+    token = signer.sign(str(prediction_pk))
+    path = reverse("replicate_webhook", args=[token])
+    return settings.REPLICATE_WEBHOOK_BASE_URL.rstrip("/") + path
+
+
+def unsign_webhook_token(token: str) -> int:
+    return int(signer.unsign(token))
@@ -29,6 +29,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "app.middleware.CompressionMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -103,8 +104,142 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 CELERY_BROKER_URL = env("CELERY_BROKER_URL", default="redis://redis:6379/0")
 CELERY_RESULT_BACKEND = env("CELERY_RESULT_BACKEND", default="redis://redis:6379/0")
 
+# Redis for shared caches, separate database from the Celery broker
+REDIS_URL = env("REDIS_URL", default="redis://redis:6379/1")
+
+# Seconds to wait for more generated rows before evaluating a partial chunk
+ROW_LINGER_SECONDS = env.int("ROW_LINGER_SECONDS", default=10)
+# Seconds between checks for rows whose linger flush was lost
+ROW_FLUSH_TICK = 60
+
+# Examples of one model per generate_images task, and predictions created
+# concurrently by each task
+GENERATE_BATCH_SIZE = env.int("GENERATE_BATCH_SIZE", default=100)
+GENERATE_CONCURRENCY = env.int("GENERATE_CONCURRENCY", default=8)
+
+# Seconds to cache the latest version of a Replicate model
+VERSION_CACHE_TTL = env.int("VERSION_CACHE_TTL", default=300)
+
+# Replicate API clients, shared per API key within a worker process: how many
+# keys to keep clients for, and connections kept alive per client
+REPLICATE_CLIENT_CACHE_SIZE = env.int("REPLICATE_CLIENT_CACHE_SIZE", default=64)
+REPLICATE_POOL_SIZE = env.int("REPLICATE_POOL_SIZE", default=20)
+REPLICATE_KEEPALIVE_EXPIRY = env.int("REPLICATE_KEEPALIVE_EXPIRY", default=60)
+
+# Prediction creation budget per API key, shared by all workers: sustained
+# predictions per second, burst size, and predictions running at once (0 for
+# no limit). Slots of predictions that never report back are freed after
+# REPLICATE_INFLIGHT_TTL seconds. Tasks over budget are deferred, by
+# REPLICATE_THROTTLE_RETRY_DELAY seconds if too many predictions are running.
+REPLICATE_RATE_LIMIT = env.float("REPLICATE_RATE_LIMIT", default=10)
+REPLICATE_RATE_BURST = env.int("REPLICATE_RATE_BURST", default=50)
+REPLICATE_MAX_INFLIGHT = env.int("REPLICATE_MAX_INFLIGHT", default=500)
+REPLICATE_INFLIGHT_TTL = env.int("REPLICATE_INFLIGHT_TTL", default=60 * 60)
+REPLICATE_THROTTLE_RETRY_DELAY = env.int("REPLICATE_THROTTLE_RETRY_DELAY", default=10)
+
+# Replicate webhooks. Public base URL of this app, e.g. https://img-quality-eval.onrender.com.
+# If unset, predictions are polled instead.
+REPLICATE_WEBHOOK_BASE_URL = env("REPLICATE_WEBHOOK_BASE_URL", default="")
+# With webhooks, predictions are only polled every this many seconds as a fallback
+PREDICTION_SWEEP_INTERVAL = env.int("PREDICTION_SWEEP_INTERVAL", default=300)
+
+# Centralized prediction poller
+PREDICTION_POLL_TICK = env.int("PREDICTION_POLL_TICK", default=5)
+# (max prediction age, poll interval) in seconds, then PREDICTION_POLL_MAX_INTERVAL
+PREDICTION_POLL_INTERVALS = [(60, 5), (600, 15), (3600, 60)]
+PREDICTION_POLL_MAX_INTERVAL = 300
+PREDICTION_POLL_BATCH_SIZE = env.int("PREDICTION_POLL_BATCH_SIZE", default=1000)
+PREDICTION_POLL_LEASE = 120
+# Seconds before a prediction that was never created on Replicate, because
+# the task creating it crashed, is created again
+PREDICTION_CREATE_TIMEOUT = 600
+# Use the prediction list endpoint when an API key has this many due predictions
+PREDICTION_POLL_LIST_THRESHOLD = 10
+PREDICTION_POLL_MAX_PAGES = 10
+
+# Polling, prediction creation, output transfers and database writes run on
+# separate queues, each served by its own workers (see docker-compose.yaml),
+# so that e.g. slow transfers do not hold up polling. Other tasks go to the
+# default queue, which the database writes workers also serve.
+CELERY_TASK_DEFAULT_QUEUE = "celery"
+CELERY_TASK_ROUTES = {
+    "app.tasks.poll_predictions": {"queue": "polling"},
+    "app.tasks.generate_image": {"queue": "predictions"},
+    "app.tasks.generate_images": {"queue": "predictions"},
+    "app.tasks.evaluate_chunk": {"queue": "predictions"},
+    "app.scheduler.run_job": {"queue": "predictions"},
+    "app.tasks.transfer_output": {"queue": "transfers"},
+    "app.tasks.handle_prediction_webhook": {"queue": "db"},
+    "app.tasks.flush_completed_rows": {"queue": "db"},
+    "app.tasks.flush_stranded_rows": {"queue": "db"},
+    "app.scheduler.dispatch_jobs": {"queue": "db"},
+}
+
+# Fair-share scheduling of generation and evaluation jobs (see
+# app/scheduler.py): jobs handed to Celery at once, which should be about the
+# total worker concurrency, seconds before a running job's slot is reclaimed
+# if it never finishes, the size in examples of evaluations that are served
+# first, and how many of their jobs run in a row before one of a larger
+# evaluation's
+SCHEDULER_MAX_DISPATCHED = env.int("SCHEDULER_MAX_DISPATCHED", default=16)
+SCHEDULER_JOB_LEASE = env.int("SCHEDULER_JOB_LEASE", default=600)
+SCHEDULER_SMALL_EVALUATION_SIZE = env.int(
+    "SCHEDULER_SMALL_EVALUATION_SIZE", default=500
+)
+SCHEDULER_SMALL_BURST = env.int("SCHEDULER_SMALL_BURST", default=3)
+SCHEDULER_TICK = 5
+
+CELERY_BEAT_SCHEDULE = {
+    "poll-predictions": {
+        "task": "app.tasks.poll_predictions",
+        "schedule": PREDICTION_POLL_TICK,
+    },
+    "dispatch-jobs": {
+        "task": "app.scheduler.dispatch_jobs",
+        "schedule": SCHEDULER_TICK,
+    },
+    "flush-stranded-rows": {
+        "task": "app.tasks.flush_stranded_rows",
+        "schedule": ROW_FLUSH_TICK,
+    },
+}
+
 # AWS
 AWS_ACCESS_KEY_ID = env("AWS_ACCESS_KEY_ID", default="")
 AWS_SECRET_ACCESS_KEY = env("AWS_SECRET_ACCESS_KEY", default="")
-AWS_ENDPOINT_URL_S3 = "https://fly.storage.tigris.dev"
-AWS_REGION = "auto"
+AWS_ENDPOINT_URL_S3 = env(
+    "AWS_ENDPOINT_URL_S3", default="https://fly.storage.tigris.dev"
+)
+AWS_REGION = env("AWS_REGION", default="auto")
+# Bucket of cached generated images, and the public URL they are served from,
+# by default the bucket's path on the S3 endpoint
+CACHE_BUCKET = env("CACHE_BUCKET", default="img-quality-eval")
+CACHE_PUBLIC_URL = env(
+    "CACHE_PUBLIC_URL", default=f"{AWS_ENDPOINT_URL_S3.rstrip('/')}/{CACHE_BUCKET}"
+).rstrip("/")
+
+# Transfers of generated outputs into the cache bucket
+# Concurrent transfers per worker process
+TRANSFER_CONCURRENCY = env.int("TRANSFER_CONCURRENCY", default=8)
+# Multipart part size and concurrent parts per transfer
+TRANSFER_CHUNK_SIZE = env.int("TRANSFER_CHUNK_SIZE", default=8 * 1024 * 1024)
+TRANSFER_PART_CONCURRENCY = env.int("TRANSFER_PART_CONCURRENCY", default=2)
+
+# Results API: consecutive ?since= deltas overlap by this many seconds so
+# that slow-committing writes are not missed
+RESULTS_CURSOR_OVERLAP = 30
+# Server-sent results events: updates buffered per viewer before it is asked
+# to resync, and seconds between keepalive comments
+RESULTS_EVENTS_QUEUE_SIZE = 100
+RESULTS_EVENTS_KEEPALIVE = 15
+
+# Largest ?limit= page of the results API
+RESULTS_MAX_PAGE_SIZE = 500
+# Serialized results responses are cached in Redis for this many seconds,
+# unless larger than RESULTS_CACHE_MAX_SIZE bytes
+RESULTS_CACHE_TTL = env.int("RESULTS_CACHE_TTL", default=60 * 60)
+RESULTS_CACHE_MAX_SIZE = env.int("RESULTS_CACHE_MAX_SIZE", default=5 * 1024 * 1024)
+# Browsers and CDNs may keep the results of completed evaluations this long
+RESULTS_COMPLETED_MAX_AGE = env.int(
+    "RESULTS_COMPLETED_MAX_AGE", default=7 * 24 * 60 * 60
+)